@@ -0,0 +1,85 @@
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data import Dataset
+from torch.utils.data import DistributedSampler
+from Spatial_CNN import Spatial_CNN
+from Temporal_CNN import Temporal_CNN
+
+# Input shapes (without batch dimension) of the two streams
+INPUT_SHAPES = {"spatial": (3, 216, 216), "temporal": (18, 216, 216)}
+
+# Number of random samples of the synthetic dataset (split between the workers)
+SYNTHETIC_SAMPLES = 256
+
+
+class SyntheticDataset(Dataset):
+    # random inputs, to benchmark the training throughput without decoding
+    def __init__(self, input_shape, n_classes, length=SYNTHETIC_SAMPLES):
+        self.input_shape = input_shape
+        self.class_names = [str(idx) for idx in range(n_classes)]
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        return torch.rand(self.input_shape, generator=generator), idx % len(self.class_names)
+
+
+def init_distributed():
+    # join the process group from the environment set by `distributed.py` (or torchrun), a
+    # single worker if not launched
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    os.environ.setdefault("MASTER_PORT", "12345")
+    os.environ.setdefault("RANK", "0")
+    os.environ.setdefault("WORLD_SIZE", "1")
+    dist.init_process_group(backend="gloo")
+    return dist.get_rank(), dist.get_world_size()
+
+
+def train(stream, dataset, epochs=1, batch_size=16, lr=1e-3, pretrained=True):
+    """
+    Data-parallel training of one stream: every worker trains on its shard of the dataset and the
+    gradients are averaged between the workers (all-reduce over gloo) at every step.
+    """
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    n_classes = len(dataset.class_names)
+    if stream == "spatial":
+        model = Spatial_CNN(n_classes, pretrained=pretrained)
+    else:
+        model = Temporal_CNN(n_classes)
+    model = DistributedDataParallel(model)
+
+    # every worker gets the same number of samples, a different shard at every epoch
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True)
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler)
+    optimizer = torch.optim.Adam([param for param in model.parameters() if param.requires_grad], lr=lr)
+    criterion = nn.NLLLoss()
+
+    for epoch in range(epochs):
+        sampler.set_epoch(epoch)
+        model.train()
+        total_loss, num_samples = 0.0, 0
+        start_time = time.perf_counter()
+        for inputs, labels in loader:
+            optimizer.zero_grad()
+            # the streams output probabilities
+            loss = criterion(torch.log(model(inputs) + 1e-8), labels)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(labels)
+            num_samples += len(labels)
+
+        elapsed = time.perf_counter() - start_time
+        print(f"[worker {rank}/{world_size}] Epoch {epoch + 1}/{epochs} - loss: {total_loss / num_samples:.4f} - "
+              f"{num_samples / elapsed:.1f} samples/sec", flush=True)
+
+    return model.module
+
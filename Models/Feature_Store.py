@@ -0,0 +1,123 @@
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from Spatial_CNN import Spatial_CNN
+
+# Normalization of the ImageNet-pretrained ResNet-50 inputs (RGB)
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+FEATURE_DIM = 2048
+FEATURES_FILE = "features.f16"
+INDEX_FILE = "index.json"
+
+
+class Feature_Store:
+    """
+    Memory-mapped float16 store of the pooled 2048-d ResNet-50 features of a dataset, keyed by
+    clip/frame, so that the custom head of `Spatial_CNN` can be trained without running the frozen
+    backbone at every epoch.
+
+    The store is a folder with the raw (N, 2048) float16 features ("features.f16") and a JSON
+    index ("index.json") with the key and label of every row. It is built from the prepared clips
+    with `torch_models.py features`.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, INDEX_FILE)) as index_file:
+            index = json.load(index_file)
+
+        self.directory = directory
+        self.keys = index["keys"]
+        self.labels = np.array(index["labels"], dtype=np.int64)
+        self.feature_dim = index["feature_dim"]
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.features = np.memmap(os.path.join(directory, FEATURES_FILE), dtype=np.float16, mode="r",
+                                  shape=(len(self.keys), self.feature_dim))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, key):
+        # features of one clip/frame as float32, by key or by row
+        row = self.rows[key] if isinstance(key, str) else key
+        return torch.from_numpy(self.features[row].astype(np.float32))
+
+    def batch(self, rows):
+        # features (B, 2048) as float32 and labels (B,) of the given rows
+        rows = np.sort(rows)    # sorted rows read the memory-mapped file sequentially
+        features = torch.from_numpy(self.features[rows].astype(np.float32))
+        return features, torch.from_numpy(self.labels[rows])
+
+    @staticmethod
+    @torch.inference_mode()
+    def build(model: Spatial_CNN, samples, directory, batch_size=64):
+        """
+        Run the frozen backbone once over the samples and write their features to a new store.
+
+        :param model:
+            The Spatial_CNN model whose backbone gives the features
+        :param samples:
+            Iterable of (key, label, frame) with frames as (3, H, W) float tensors
+        :param directory:
+            Folder to create the store in
+        :param batch_size:
+            Number of frames per backbone forward pass
+        """
+        os.makedirs(directory, exist_ok=True)
+        model.eval()
+        keys, labels, frames = [], [], []
+
+        with open(os.path.join(directory, FEATURES_FILE), "wb") as features_file:
+            def flush():
+                features = model.extract_features(torch.stack(frames))
+                features.numpy().astype(np.float16).tofile(features_file)
+                frames.clear()
+
+            for key, label, frame in samples:
+                keys.append(key)
+                labels.append(int(label))
+                frames.append(frame)
+                if len(frames) == batch_size:
+                    flush()
+            if frames:
+                flush()
+
+        with open(os.path.join(directory, INDEX_FILE), "w") as index_file:
+            json.dump({"feature_dim": FEATURE_DIM, "keys": keys, "labels": labels}, index_file)
+
+        return Feature_Store(directory)
+
+
+def train_head(model: Spatial_CNN, store: Feature_Store, epochs=10, batch_size=256, lr=1e-3):
+    """Train the custom head of `Spatial_CNN` directly on the stored backbone features."""
+    head = model.model.fc
+    head.train()
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr)
+    criterion = nn.CrossEntropyLoss()
+
+    for epoch in range(epochs):
+        start_time = time.perf_counter()
+        order = np.random.permutation(len(store))
+        total_loss, correct = 0.0, 0
+        for start in range(0, len(order), batch_size):
+            features, labels = store.batch(order[start:start + batch_size])
+            optimizer.zero_grad()
+            logits = head(features)
+            loss = criterion(logits, labels)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(labels)
+            correct += (logits.argmax(dim=1) == labels).sum().item()
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Epoch {epoch + 1}/{epochs} - loss: {total_loss / len(store):.4f} - "
+              f"acc: {correct / len(store):.4f} - {elapsed:.2f}s")
+
+    head.eval()
+    return model
+
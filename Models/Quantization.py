@@ -0,0 +1,89 @@
+import copy
+import io
+import time
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization import quantize_dynamic as _quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx
+from torch.ao.quantization.quantize_fx import prepare_fx
+
+# quantized kernels for x86 CPUs (fbgemm/onednn), our inference hosts are CPU-only
+QUANTIZED_ENGINE = "x86"
+
+
+def quantize_dynamic(model):
+    # int8 weights for the Linear layers, activations quantized on the fly at every call
+    return _quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches, example_inputs):
+    # post-training static quantization (FX graph mode) of all supported layers, with the
+    # activation ranges observed on the calibration batches
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    prepared = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(QUANTIZED_ENGINE),
+                          example_inputs)
+    with torch.inference_mode():
+        for inputs, _ in calibration_batches:
+            prepared(inputs)
+    return convert_fx(prepared)
+
+
+def quantize_two_stream(model, spatial_calibration=None, temporal_calibration=None):
+    # quantize both streams of a Two_Stream model: statically if calibration batches are given for
+    # the stream, dynamically otherwise (the fusion stays in fp32)
+    model = copy.deepcopy(model).eval()
+    if spatial_calibration:
+        model.spatial_stream = quantize_static(model.spatial_stream, spatial_calibration,
+                                               (spatial_calibration[0][0],))
+    else:
+        model.spatial_stream = quantize_dynamic(model.spatial_stream)
+    if temporal_calibration:
+        model.temporal_stream = quantize_static(model.temporal_stream, temporal_calibration,
+                                                (temporal_calibration[0][0],))
+    else:
+        model.temporal_stream = quantize_dynamic(model.temporal_stream)
+    return model
+
+
+@torch.inference_mode()
+def evaluate(model, batches, reference=None):
+    # accuracy, agreement of the top-1 predictions with the reference model, and latency per batch
+    model.eval()
+    correct, agree, total, elapsed = 0, 0, 0, 0.0
+    model(batches[0][0])    # warm-up
+    for inputs, labels in batches:
+        start = time.perf_counter()
+        outputs = model(inputs)
+        elapsed += time.perf_counter() - start
+        predictions = outputs.argmax(dim=1)
+        correct += (predictions == labels).sum().item()
+        if reference is not None:
+            agree += (predictions == reference(inputs).argmax(dim=1)).sum().item()
+        total += len(labels)
+    return correct / total, (agree / total if reference is not None else 1.0), elapsed * 1000 / len(batches)
+
+
+def model_size_mb(model):
+    # size of the serialized state dict, serialized in memory
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1e6
+
+
+def report(model, calibration_batches, eval_batches):
+    # accuracy vs. latency of the dynamic and static int8 models against the fp32 model
+    model = model.eval()
+    example_inputs = (calibration_batches[0][0],)
+    variants = [
+        ("fp32", model),
+        ("int8 dynamic", quantize_dynamic(model)),
+        ("int8 static", quantize_static(model, calibration_batches, example_inputs)),
+    ]
+
+    print(f"{'model':<14}{'accuracy':>10}{'agreement':>11}{'latency (ms)':>14}{'size (MB)':>11}")
+    for name, variant in variants:
+        accuracy, agreement, latency = evaluate(variant, eval_batches, reference=model)
+        print(f"{name:<14}{accuracy:>10.4f}{agreement:>11.4f}{latency:>14.1f}{model_size_mb(variant):>11.1f}")
+
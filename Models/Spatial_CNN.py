@@ -2,17 +2,22 @@ import torch
 import torch.nn as nn
 import torchvision
 import torch.nn.functional as F
+from Weight_Registry import load_pretrained
 
 # Repository to download the pretrained models from
 # repo = "pytorch/vision"
 
 
 class Spatial_CNN(nn.Module):
-    def __init__(self, N_Classes ):
+    def __init__(self, N_Classes, pretrained=True, weights_dir=None):
         super(Spatial_CNN, self).__init__()
 
-        # use resnet50 pretrained on imagenet as our base model
-        self.model = torchvision.models.resnet50(pretrained=True)
+        # use resnet50 pretrained on imagenet as our base model, loaded from the local weight
+        # registry (no download), built on the meta device to skip initializing overwritten layers
+        if pretrained:
+            self.model = load_pretrained("resnet50", weights_dir)
+        else:
+            self.model = torchvision.models.resnet50(weights=None)
 
         # freeze pretrained layer
         for layer in self.model.parameters():
@@ -37,6 +42,32 @@ class Spatial_CNN(nn.Module):
         x = self.model(input)
         return F.softmax(x, dim=1)
 
+    def extract_features(self, input):
+        # pooled output of the frozen ResNet-50 backbone, (B, 3, H, W) -> (B, 2048)
+        m = self.model
+        x = m.maxpool(m.relu(m.bn1(m.conv1(input))))
+        x = m.layer4(m.layer3(m.layer2(m.layer1(x))))
+        return torch.flatten(m.avgpool(x), 1)
+
+    def forward_head(self, features):
+        # same output as `forward`, from the features given by `extract_features`
+        x = self.model.fc(features)
+        return F.softmax(x, dim=1)
+
+    @torch.inference_mode()
+    def forward_window(self, frames, frame_ids, cache):
+        # class scores (1, N_Classes) of a window of live frames (T, 3, H, W), averaged over its
+        # frames. The backbone features of the frames are kept in `cache` (dict by frame id), so
+        # that overlapping windows only run the backbone on their new frames
+        missing = [idx for idx, frame_id in enumerate(frame_ids) if frame_id not in cache]
+        if missing:
+            for idx, features in zip(missing, self.extract_features(frames[missing])):
+                cache[frame_ids[idx]] = features
+        for frame_id in [frame_id for frame_id in cache if frame_id not in frame_ids]:
+            del cache[frame_id]
+        features = torch.stack([cache[frame_id] for frame_id in frame_ids])
+        return self.forward_head(features).mean(dim=0, keepdim=True)
+
 
 if __name__ == "__main__":
     input_shape = (10, 3, 216, 216 )    # (Batches, Channel, Height, Width)
@@ -1,25 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
 import torch
 import torch.nn as nn
-import torchvision
-import torch.nn.functional as F
 from Spatial_CNN import Spatial_CNN
 from Temporal_CNN import Temporal_CNN
+from Weight_Registry import build_with_weights
+from Weight_Registry import load_state_dict
+from Weight_Registry import save_state_dict
+
+# Late fusion methods of the spatial and temporal class scores
+FUSION_METHODS = ("average", "svm")
 
 
 class Two_Stream(nn.Module):
-    def __init__(self, N_Classes, spatial_weights=None, temporal_weights=None):
+    def __init__(self, N_Classes, spatial_weights=None, temporal_weights=None,
+                 fusion="average", fusion_weights=(1.0, 1.0), svm_weights=None):
         super(Two_Stream, self).__init__()
 
-        self.spatial_stream = Spatial_CNN(N_Classes)
-        self.temporal_stream = Temporal_CNN(N_Classes)
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f"Unknown fusion method \"{fusion}\", expected one of {FUSION_METHODS}")
+        if fusion == "svm" and svm_weights is None:
+            raise ValueError("The SVM fusion needs its trained weights (svm_weights), see `train_svm_fusion`")
 
+        # trained weights replace every parameter, so those streams are built without initialization
         if spatial_weights is not None:
             # TODO: check it exception and path safety
-            self.spatial_stream.load_state_dict(torch.load(spatial_weights))
+            self.spatial_stream = build_with_weights(lambda: Spatial_CNN(N_Classes, pretrained=False),
+                                                     load_state_dict(spatial_weights))
+        else:
+            self.spatial_stream = Spatial_CNN(N_Classes)
 
         if temporal_weights is not None:
             # TODO: check it exception and path safety os.path exist
-            self.temporal_stream.load_state_dict(torch.load(temporal_weights))
+            self.temporal_stream = build_with_weights(lambda: Temporal_CNN(N_Classes),
+                                                      load_state_dict(temporal_weights))
+        else:
+            self.temporal_stream = Temporal_CNN(N_Classes)
 
         # freeze all weights, the two models have been trained separately
         for layer in self.spatial_stream.parameters():
@@ -28,6 +45,25 @@ class Two_Stream(nn.Module):
         for layer in self.temporal_stream.parameters():
             layer.requires_grad = False
 
+        # Weighted average: per-stream weights, normalized to sum to 1
+        self.fusion = fusion
+        weights = torch.tensor(fusion_weights, dtype=torch.float32)
+        self.register_buffer("fusion_weights", weights / weights.sum())
+
+        # SVM fusion: linear classifier over the stacked class scores of both streams, trained by
+        # `train_svm_fusion` while the streams are frozen
+        self.svm = None
+        if fusion == "svm":
+            self.svm = build_with_weights(lambda: nn.Linear(in_features=2 * N_Classes, out_features=N_Classes),
+                                          load_state_dict(svm_weights))
+
+    def fuse(self, x, y):
+        # x, y - class scores of the spatial and temporal streams (B, N_Classes)
+        # Fusion is done per sample, i.e. never across the batch dimension
+        if self.fusion == "svm":
+            return self.svm(torch.cat((x, y), dim=1))
+        return self.fusion_weights[0] * x + self.fusion_weights[1] * y
+
     def forward(self, x, y):
         # x - input to spatial stream (B, 3, 216, 216)
         # y - input to temporal stream (B, 18, 216, 216)
@@ -35,18 +71,118 @@ class Two_Stream(nn.Module):
         x = self.spatial_stream(x)
         y = self.temporal_stream(y)
 
-        # Average
-        x = torch.cat((x, y), dim=0).mean(dim=0)
+        return self.fuse(x, y)
+
+
+def train_svm_fusion(model, batches, svm_weights, epochs=50, lr=1e-2, weight_decay=1e-4):
+    """
+    Train the SVM fusion of a two-stream model: a linear classifier over the stacked class scores of
+    the frozen streams, with a multi-class hinge loss (`nn.MultiMarginLoss`) and an L2 penalty.
+
+    :param model:
+        The Two_Stream model with the trained streams
+    :param batches:
+        Iterable of (spatial input, temporal input, labels) batches
+    :param svm_weights:
+        Path to save the trained weights to, loaded with `Two_Stream(..., fusion="svm", svm_weights=...)`
+    :param epochs:
+        Number of (full batch) passes over the stream scores
+    :param lr:
+        Learning rate of the SGD optimizer
+    :param weight_decay:
+        L2 penalty on the classifier weights (the margin of the SVM)
+    :return:
+        The trained linear classifier
+    """
+    model.eval()
+
+    # The streams are frozen, so their scores are computed once
+    scores, labels = [], []
+    with torch.inference_mode():
+        for spatial_input, temporal_input, batch_labels in batches:
+            scores.append(torch.cat((model.spatial_stream(spatial_input), model.temporal_stream(temporal_input)), dim=1))
+            labels.append(batch_labels)
+    scores, labels = torch.cat(scores), torch.cat(labels)
+
+    svm = nn.Linear(in_features=scores.shape[1], out_features=scores.shape[1] // 2)
+    optimizer = torch.optim.SGD(svm.parameters(), lr=lr, momentum=0.9, weight_decay=weight_decay)
+    criterion = nn.MultiMarginLoss()
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        outputs = svm(scores)
+        loss = criterion(outputs, labels)
+        loss.backward()
+        optimizer.step()
+    accuracy = (outputs.argmax(dim=1) == labels).float().mean().item()
+    print(f"SVM fusion - loss: {loss.item():.4f} - acc: {accuracy:.4f} on {len(labels)} clips")
+
+    save_state_dict(svm.state_dict(), svm_weights)
+    return svm
+
 
-        return x
+class Two_Stream_Inference:
+    """
+    Batched inference engine running the spatial and temporal streams of a `Two_Stream` model
+    concurrently, each on its own thread (PyTorch releases the GIL inside its operators), before
+    fusing their scores per sample.
+    """
+
+    def __init__(self, model: Two_Stream, concurrent: bool = True):
+        self.model = model.eval()
+        self.concurrent = concurrent
+        self.pool = ThreadPoolExecutor(max_workers=2) if concurrent else None
+
+    @torch.inference_mode()
+    def predict(self, spatial_input, temporal_input):
+        # spatial_input (B, 3, 216, 216), temporal_input (B, 18, 216, 216) -> fused scores (B, N)
+        if self.pool is None:
+            x = self.model.spatial_stream(spatial_input)
+            y = self.model.temporal_stream(temporal_input)
+        else:
+            # Inference mode is thread-local, so it is enabled again on the worker threads
+            spatial_future = self.pool.submit(_run_stream, self.model.spatial_stream, spatial_input)
+            temporal_future = self.pool.submit(_run_stream, self.model.temporal_stream, temporal_input)
+            x, y = spatial_future.result(), temporal_future.result()
+
+        return self.model.fuse(x, y)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def _run_stream(stream, inputs):
+    with torch.inference_mode():
+        return stream(inputs)
+
+
+def benchmark(model, batch_sizes=(1, 2, 4, 8), iterations=10, concurrent=True):
+    """Print the two-stream inference throughput in clips/sec for every batch size."""
+    engine = Two_Stream_Inference(model, concurrent=concurrent)
+    print(f"Two-Stream inference ({'concurrent' if concurrent else 'sequential'} streams)")
+    for batch_size in batch_sizes:
+        spatial_input = torch.rand((batch_size, 3, 216, 216))
+        temporal_input = torch.rand((batch_size, 18, 216, 216))
+
+        # Warm-up
+        engine.predict(spatial_input, temporal_input)
+
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            engine.predict(spatial_input, temporal_input)
+        elapsed = time.perf_counter() - start_time
+        print(f"    batch size {batch_size:3d} : {batch_size * iterations / elapsed:8.2f} clips/sec")
+    engine.close()
 
 
 if __name__ == "__main__":
-    a  = torch.rand((1, 10))
-    b  = torch.rand((1, 10))
-    print(a)
-    print(b)
-    c = torch.cat([a, b], dim=0)
-    print(c)
-
-    print(c.mean(dim=0))
+    N_CLASSES = 101     # Number of classes for UCF-101 dataset
+    two_stream = Two_Stream(N_CLASSES)
+
+    # Fusion is per sample, so every sample of the batch gets its own fused scores
+    a = torch.rand((4, 3, 216, 216))
+    b = torch.rand((4, 18, 216, 216))
+    print(Two_Stream_Inference(two_stream).predict(a, b).shape)
+
+    benchmark(two_stream, concurrent=False)
+    benchmark(two_stream, concurrent=True)
@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+import torch
+import torchvision
+
+# Local folder with the pretrained checkpoints, so that models can be built on nodes without
+# network access. Override with the MODEL_WEIGHTS_DIR environment variable.
+WEIGHTS_DIR = os.environ.get("MODEL_WEIGHTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights"))
+
+# Pretrained checkpoints known by the registry: name -> (model builder, checkpoint file, torchvision weights)
+REGISTRY = {
+    "resnet50": (torchvision.models.resnet50, "resnet50-0676ba61.pth",
+                 torchvision.models.ResNet50_Weights.IMAGENET1K_V1),
+}
+
+
+def weights_path(name, weights_dir=None):
+    # path of the local checkpoint of a registered model
+    if name not in REGISTRY:
+        raise KeyError(f"Unknown pretrained model \"{name}\", expected one of {list(REGISTRY)}")
+
+    path = os.path.join(weights_dir or WEIGHTS_DIR, REGISTRY[name][1])
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Pretrained weights \"{path}\" not found. Run `python Weight_Registry.py "
+                                f"fetch {name}` on a machine with network access and copy the file over.")
+    return path
+
+
+def load_state_dict(path):
+    # memory-map the checkpoint instead of reading it all, tensors are paged in when used
+    return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def save_state_dict(state_dict, path):
+    # checkpoint loadable with `load_state_dict`
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    torch.save(state_dict, path)
+
+
+def build_with_weights(builder, state_dict):
+    # build the model on the meta device (no memory allocation nor random initialization), then
+    # use the checkpoint tensors as its parameters directly
+    with torch.device("meta"):
+        model = builder()
+    model.load_state_dict(state_dict, assign=True)
+    return model
+
+
+def load_pretrained(name, weights_dir=None):
+    # registered model with its pretrained weights, from the local weights folder only
+    builder = REGISTRY[name][0]
+    return build_with_weights(lambda: builder(weights=None), load_state_dict(weights_path(name, weights_dir)))
+
+
+def fetch(name, weights_dir=None):
+    # download a registered checkpoint into the weights folder (needs network access)
+    weights_dir = weights_dir or WEIGHTS_DIR
+    os.makedirs(weights_dir, exist_ok=True)
+    path = os.path.join(weights_dir, REGISTRY[name][1])
+    torch.save(REGISTRY[name][2].get_state_dict(progress=True), path)
+    print(f"Saved \"{name}\" weights to {path}")
+
+
+def startup_benchmark(n_classes=101):
+    # cold-start time of Spatial_CNN with eager initialization vs. meta-device + memory-mapped weights
+    from Spatial_CNN import Spatial_CNN
+
+    path = weights_path("resnet50")
+
+    start = time.perf_counter()
+    model = Spatial_CNN(n_classes, pretrained=False)
+    model.model.load_state_dict({k: v for k, v in torch.load(path, map_location="cpu").items()
+                                 if not k.startswith("fc.")}, strict=False)
+    eager = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Spatial_CNN(n_classes, pretrained=True)
+    fast = time.perf_counter() - start
+
+    print(f"Spatial_CNN cold start")
+    print(f"    eager init + torch.load       : {eager * 1000:8.1f} ms")
+    print(f"    meta device + mmap weights    : {fast * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    # python Weight_Registry.py fetch resnet50
+    # python Weight_Registry.py benchmark
+    if len(sys.argv) > 2 and sys.argv[1] == "fetch":
+        fetch(sys.argv[2])
+    else:
+        startup_benchmark()
@@ -2,24 +2,37 @@
 Script to run the selected data augmentation techniques and create a new augmented data-set.
 
 Usage:
+    augment_dataset.py [--config=PATH] [--headless]
     augment_dataset.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
-from PyInquirer import prompt
+from docopt import docopt
+import importlib
 import os
 import shutil
 
+from cli import ask
+from cli import load_config
 from constants import AUGMENTATION_METHODS
 from constants import TEST_PATH_IN
 from constants import TEST_PATH_OUT
 from constants import TEST_TARGET_FPS
 from constants import VIDEO_EXT
+from profiling import count
+from profiling import profile_run
+from profiling import stage
 
-from blur_video import blur_video
-from convert_to_gray import convert_to_gray
-from downsize_video import parse_video
-from flip_video import flip_video
-from invert_color import invert_color
+# Module and function of every augmentation method, imported on first use
+AUGMENTATIONS = {
+    "blurred": ("blur_video", "blur_video"),
+    "flipped": ("flip_video", "flip_video"),
+    "grayscale": ("convert_to_gray", "convert_to_gray"),
+    "inv_color": ("invert_color", "invert_color"),
+}
 
 
 def augment_dataset(path_in: str,
@@ -36,31 +49,29 @@ def augment_dataset(path_in: str,
         The type of augmentation method to be used
     """
 
-    if method.lower() == "blurred":         # Blur video, and save
-        blur_video(path_in, path_out)
-    elif method.lower() == "inv_color":     # Invert colors of video, and save
-        invert_color(path_in, path_out)
-    elif method.lower() == "flipped":       # Flip video horizontally, and save
-        flip_video(path_in, path_out)
-    else:                                   # Convert video to grayscale, and save
-        convert_to_gray(path_in, path_out)
+    # Unknown methods convert the video to grayscale, as before
+    module_name, function_name = AUGMENTATIONS.get(method.lower(), AUGMENTATIONS["grayscale"])
+    augmentation = getattr(importlib.import_module(module_name), function_name)
+    augmentation(path_in, path_out)
 
 
 def main():
     """Main body of the script to be run."""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="augment_dataset")
 
-    answer_path_in = prompt({
+    answer_path_in = ask({
         'type': 'input',
         'name': 'path_in',
         'message': 'Enter the path to the videos directory: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_in = answer_path_in['path_in']
     if not os.path.isdir(path_in):
         print(f"    [ERROR]\tThe folder \"{path_in}\" doesn't exist.")
         return
 
-    answer_is_dir = prompt({
+    answer_is_dir = ask({
         'type': 'list',
         'name': 'is_dir',
         'message': 'Do you wish to process the complete folder or selected videos?',
@@ -68,34 +79,34 @@ def main():
             'Complete Folder',
             'Select Videos'
         ]
-    })
+    }, config)
     is_dir = answer_is_dir['is_dir'] == "Complete Folder"
 
     if is_dir:
         file_names = os.listdir(path_in)
     else:
-        answer_file_names = prompt({
+        answer_file_names = ask({
             'type': 'checkbox',
             'name': 'file_names',
             'message': 'Select the videos to invert colors of: ',
             'choices': [{'name': _file} for _file in os.listdir(path_in)]
-        })
+        }, config)
         file_names = answer_file_names['file_names']
 
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save the converted videos to: ',
         'default': TEST_PATH_OUT
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
-    answer_augmentation_methods = prompt({
+    answer_augmentation_methods = ask({
         'type': 'checkbox',
         'name': 'augmentation_methods',
         'message': 'Select the data augmentation methods to apply on raw videos.',
         'choices': [{'name': method} for method in AUGMENTATION_METHODS.keys()]
-    })
+    }, config)
     augmentation_methods = answer_augmentation_methods['augmentation_methods']
 
     os.makedirs(path_out, exist_ok=True)
@@ -104,7 +115,9 @@ def main():
     for _id, video in enumerate(file_names):
         print(f"    [INFO]\t({_id + 1}/{num_videos})\tProcessing video \"{video}\"")
         video_path = os.path.join(path_in, video)
-        shutil.copy(video_path, path_out)
+        with stage("io"):
+            shutil.copy(video_path, path_out)
+        count("io.bytes", os.path.getsize(video_path))
         for augmentation in augmentation_methods:
             method = AUGMENTATION_METHODS.get(augmentation)
             augmented_video_name = f"{video.split('.')[0]}_{method}{VIDEO_EXT}"
@@ -113,7 +126,7 @@ def main():
 
     print()
 
-    answer_downsize = prompt({
+    answer_downsize = ask({
         'type': 'list',
         'name': 'downsize',
         'message': 'Do you also want to downsize all the videos?',
@@ -121,10 +134,12 @@ def main():
             'YES',
             'NO'
         ]
-    })
+    }, config)
     do_downsize = True if answer_downsize['downsize'] == "YES" else False
 
     if do_downsize:
+        from downsize_video import parse_video
+
         downsize_path = os.path.join(path_out, "downsized_videos")
         os.makedirs(downsize_path, exist_ok=True)
 
@@ -142,4 +157,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("augment_dataset"):
+        main()
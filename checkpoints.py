@@ -0,0 +1,208 @@
+"""
+Periodic, asynchronous training checkpoints for `train_c3d.py`, to resume an interrupted training
+in seconds instead of starting over.
+
+A checkpoint holds everything needed to continue as if training was never stopped:
+
+    - the model weights and the optimizer state (e.g. the Adam moments)
+    - the number of completed epochs and the loss/accuracy history so far
+    - the Python, NumPy and TensorFlow random states
+    - the data loader position (seed and epoch of `VideoClipDataset`, see `set_epoch`)
+
+The state is copied to host memory at the end of an epoch, then written to disk on a background
+thread while the next epoch trains. Files are written to a temporary path and renamed once complete,
+so a crash while writing never leaves a corrupt latest checkpoint.
+
+Usage:
+    checkpoints.py <checkpoint_dir>
+    checkpoints.py (-h | --help)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import glob
+import os
+import pickle
+import random
+import time
+
+from docopt import docopt
+import keras
+import numpy as np
+
+CHECKPOINT_PREFIX = "ckpt-"
+CHECKPOINT_EXT = ".pkl"
+
+
+def _optimizer_variables(optimizer) -> list:
+    """Variables of the optimizer, with both the Keras 2 (method) and Keras 3 (property) APIs."""
+    variables = optimizer.variables
+    return list(variables() if callable(variables) else variables)
+
+
+def _build_optimizer(model):
+    """Create the optimizer variables (normally created lazily by the first training step)."""
+    optimizer = model.optimizer
+    if hasattr(optimizer, "build"):
+        optimizer.build(model.trainable_variables)
+    else:
+        optimizer._create_all_weights(model.trainable_variables)
+
+
+class CheckpointManager:
+    """Write and restore the training checkpoints of one training run."""
+
+    def __init__(self, directory: str, keep: int = 3):
+        """
+        :param directory:
+            Folder of the checkpoints
+        :param keep:
+            Number of most recent checkpoints to keep on disk
+        """
+        self.directory = directory
+        self.keep = keep
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+        os.makedirs(directory, exist_ok=True)
+
+    def checkpoints(self) -> list:
+        """Paths of the checkpoints on disk, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, f"{CHECKPOINT_PREFIX}*{CHECKPOINT_EXT}")))
+
+    def latest(self) -> Optional[str]:
+        """Path of the most recent checkpoint, None if there is none."""
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, model, epoch: int, history: dict, dataset=None):
+        """
+        Snapshot the training state and write it to disk in the background.
+
+        :param model:
+            The compiled model being trained
+        :param epoch:
+            Number of completed epochs
+        :param history:
+            The loss/accuracy history of all completed epochs
+        :param dataset:
+            The `VideoClipDataset` feeding the training, if any
+        """
+        import tensorflow as tf
+
+        # Copies taken now, as training goes on and updates the variables during the write
+        state = {
+            "epoch": epoch,
+            "history": {key: list(values) for key, values in history.items()},
+            "weights": model.get_weights(),
+            "optimizer": [variable.numpy() for variable in _optimizer_variables(model.optimizer)],
+            "python_rng": random.getstate(),
+            "numpy_rng": np.random.get_state(),
+            "tf_rng": tf.random.get_global_generator().state.numpy(),
+            "dataset": {"seed": dataset.seed, "epoch": epoch} if dataset is not None else None,
+        }
+
+        # One write at a time, a slow disk never piles up checkpoints in memory
+        self.wait()
+        self._pending = self.writer.submit(self._write, state)
+
+    def _write(self, state: dict):
+        path = os.path.join(self.directory, f"{CHECKPOINT_PREFIX}{state['epoch']:04d}{CHECKPOINT_EXT}")
+        with open(path + ".tmp", "wb") as checkpoint_file:
+            pickle.dump(state, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+        for old_path in self.checkpoints()[:-self.keep]:
+            os.remove(old_path)
+
+    def wait(self):
+        """Wait for the checkpoint being written, if any (raises its error if it failed)."""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def restore(self, model, dataset=None, path: Optional[str] = None) -> dict:
+        """
+        Restore the training state of a checkpoint.
+
+        :param model:
+            The compiled model, with the same architecture and optimizer as when saved
+        :param dataset:
+            The `VideoClipDataset` feeding the training, if any
+        :param path:
+            Path of the checkpoint, the latest one if None
+        :return:
+            The checkpoint state ("epoch" to continue from and "history" so far)
+        """
+        import tensorflow as tf
+
+        path = path or self.latest()
+        with open(path, "rb") as checkpoint_file:
+            state = pickle.load(checkpoint_file)
+
+        model.set_weights(state["weights"])
+        if state["optimizer"]:
+            _build_optimizer(model)
+            for variable, value in zip(_optimizer_variables(model.optimizer), state["optimizer"]):
+                variable.assign(value)
+
+        random.setstate(state["python_rng"])
+        np.random.set_state(state["numpy_rng"])
+        tf.random.get_global_generator().reset(state["tf_rng"])
+        if dataset is not None and state["dataset"] is not None:
+            dataset.seed = state["dataset"]["seed"]
+            dataset.set_epoch(state["dataset"]["epoch"])
+
+        return state
+
+    def close(self):
+        """Finish writing the last checkpoint."""
+        self.wait()
+        self.writer.shutdown()
+
+
+class CheckpointCallback(keras.callbacks.Callback):
+    """Save a checkpoint every `every` epochs, and keep the history of the whole training run."""
+
+    def __init__(self, manager: CheckpointManager, every: int = 1, history: Optional[dict] = None, dataset=None):
+        """
+        :param manager:
+            The checkpoint manager to save with
+        :param every:
+            Number of epochs between two checkpoints
+        :param history:
+            History of the epochs completed before this run (when resuming)
+        :param dataset:
+            The `VideoClipDataset` feeding the training, if any
+        """
+        super().__init__()
+        self.manager = manager
+        self.every = every
+        self.history = {key: list(values) for key, values in (history or dict()).items()}
+        self.dataset = dataset
+
+    def on_epoch_end(self, epoch, logs=None):
+        for key, value in (logs or dict()).items():
+            self.history.setdefault(key, []).append(float(value))
+        if (epoch + 1) % self.every == 0 or epoch + 1 == self.params.get("epochs"):
+            self.manager.save(self.model, epoch + 1, self.history, self.dataset)
+
+    def on_train_end(self, logs=None):
+        self.manager.wait()
+
+
+def main():
+    """Print the checkpoints of a training run."""
+    args = docopt(__doc__)
+    manager = CheckpointManager(args['<checkpoint_dir>'])
+    for path in manager.checkpoints():
+        start_time = time.perf_counter()
+        with open(path, "rb") as checkpoint_file:
+            state = pickle.load(checkpoint_file)
+        load_time = time.perf_counter() - start_time
+        last = {key: round(values[-1], 4) for key, values in state["history"].items() if values}
+        print(f"    [INFO]\t{os.path.basename(path)}\tepoch {state['epoch']}\t{last}\t(loaded in {load_time:.2f}s)")
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Non-interactive front end of the PyInquirer scripts, so that they can be scheduled, run on other
+machines or benchmarked with all their parameters explicit.
+
+Every script takes the same two options:
+
+    --config=PATH       YAML file with the answers to the prompts, by question name
+    --headless          Never prompt: the answers missing from the config take their default
+
+The config keys are the names of the questions (`path_in`, `target_fps`, `folder_names`, ...).
+One config file can hold the answers of several scripts: the top-level keys are shared, and a
+section named after a script overrides them for that script:
+
+    path_in: raw_videos
+    path_out: prepared
+    blur_video:
+        blur_intensity: HIGH
+        folder_names: [thumbs_up, wave]
+
+Questions asked once per folder or per split (`is_dir`, `file_names`, `fraction`) take either a
+single answer or a mapping by folder / split name:
+
+    fraction:
+        val: 0.15
+        test: 0.15
+
+In headless mode, an input or confirm question without answer takes its default, a list question
+its default (or first) choice, and a checkbox question (a selection) has to be answered in the
+config. Without `--headless`, the missing answers are prompted for as before. PyInquirer (and
+prompt-toolkit) is only imported when a prompt is actually shown, and PyYAML when a config is given.
+
+Usage:
+    cli.py <config_path> [<script>]
+    cli.py (-h | --help)
+"""
+
+from typing import Optional
+import os
+
+from docopt import docopt
+
+# Key of the headless flag in the loaded config
+HEADLESS = "headless"
+
+# Questions asked once per folder or per split, whose answer can be a mapping by folder / split name
+SCOPED_QUESTIONS = ("is_dir", "file_names", "fraction")
+
+
+def _fail(message: str):
+    raise SystemExit(f"    [ERROR]\t{message}")
+
+
+def load_config(path: Optional[str] = None, headless: bool = False, section: Optional[str] = None) -> dict:
+    """
+    Load the answers of a script from a YAML config file.
+
+    :param path:
+        Path to the YAML config file, or None for an empty config
+    :param headless:
+        Never prompt, even if the config file doesn't say so
+    :param section:
+        Name of the script, whose section of the config overrides the top-level answers
+    :return:
+        The answers by question name, with the headless flag
+    """
+    config = dict()
+    if path is not None:
+        import yaml
+
+        if not os.path.isfile(path):
+            _fail(f"The config file \"{path}\" doesn't exist.")
+        with open(path) as config_file:
+            config = yaml.safe_load(config_file) or dict()
+        if not isinstance(config, dict):
+            _fail(f"The config file \"{path}\" must be a mapping of question names to answers.")
+
+        # Keep the shared answers, without the sections of the scripts
+        answers = {key: value for key, value in config.items()
+                   if not isinstance(value, dict) or key in SCOPED_QUESTIONS}
+        if section is not None and isinstance(config.get(section), dict):
+            answers.update(config[section])
+        config = answers
+
+    config[HEADLESS] = bool(headless or config.get(HEADLESS, False))
+    return config
+
+
+def _choice_names(choices) -> list:
+    return [choice['name'] if isinstance(choice, dict) else choice for choice in choices]
+
+
+def _check_answer(question: dict, value):
+    """Convert an answer from the config to what the prompt would have returned, or fail."""
+    name, question_type = question['name'], question.get('type', 'input')
+
+    if question_type == 'confirm':
+        if not isinstance(value, bool):
+            _fail(f"The answer of \"{name}\" must be true or false, got {value!r}.")
+        return value
+
+    if question_type == 'checkbox':
+        values = value if isinstance(value, list) else [value]
+        choices = _choice_names(question['choices'])
+        unknown = [str(item) for item in values if str(item) not in choices]
+        if unknown:
+            _fail(f"Unknown choice(s) {unknown} for \"{name}\", expected some of {choices}.")
+        return [str(item) for item in values]
+
+    if question_type == 'list':
+        choices = _choice_names(question['choices'])
+        # YAML reads an unquoted Yes / No as a boolean
+        if isinstance(value, bool) and {'Yes', 'No'} <= set(choices):
+            value = 'Yes' if value else 'No'
+        if str(value) not in choices:
+            _fail(f"Unknown choice {value!r} for \"{name}\", expected one of {choices}.")
+        return str(value)
+
+    # The prompts return the text typed in, which the scripts convert themselves
+    return str(value)
+
+
+def ask(question: dict, config: Optional[dict] = None, scope: Optional[str] = None) -> dict:
+    """
+    Answer a PyInquirer question from the config, or prompt for it.
+
+    :param question:
+        The PyInquirer question (`type`, `name`, `message`, `default`, `choices`)
+    :param config:
+        The answers loaded by `load_config`, or None to always prompt
+    :param scope:
+        Folder or split name of a question asked several times, to pick its answer from a mapping
+    :return:
+        The answers by question name, as returned by `PyInquirer.prompt`
+    """
+    config = config or dict()
+    name = question['name']
+
+    value = config.get(name)
+    if isinstance(value, dict) and scope is not None:
+        value = value.get(scope)
+
+    if value is not None:
+        value = _check_answer(question, value)
+    elif config.get(HEADLESS):
+        question_type = question.get('type', 'input')
+        if question_type == 'checkbox':
+            _fail(f"No answer for \"{name}\"{f' ({scope})' if scope else ''} in the config (needed in headless mode).")
+        if 'default' in question:
+            value = question['default'] if question_type == 'confirm' else str(question['default'])
+        elif question_type == 'list':
+            value = _choice_names(question['choices'])[0]
+        else:
+            _fail(f"No answer for \"{name}\" in the config, and no default (needed in headless mode).")
+    else:
+        from PyInquirer import prompt
+        return prompt(question)
+
+    # Log the answers that weren't typed in, so that the output of a run shows its parameters
+    print(f"    [INFO]\t{question['message'].strip().rstrip(':?.').strip()}: {value}")
+    return {name: value}
+
+
+def main():
+    """Print the answers a script would read from a config file."""
+    args = docopt(__doc__)
+    config = load_config(args['<config_path>'], section=args['<script>'])
+    for name, value in config.items():
+        print(f"    [INFO]\t{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Sampling of fixed-length clips from videos of any length.
+
+A sampler only computes lists of frame indices (one list per clip), which are then either read into
+arrays (`read_clips`) for training, or written to new videos (`write_clips`) to generate a dataset
+offline. In both cases the source video is decoded only once, no matter how many clips are taken
+from it or how much they overlap.
+
+Videos shorter than the clip length are padded by repeating their first and last frames, the same
+way `preprocess_videos.pad_videos` always did.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from profiling import count
+from profiling import stage
+from video_codecs import open_writer
+from video_reader import FrameReader
+
+
+def _pad_indices(num_frames: int, clip_len: int) -> List[int]:
+    """Indices of a short video padded with its first and last frames to `clip_len` frames."""
+    if num_frames <= 0:
+        raise ValueError("Can't pad a video without frames")
+    diff = clip_len - num_frames
+    pad_to_start = diff // 2
+    pad_to_end = diff - diff // 2
+
+    return [0] * pad_to_start + list(range(num_frames)) + [num_frames - 1] * pad_to_end
+
+
+def _clip_from(start: int, clip_len: int) -> List[int]:
+    """Indices of the `clip_len` consecutive frames starting at `start`."""
+    return list(range(start, start + clip_len))
+
+
+def center_indices(num_frames: int, clip_len: int) -> List[List[int]]:
+    """
+    Single clip made of the center `clip_len` frames of the video.
+
+    :param num_frames:
+        Number of frames in the video
+    :param clip_len:
+        Number of frames per clip
+    :return:
+        The list of frame indices for the clip
+    """
+    if num_frames <= clip_len:
+        return [_pad_indices(num_frames, clip_len)]
+
+    diff = num_frames - clip_len
+    return [_clip_from(diff - diff // 2, clip_len)]
+
+
+def sliding_window_indices(num_frames: int, clip_len: int, stride: int) -> List[List[int]]:
+    """
+    Clips taken every `stride` frames across the complete video.
+
+    :param num_frames:
+        Number of frames in the video
+    :param clip_len:
+        Number of frames per clip
+    :param stride:
+        Number of frames between the starts of two consecutive clips
+    :return:
+        The lists of frame indices for all clips
+    """
+    if num_frames <= clip_len:
+        return [_pad_indices(num_frames, clip_len)]
+
+    # Center the windows so that the frames left out are split between both ends
+    last_start = num_frames - clip_len
+    offset = (last_start % stride) // 2
+    return [_clip_from(start, clip_len) for start in range(offset, last_start + 1, stride)]
+
+
+def random_indices(num_frames: int,
+                   clip_len: int,
+                   num_clips: int,
+                   rng: np.random.Generator) -> List[List[int]]:
+    """
+    Clips starting at uniformly sampled positions in the video. The start positions are drawn with
+    replacement, so that a video only slightly longer than a clip can give fewer (distinct) clips
+    than `num_clips`, and a video shorter than a clip gives a single padded clip.
+
+    :param num_frames:
+        Number of frames in the video
+    :param clip_len:
+        Number of frames per clip
+    :param num_clips:
+        Maximum number of clips to sample
+    :param rng:
+        Random generator to sample the start positions with
+    :return:
+        The lists of frame indices for all clips, sorted by start position
+    """
+    if num_frames <= clip_len:
+        return [_pad_indices(num_frames, clip_len)]
+
+    starts = np.unique(rng.integers(0, num_frames - clip_len + 1, size=num_clips))
+    return [_clip_from(int(start), clip_len) for start in starts]
+
+
+def segment_indices(num_frames: int,
+                    clip_len: int,
+                    num_segments: int,
+                    rng: Optional[np.random.Generator] = None) -> List[List[int]]:
+    """
+    TSN-style sampling: split the video into `num_segments` equal segments and take one clip from
+    each, at a random position inside the segment for training or at its center for evaluation.
+    Segments of a video shorter than `num_segments` clips can share their clip, which is only
+    returned once, and a video shorter than a clip gives a single padded clip.
+
+    :param num_frames:
+        Number of frames in the video
+    :param clip_len:
+        Number of frames per clip
+    :param num_segments:
+        Number of segments (and so of clips) per video
+    :param rng:
+        Random generator to sample the position inside each segment, or None to take the center
+    :return:
+        The lists of frame indices for all clips
+    """
+    if num_frames <= clip_len:
+        return [_pad_indices(num_frames, clip_len)]
+
+    last_start = num_frames - clip_len
+    bounds = np.linspace(0, last_start + 1, num_segments + 1)
+    clips = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        low, high = int(low), max(int(high), int(low) + 1)
+        if rng is None:
+            start = (low + high - 1) // 2
+        else:
+            start = int(rng.integers(low, high))
+        clip = _clip_from(min(start, last_start), clip_len)
+        if clip not in clips:
+            clips.append(clip)
+
+    return clips
+
+
+class ClipSampler:
+    """
+    Callable computing the clips to take from a video of the given length with one of the
+    sampling methods listed in `constants.CLIP_SAMPLING_METHODS`.
+    """
+
+    def __init__(self,
+                 clip_len: int,
+                 method: str = "center",
+                 stride: Optional[int] = None,
+                 num_clips: int = 1,
+                 seed: Optional[int] = None):
+        """
+        :param clip_len:
+            Number of frames per clip
+        :param method:
+            One of "center", "sliding", "random" or "segment"
+        :param stride:
+            Stride of the sliding windows (defaults to half of the clip length)
+        :param num_clips:
+            Maximum number of clips per video for the "random" and "segment" methods (short videos
+            give fewer, distinct clips)
+        :param seed:
+            Seed for the random positions ("random" method, and "segment" method if given)
+        """
+        if method not in ("center", "sliding", "random", "segment"):
+            raise ValueError(f"Unknown clip sampling method \"{method}\"")
+
+        self.clip_len = int(clip_len)
+        self.method = method
+        self.stride = int(stride) if stride else max(self.clip_len // 2, 1)
+        self.num_clips = num_clips
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, num_frames: int) -> List[List[int]]:
+        """
+        :param num_frames:
+            Number of frames in the video
+        :return:
+            The lists of frame indices for all clips
+        """
+        if num_frames <= 0:
+            return []
+        if self.method == "sliding":
+            return sliding_window_indices(num_frames, self.clip_len, self.stride)
+        if self.method == "random":
+            return random_indices(num_frames, self.clip_len, self.num_clips, self.rng)
+        if self.method == "segment":
+            rng = self.rng if self.seed is not None else None
+            return segment_indices(num_frames, self.clip_len, self.num_clips, rng)
+        return center_indices(num_frames, self.clip_len)
+
+
+def _index_positions(clips: Sequence[Sequence[int]]) -> Dict[int, List[Tuple[int, int]]]:
+    """Map every frame index to the (clip, position in clip) slots it fills."""
+    positions = dict()
+    for clip_idx, clip in enumerate(clips):
+        for pos, frame_idx in enumerate(clip):
+            positions.setdefault(frame_idx, []).append((clip_idx, pos))
+
+    return positions
+
+
+def read_clips(path_in: str,
+               clips: Sequence[Sequence[int]],
+               to_rgb: bool = False) -> np.ndarray:
+    """
+    Decode the video once and gather the frames of all clips.
+
+    :param path_in:
+        Path to the video file
+    :param clips:
+        The lists of frame indices for all clips, as returned by a sampler
+    :param to_rgb:
+        Convert the frames from BGR to RGB
+    :return:
+        Array of shape (num_clips, clip_len, height, width, 3)
+    """
+    positions = _index_positions(clips)
+    clip_len = len(clips[0]) if clips else 0
+
+    with FrameReader(path_in, reuse_buffer=True, stop=max(positions) + 1 if positions else 0) as reader:
+        output = np.empty((len(clips), clip_len, reader.height, reader.width, 3), dtype=np.uint8)
+        last_frame = None
+        frame_idx = -1
+        for frame_idx, frame in enumerate(reader):
+            if frame_idx not in positions:
+                continue
+            first_clip, first_pos = positions[frame_idx][0]
+            if to_rgb:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=output[first_clip, first_pos])
+            else:
+                output[first_clip, first_pos] = frame
+            for clip_idx, pos in positions[frame_idx][1:]:
+                output[clip_idx, pos] = output[first_clip, first_pos]
+            last_frame = output[first_clip, first_pos]
+
+    # The frame count used by the sampler can overestimate the number of decodable frames,
+    # fill any missing frames with the last one that could be read
+    if last_frame is not None:
+        for missing_idx in range(frame_idx + 1, max(positions) + 1):
+            for clip_idx, pos in positions.get(missing_idx, []):
+                output[clip_idx, pos] = last_frame
+
+    return output
+
+
+def write_clips(path_in: str,
+                paths_out: Sequence[str],
+                clips: Sequence[Sequence[int]]):
+    """
+    Decode the video once and write every clip to its own video file. Writers are only kept open
+    while their clip is being written, so long videos with many overlapping clips stay cheap.
+
+    :param path_in:
+        Path to the video file
+    :param paths_out:
+        Paths to save the clips to, one per clip
+    :param clips:
+        The lists of frame indices for all clips, as returned by a sampler
+    """
+    positions = _index_positions(clips)
+    if not positions:
+        return
+    starting_clips = dict()
+    for clip_idx, clip in enumerate(clips):
+        starting_clips.setdefault(min(clip), []).append(clip_idx)
+    last_frames = [max(clip) for clip in clips]
+    writers = dict()
+
+    last_frame = None
+    frame_idx = -1
+    with FrameReader(path_in, reuse_buffer=True, stop=max(positions) + 1) as reader:
+        fps, dims = reader.fps, reader.dims
+        for frame_idx, frame in enumerate(reader):
+            last_frame = frame
+            for clip_idx in starting_clips.get(frame_idx, []):
+                writers[clip_idx] = open_writer(paths_out[clip_idx], reader.fps, reader.dims)
+
+            for clip_idx, _ in positions.get(frame_idx, []):
+                with stage("encode"):
+                    writers[clip_idx].write(frame)
+                count("encode.frames")
+
+            for clip_idx in [idx for idx in writers if last_frames[idx] == frame_idx]:
+                writers.pop(clip_idx).release()
+
+    # The frame count used by the sampler can overestimate the number of decodable frames,
+    # fill any missing frames with the last one that could be read
+    if last_frame is not None:
+        for missing_idx in range(frame_idx + 1, max(positions) + 1):
+            for clip_idx in starting_clips.get(missing_idx, []):
+                writers[clip_idx] = open_writer(paths_out[clip_idx], fps, dims)
+            for clip_idx, _ in positions.get(missing_idx, []):
+                writers[clip_idx].write(last_frame)
+
+    for writer in writers.values():
+        writer.release()
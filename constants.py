@@ -4,20 +4,27 @@ TEST_PATH_IN = r"C:/Users/Manik/Desktop/data/Cleaned Dataset"
 TEST_PATH_OUT = r"E:/LakeheadU/Final Project Data/data"
 TEST_PATH_TEST_VIDEOS = r"E:/LakeheadU/Final Project Data/data/test_videos"
 TEST_SAVED_MODELS_DIRECTORY = r"E:/LakeheadU/Final Project Data/model_weights"
+TEST_PREDICTION_CACHE = r"E:/LakeheadU/Final Project Data/data/prediction_cache.sqlite"
 TEST_FILE_NAME = "user02.mp4"
 TEST_TARGET_FPS = 4
 TEST_TARGET_FRAMES = 20
 TEST_RESIZE_FRAME_WIDTH = 100
 TEST_RESIZE_FRAME_HEIGHT = 100
 TEST_NUM_TEST_VIDEOS_PER_CLASS = 20
+TEST_SPLIT_FRACTIONS = {'val': 0.15, 'test': 0.15}
+TEST_SPLIT_SEED = 42
 
 # Video extension
 VIDEO_EXT = ".mp4"
 
-# VideoWriter "out" four-char code
-FOURCC = 0x7634706d
+# Codec of the written videos ("mp4v", "MJPG" or "FFV1"), decoding thread count hint (0 for the
+# OpenCV default) and hardware acceleration of the videos (see `video_codecs.py`)
+VIDEO_CODEC = "mp4v"
+VIDEO_THREADS = 0
+VIDEO_HW_ACCELERATION = False
 
 # VideoCapture properties
+PROP_ID_POS_FRAMES = 1
 PROP_ID_WIDTH = 3
 PROP_ID_HEIGHT = 4
 PROP_ID_FPS = 5
@@ -65,6 +72,17 @@ AUGMENTATION_METHODS = {
     "Video blur": "blurred"
 }
 
+# Clip sampling methods for videos longer than the target number of frames
+CLIP_SAMPLING_METHODS = {
+    "Center trim": "center",
+    "Sliding window": "sliding",
+    "Uniform random": "random",
+    "Segments (TSN)": "segment"
+}
+
+# Default number of clips per video for the "random" and "segment" sampling methods
+TEST_NUM_CLIPS_PER_VIDEO = 3
+
 # Saved trained models for different data-sets
 DATASETS = {
     "ASL": 'my_sign_model',
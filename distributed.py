@@ -0,0 +1,182 @@
+"""
+Launcher for data-parallel training on CPU nodes, and scaling benchmark of the workers.
+
+Starts N local worker processes of a training command, each with the environment of its
+distributed backend, to test multi-worker training on a single machine:
+
+    - tf    : `TF_CONFIG` for `tf.distribute.MultiWorkerMirroredStrategy`, e.g.
+              `python train_c3d.py --distributed`
+    - torch : `MASTER_ADDR`, `MASTER_PORT`, `RANK` and `WORLD_SIZE` for `torch.distributed`
+              (gloo backend), e.g. `python torch_models.py train temporal <dataset_dir>`
+
+The CPU cores are split evenly between the workers. The output of every worker is saved to
+"<log_dir>/worker_<i>.log". On several nodes, set the same variables on every node instead.
+
+The benchmark runs the command with 1, 2, 4 and 8 workers, and reports the total throughput and the
+scaling efficiency. The torch workers log their own throughput, which is summed, while the tf
+workers all log the throughput of the global batch, of which the highest is kept.
+
+Usage:
+    distributed.py launch (tf | torch) <num_workers> [--port=PORT] [--log-dir=DIR] [--] <command>...
+    distributed.py benchmark (tf | torch) [--workers=LIST] [--port=PORT] [--log-dir=DIR] [--] <command>...
+    distributed.py (-h | --help)
+
+Options:
+    --port=PORT         First port used by the workers to communicate [default: 12345]
+    --log-dir=DIR       Folder to save the output of the workers to [default: distributed_logs]
+    --workers=LIST      Comma separated numbers of workers to benchmark [default: 1,2,4,8]
+"""
+
+from typing import List
+from typing import Optional
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+SAMPLES_PER_SEC_PATTERN = re.compile(r"([\d.]+) samples/sec")
+
+
+def worker_env(backend: str, worker_index: int, num_workers: int, port: int) -> dict:
+    """
+    Environment of one local worker process.
+
+    :param backend:
+        "tf" or "torch"
+    :param worker_index:
+        Index (rank) of the worker
+    :param num_workers:
+        Total number of workers
+    :param port:
+        First port of the workers
+    :return:
+        The environment variables of the worker
+    """
+    env = dict(os.environ)
+    if backend == "tf":
+        env["TF_CONFIG"] = json.dumps({
+            "cluster": {"worker": [f"localhost:{port + idx}" for idx in range(num_workers)]},
+            "task": {"type": "worker", "index": worker_index},
+        })
+    else:
+        env.update({
+            "MASTER_ADDR": "127.0.0.1",
+            "MASTER_PORT": str(port),
+            "RANK": str(worker_index),
+            "LOCAL_RANK": str(worker_index),
+            "WORLD_SIZE": str(num_workers),
+        })
+
+    # Local workers share the CPU, don't let each of them use all the cores
+    num_threads = str(max((os.cpu_count() or 1) // num_workers, 1))
+    env["OMP_NUM_THREADS"] = num_threads
+    env["TF_NUM_INTRAOP_THREADS"] = num_threads
+    return env
+
+
+def launch(backend: str, command: List[str], num_workers: int, port: int = 12345,
+           log_dir: str = "distributed_logs") -> Optional[float]:
+    """
+    Run the command on local worker processes and wait for all of them.
+
+    :param backend:
+        "tf" or "torch"
+    :param command:
+        The training command (a ".py" script is run with the current interpreter)
+    :param num_workers:
+        Number of worker processes
+    :param port:
+        First port of the workers
+    :param log_dir:
+        Folder to save the output of the workers to
+    :return:
+        Total throughput in samples/sec logged by the workers, None if any worker failed or
+        none logged it
+    """
+    if command[0].endswith(".py"):
+        command = [sys.executable] + command
+    os.makedirs(log_dir, exist_ok=True)
+
+    log_paths = [os.path.join(log_dir, f"worker_{idx}.log") for idx in range(num_workers)]
+    processes = []
+    for idx, log_path in enumerate(log_paths):
+        with open(log_path, "w") as log_file:
+            processes.append(subprocess.Popen(command, env=worker_env(backend, idx, num_workers, port),
+                                              stdout=log_file, stderr=subprocess.STDOUT))
+
+    return_codes = [process.wait() for process in processes]
+    if any(return_codes):
+        for idx, code in enumerate(return_codes):
+            if code:
+                print(f"    [ERROR]\tWorker {idx} failed with exit code {code}, see \"{log_paths[idx]}\"")
+        return None
+
+    throughputs = []
+    for log_path in log_paths:
+        with open(log_path) as log_file:
+            matches = SAMPLES_PER_SEC_PATTERN.findall(log_file.read())
+        if matches:
+            throughputs.append(float(matches[-1]))
+    if not throughputs:
+        return None
+    # `ThroughputLogger` already counts the samples of all the tf workers
+    return max(throughputs) if backend == "tf" else sum(throughputs)
+
+
+def benchmark(backend: str, command: List[str], workers: List[int], port: int = 12345,
+              log_dir: str = "distributed_logs"):
+    """
+    Print the throughput and scaling efficiency of the command for every number of workers.
+
+    :param backend:
+        "tf" or "torch"
+    :param command:
+        The training command
+    :param workers:
+        Numbers of workers to run the command with
+    :param port:
+        First port of the workers
+    :param log_dir:
+        Folder to save the output of the workers to (one sub-folder per number of workers)
+    """
+    results = []
+    for num_workers in workers:
+        print(f"    [INFO]\tRunning {num_workers} worker(s)...")
+        start_time = time.perf_counter()
+        throughput = launch(backend, command, num_workers, port, os.path.join(log_dir, f"{num_workers}_workers"))
+        results.append((num_workers, throughput, time.perf_counter() - start_time))
+
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tSCALING ({backend})")
+    print(f"    [INFO]\t{'=' * 50}")
+    base = next((throughput / num_workers for num_workers, throughput, _ in results if throughput), None)
+    for num_workers, throughput, elapsed in results:
+        if throughput is None:
+            print(f"    [INFO]\t{num_workers} worker(s)\tfailed")
+            continue
+        efficiency = throughput / (base * num_workers)
+        print(f"    [INFO]\t{num_workers} worker(s)\t{throughput:8.1f} samples/sec\t"
+              f"efficiency {efficiency:6.1%}\twall time {elapsed:.1f}s")
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    backend = "tf" if args['tf'] else "torch"
+    port = int(args['--port'])
+
+    if args['launch']:
+        throughput = launch(backend, args['<command>'], int(args['<num_workers>']), port, args['--log-dir'])
+        if throughput is not None:
+            print(f"    [INFO]\tTotal throughput: {throughput:.1f} samples/sec")
+    else:
+        workers = [int(num_workers) for num_workers in args['--workers'].split(',')]
+        benchmark(backend, args['<command>'], workers, port, args['--log-dir'])
+
+
+if __name__ == "__main__":
+    main()
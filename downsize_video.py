@@ -2,25 +2,34 @@
 Script to downsize a video, i.e. reduce the fps of any video with a target fps value.
 
 Usage:
-    downsize_video.py
+    downsize_video.py [--config=PATH] [--headless]
     downsize_video.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
-from PyInquirer import prompt
-import cv2
+from docopt import docopt
 import os
 
-from constants import FOURCC
+from cli import ask
+from cli import load_config
 from constants import PROP_ID_FPS
-from constants import PROP_ID_FRAME_COUNT
-from constants import PROP_ID_HEIGHT
-from constants import PROP_ID_WIDTH
 from constants import TEST_PATH_IN
 from constants import TEST_PATH_OUT
 from constants import TEST_TARGET_FPS
 from constants import VIDEO_EXT
+from profiling import count
+from profiling import profile_run
+from profiling import stage
+from profiling import timed
+from video_codecs import open_capture
+from video_codecs import open_writer
+from video_reader import FrameReader
 
 
+@timed("downsize")
 def parse_video(path_in,
                 path_out,
                 target_fps):
@@ -35,46 +44,40 @@ def parse_video(path_in,
         Target FPS for downsizing video
     """
 
-    cap = cv2.VideoCapture(path_in)
-
-    width = int(cap.get(PROP_ID_WIDTH))
-    height = int(cap.get(PROP_ID_HEIGHT))
-    current_fps = int(cap.get(PROP_ID_FPS))
-    frame_count = int(cap.get(PROP_ID_FRAME_COUNT))
-    frame_jump = current_fps / target_fps
-
-    out = cv2.VideoWriter(path_out, FOURCC, target_fps, (width, height))
+    with FrameReader(path_in, reuse_buffer=True) as reader:
+        current_fps = int(reader.fps)
+        frame_count = reader.frame_count
+        frame_jump = current_fps / target_fps
 
-    curr_frame = 0
-    prev_frame_idx = -1
-    while curr_frame < frame_count:
-        new_frame_idx = int(curr_frame * frame_jump)
-        if new_frame_idx != prev_frame_idx:
-            cap.set(1, new_frame_idx)
-            _, frame = cap.read()
-            out.write(frame)
-            prev_frame_idx = new_frame_idx
-        curr_frame += 1
+        # Indices of the source frames to keep, read sequentially instead of seeking to each one
+        keep_frames = {int(curr_frame * frame_jump) for curr_frame in range(frame_count)}
 
+        out = open_writer(path_out, target_fps, reader.dims)
+        for frame_idx, frame in enumerate(reader):
+            if frame_idx in keep_frames:
+                with stage("encode"):
+                    out.write(frame)
+                count("encode.frames")
     out.release()
-    cap.release()
 
 
 def main():
     """Main body of the script to be run."""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="downsize_video")
 
-    answer_path_in = prompt({
+    answer_path_in = ask({
         'type': 'input',
         'name': 'path_in',
         'message': 'Enter the path to the videos folder: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_in = answer_path_in['path_in']
     if not os.path.isdir(path_in):
         print(f"    [ERROR]\tThe folder \"{path_in}\" doesn't exist.")
         return
 
-    answer_is_dataset = prompt({
+    answer_is_dataset = ask({
         'type': 'list',
         'name': 'is_dataset',
         'message': 'Do you wish to process the complete dataset or selected folders?',
@@ -82,34 +85,34 @@ def main():
             'Complete Dataset',
             'Select Folders'
         ]
-    })
+    }, config)
     is_dataset = answer_is_dataset['is_dataset'] == "Complete Dataset"
 
     if is_dataset:
         folder_names = os.listdir(path_in)
     else:
-        answer_folder_names = prompt({
+        answer_folder_names = ask({
             'type': 'checkbox',
             'name': 'folder_names',
             'message': 'Select the folders to process: ',
             'choices': [{'name': _file} for _file in os.listdir(path_in)]
-        })
+        }, config)
         folder_names = answer_folder_names['folder_names']
 
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save the downsized video(s) to: ',
         'default': TEST_PATH_OUT
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
-    answer_target_fps = prompt({
+    answer_target_fps = ask({
         'type': 'input',
         'name': 'target_fps',
         'message': 'Enter the target FPS for the video(s): ',
         'default': str(TEST_TARGET_FPS)
-    })
+    }, config)
     target_fps = float(answer_target_fps['target_fps'])
 
     os.makedirs(path_out, exist_ok=True)
@@ -124,7 +127,7 @@ def main():
 
         file_names = os.listdir(folder_path)
         if not is_dataset:
-            answer_is_dir = prompt({
+            answer_is_dir = ask({
                 'type': 'list',
                 'name': 'is_dir',
                 'message': f'Do you wish to process the complete folder \"{folder.upper()}\" or selected videos?',
@@ -132,18 +135,18 @@ def main():
                     'Complete Folder',
                     'Select Videos'
                 ]
-            })
+            }, config, scope=folder)
             is_dir = answer_is_dir['is_dir'] == "Complete Folder"
 
             if is_dir:
                 file_names = os.listdir(folder_path)
             else:
-                answer_file_names = prompt({
+                answer_file_names = ask({
                     'type': 'checkbox',
                     'name': 'file_names',
                     'message': 'Select the videos to downsize: ',
                     'choices': [{'name': _file} for _file in os.listdir(folder_path)]
-                })
+                }, config, scope=folder)
                 file_names = answer_file_names['file_names']
 
         num_videos = len(file_names)
@@ -153,7 +156,7 @@ def main():
             video_path = os.path.join(folder_path, video)
             new_file_name = f"{video.split('.')[0]}_downsized_at_fps={int(target_fps)}{VIDEO_EXT}"
             save_path = os.path.join(new_folder_path, new_file_name)
-            cap = cv2.VideoCapture(video_path)
+            cap = open_capture(video_path)
             original_fps = cap.get(PROP_ID_FPS)
             cap.release()
             if target_fps >= original_fps:
@@ -165,4 +168,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("downsize_video"):
+        main()
@@ -0,0 +1,204 @@
+"""
+Script to export the gesture models for deployment, to be run with `predictor.py`:
+
+    - torch : `Spatial_CNN`, `Temporal_CNN` or `Two_Stream` (Models folder) exported to TorchScript
+              ("<model>.pt") and ONNX ("<model>.onnx"), with a dynamic batch dimension
+    - keras : the C3D model trained by `train_c3d.py` exported to a TensorFlow SavedModel
+              ("<model>_savedmodel"), then converted to ONNX ("<model>.onnx") with tf2onnx when
+              installed (`pip install tf2onnx`)
+
+Every ONNX export is checked against the original model on a random batch.
+
+Usage:
+    export_models.py torch (spatial | temporal | two_stream) <output_dir> [--weights=PATH]... [--classes=N] [--opset=N]
+    export_models.py keras <keras_model> <output_dir> [--opset=N]
+    export_models.py (-h | --help)
+
+Options:
+    --weights=PATH      Trained weights (state dict) of the model. For two_stream, give the spatial
+                        then the temporal weights
+    --classes=N         Number of classes of the model [default: 8]
+    --opset=N           ONNX opset version [default: 17]
+"""
+
+import os
+import subprocess
+import sys
+
+from docopt import docopt
+import numpy as np
+
+from constants import TEST_RESIZE_FRAME_HEIGHT
+from constants import TEST_RESIZE_FRAME_WIDTH
+from constants import TEST_TARGET_FRAMES
+from predictor import OnnxPredictor
+
+# The Torch models import each other as sibling modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Models"))
+
+# Input shapes (without batch dimension) of the Torch models
+SPATIAL_INPUT_SHAPE = (3, 216, 216)
+TEMPORAL_INPUT_SHAPE = (18, 216, 216)
+
+
+def build_torch_model(model_name, num_classes, weights):
+    """
+    Build a Torch model in inference mode, with its trained weights.
+
+    :param model_name:
+        One of "spatial", "temporal" or "two_stream"
+    :param num_classes:
+        Number of classes of the model
+    :param weights:
+        List of the trained weights paths (spatial then temporal for "two_stream")
+    :return:
+        The model and its example inputs
+    """
+    import torch
+
+    if model_name == "two_stream":
+        from Two_Stream import Two_Stream
+
+        model = Two_Stream(num_classes, *weights[:2])
+        example_inputs = (torch.rand((1,) + SPATIAL_INPUT_SHAPE), torch.rand((1,) + TEMPORAL_INPUT_SHAPE))
+    else:
+        if model_name == "spatial":
+            from Spatial_CNN import Spatial_CNN
+
+            model = Spatial_CNN(num_classes, pretrained=not weights)
+            example_inputs = (torch.rand((1,) + SPATIAL_INPUT_SHAPE),)
+        else:
+            from Temporal_CNN import Temporal_CNN
+
+            model = Temporal_CNN(num_classes)
+            example_inputs = (torch.rand((1,) + TEMPORAL_INPUT_SHAPE),)
+        if weights:
+            model.load_state_dict(torch.load(weights[0], map_location="cpu", weights_only=True))
+
+    return model.eval(), example_inputs
+
+
+def export_torch(model_name, output_dir, num_classes, weights, opset):
+    """
+    Export a Torch model to TorchScript and ONNX.
+
+    :param model_name:
+        One of "spatial", "temporal" or "two_stream"
+    :param output_dir:
+        Folder to save the exported models to
+    :param num_classes:
+        Number of classes of the model
+    :param weights:
+        List of the trained weights paths
+    :param opset:
+        ONNX opset version
+    :return:
+        Paths of the TorchScript and ONNX models
+    """
+    import torch
+
+    model, example_inputs = build_torch_model(model_name, num_classes, weights)
+    os.makedirs(output_dir, exist_ok=True)
+
+    torchscript_path = os.path.join(output_dir, f"{model_name}.pt")
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example_inputs)
+    traced.save(torchscript_path)
+    print(f"    [INFO]\tSaved TorchScript model to \"{torchscript_path}\"")
+
+    onnx_path = os.path.join(output_dir, f"{model_name}.onnx")
+    input_names = ["spatial_input", "temporal_input"] if model_name == "two_stream" else ["input"]
+    torch.onnx.export(model, example_inputs, onnx_path,
+                      input_names=input_names,
+                      output_names=["scores"],
+                      dynamic_axes={name: {0: "batch"} for name in input_names + ["scores"]},
+                      opset_version=opset,
+                      dynamo=False)
+    print(f"    [INFO]\tSaved ONNX model to \"{onnx_path}\"")
+
+    with torch.inference_mode():
+        batch = tuple(torch.rand((2,) + tuple(example.shape[1:])) for example in example_inputs)
+        expected = model(*batch).numpy()
+    check_onnx(onnx_path, [example.numpy() for example in batch], expected)
+
+    return torchscript_path, onnx_path
+
+
+def export_keras(keras_model_path, output_dir, opset):
+    """
+    Export the Keras C3D model to a SavedModel, and to ONNX with tf2onnx when installed.
+
+    :param keras_model_path:
+        Path to the ".h5" model saved by `train_c3d.py`
+    :param output_dir:
+        Folder to save the exported models to
+    :param opset:
+        ONNX opset version
+    :return:
+        Paths of the SavedModel folder and of the ONNX model (None if not converted)
+    """
+    import keras
+
+    model = keras.models.load_model(keras_model_path)
+    os.makedirs(output_dir, exist_ok=True)
+    model_name = os.path.splitext(os.path.basename(keras_model_path))[0]
+
+    saved_model_path = os.path.join(output_dir, f"{model_name}_savedmodel")
+    model.save(saved_model_path, save_format="tf")
+    print(f"    [INFO]\tSaved SavedModel to \"{saved_model_path}\"")
+
+    onnx_path = os.path.join(output_dir, f"{model_name}.onnx")
+    convert_command = [sys.executable, "-m", "tf2onnx.convert", "--saved-model", saved_model_path,
+                       "--output", onnx_path, "--opset", str(opset)]
+    try:
+        import tf2onnx  # noqa: F401
+    except ImportError:
+        print(f"    [WARN]\ttf2onnx is not installed, convert the SavedModel to ONNX with:")
+        print(f"    [WARN]\t{' '.join(convert_command)}")
+        return saved_model_path, None
+
+    subprocess.run(convert_command, check=True)
+    print(f"    [INFO]\tSaved ONNX model to \"{onnx_path}\"")
+
+    batch = np.random.rand(2, TEST_TARGET_FRAMES, TEST_RESIZE_FRAME_HEIGHT, TEST_RESIZE_FRAME_WIDTH, 3)
+    batch = (batch * 255).astype(np.float32)
+    check_onnx(onnx_path, [batch], model.predict(batch, verbose=0))
+
+    return saved_model_path, onnx_path
+
+
+def check_onnx(onnx_path, inputs, expected, atol=1e-4):
+    """
+    Check that the ONNX model gives the same scores as the original model.
+
+    :param onnx_path:
+        Path to the ONNX model
+    :param inputs:
+        List of the input arrays
+    :param expected:
+        Scores of the original model for these inputs
+    :param atol:
+        Absolute tolerance on the scores
+    """
+    scores = OnnxPredictor(onnx_path).predict(*inputs)
+    max_diff = float(np.abs(scores - expected).max())
+    if max_diff > atol:
+        print(f"    [WARN]\tONNX scores differ from the original model (max diff {max_diff:.2e})")
+    else:
+        print(f"    [INFO]\tONNX scores match the original model (max diff {max_diff:.2e})")
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    opset = int(args['--opset'])
+
+    if args['torch']:
+        model_name = next(name for name in ("spatial", "temporal", "two_stream") if args[name])
+        export_torch(model_name, args['<output_dir>'], int(args['--classes']), args['--weights'], opset)
+    else:
+        export_keras(args['<keras_model>'], args['<output_dir>'], opset)
+
+
+if __name__ == "__main__":
+    main()
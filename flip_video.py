@@ -2,22 +2,32 @@
 Helper script to process videos inside a folder and flip them horizontally to double the size of the data-set.
 
 Usage:
+    flip_video.py [--config=PATH] [--headless]
     flip_video.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
 import os
 import cv2
-from PyInquirer import prompt
+from docopt import docopt
 
-from constants import FOURCC
-from constants import PROP_ID_FPS
-from constants import PROP_ID_HEIGHT
-from constants import PROP_ID_WIDTH
+from cli import ask
+from cli import load_config
 from constants import TEST_PATH_IN
 from constants import TEST_PATH_OUT
 from constants import VIDEO_EXT
+from profiling import count
+from profiling import profile_run
+from profiling import stage
+from profiling import timed
+from video_codecs import open_writer
+from video_reader import FrameReader
 
 
+@timed()
 def flip_video(path_in: str,
                path_out: str):
     """
@@ -29,36 +39,34 @@ def flip_video(path_in: str,
         Path to save the flipped video
     """
 
-    cap = cv2.VideoCapture(path_in)
-    out = cv2.VideoWriter(path_out, FOURCC, cap.get(PROP_ID_FPS),
-                          (int(cap.get(PROP_ID_WIDTH)), int(cap.get(PROP_ID_HEIGHT))))
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame = cv2.flip(frame, 1)
-        out.write(frame)
-
-    cap.release()
+    with FrameReader(path_in, reuse_buffer=True) as reader:
+        out = open_writer(path_out, reader.fps, reader.dims)
+        for frame in reader:
+            with stage("compute"):
+                frame = cv2.flip(frame, 1)
+            with stage("encode"):
+                out.write(frame)
+            count("encode.frames")
     out.release()
 
 
 def main():
     """Main body of the script to be run."""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="flip_video")
 
-    answer_path_in = prompt({
+    answer_path_in = ask({
         'type': 'input',
         'name': 'path_in',
         'message': 'Enter the path to the dataset directory: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_in = answer_path_in['path_in']
     if not os.path.isdir(path_in):
         print(f"    [ERROR]\tThe folder \"{path_in}\" doesn't exist.")
         return
 
-    answer_is_dataset = prompt({
+    answer_is_dataset = ask({
         'type': 'list',
         'name': 'is_dataset',
         'message': 'Do you wish to process the complete dataset or selected folders?',
@@ -66,26 +74,26 @@ def main():
             'Complete Dataset',
             'Select Folders'
         ]
-    })
+    }, config)
     is_dataset = answer_is_dataset['is_dataset'] == "Complete Dataset"
 
     if is_dataset:
         folder_names = os.listdir(path_in)
     else:
-        answer_folder_names = prompt({
+        answer_folder_names = ask({
             'type': 'checkbox',
             'name': 'folder_names',
             'message': 'Select the folders to process: ',
             'choices': [{'name': _file} for _file in os.listdir(path_in)]
-        })
+        }, config)
         folder_names = answer_folder_names['folder_names']
 
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save the flipped videos to: ',
         'default': TEST_PATH_OUT
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
     os.makedirs(path_out, exist_ok=True)
@@ -100,7 +108,7 @@ def main():
 
         file_names = os.listdir(folder_path)
         if not is_dataset:
-            answer_is_dir = prompt({
+            answer_is_dir = ask({
                 'type': 'list',
                 'name': 'is_dir',
                 'message': f'Do you wish to process the complete folder \"{folder.upper()}\" or selected videos?',
@@ -108,18 +116,18 @@ def main():
                     'Complete Folder',
                     'Select Videos'
                 ]
-            })
+            }, config, scope=folder)
             is_dir = answer_is_dir['is_dir'] == "Complete Folder"
 
             if is_dir:
                 file_names = os.listdir(folder_path)
             else:
-                answer_file_names = prompt({
+                answer_file_names = ask({
                     'type': 'checkbox',
                     'name': 'file_names',
                     'message': 'Select the videos to flip horizontally: ',
                     'choices': [{'name': _file} for _file in os.listdir(folder_path)]
-                })
+                }, config, scope=folder)
                 file_names = answer_file_names['file_names']
 
         num_videos = len(file_names)
@@ -135,4 +143,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profile_run("flip_video"):
+        main()
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""
+Motion gate of the live inference loops (`test_inference.py`, `test_output.py`): the model is only
+run while something moves in front of the camera.
+
+Every frame is downscaled to a small grayscale image and compared with a running-average
+background. The gate opens when the fraction of changed pixels reaches `on_threshold`, and closes
+again once it stays below `off_threshold` for `hold_frames` frames (hysteresis, so a gesture
+slowing down for a moment isn't cut). The gate costs a few tens of microseconds per frame, so an
+idle stream costs almost nothing instead of a model call every few frames.
+
+Run this script on a recorded video to tune the thresholds: it prints the gate statistics and its
+cost per frame.
+
+Usage:
+    motion_gate.py <video_path> [--on=FRACTION] [--off=FRACTION] [--hold=N]
+    motion_gate.py (-h | --help)
+
+Options:
+    --on=FRACTION       Fraction of changed pixels opening the gate [default: 0.02]
+    --off=FRACTION      Fraction of changed pixels below which the gate closes [default: 0.005]
+    --hold=N            Number of still frames before the gate closes [default: 15]
+"""
+
+from typing import Tuple
+import time
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+from video_reader import FrameReader
+
+# Size (width, height) of the frames compared by the gate
+GATE_SIZE = (64, 48)
+
+
+class MotionGate:
+    """Frame differencing against a running-average background, with hysteresis and statistics."""
+
+    def __init__(self,
+                 name: str = "stream",
+                 size: Tuple[int, int] = GATE_SIZE,
+                 pixel_threshold: int = 25,
+                 on_threshold: float = 0.02,
+                 off_threshold: float = 0.005,
+                 hold_frames: int = 15,
+                 learning_rate: float = 0.05):
+        """
+        :param name:
+            Name of the stream, for the statistics
+        :param size:
+            Size (width, height) of the downscaled frames
+        :param pixel_threshold:
+            Gray level difference with the background for a pixel to count as changed
+        :param on_threshold:
+            Fraction of changed pixels opening the gate
+        :param off_threshold:
+            Fraction of changed pixels below which the gate starts closing
+        :param hold_frames:
+            Number of consecutive frames below `off_threshold` before the gate closes
+        :param learning_rate:
+            Weight of the new frame in the running-average background
+        """
+        self.name = name
+        self.size = tuple(size)
+        self.pixel_threshold = pixel_threshold
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.hold_frames = hold_frames
+        self.learning_rate = learning_rate
+
+        width, height = self.size
+        self.small = np.empty((height, width, 3), dtype=np.uint8)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.diff = np.empty((height, width), dtype=np.uint8)
+        self.background = None
+        self.background_u8 = np.empty((height, width), dtype=np.uint8)
+
+        self.active = False
+        self.activity = 0.0
+        self.still_frames = 0
+        self.num_frames = 0
+        self.num_active = 0
+        self.num_openings = 0
+        self.gate_time = 0.0
+
+    def update(self, frame: np.ndarray) -> bool:
+        """
+        Add a new frame to the gate.
+
+        :param frame:
+            The BGR video frame (or the image region to watch)
+        :return:
+            Whether the gate is open, i.e. the model should run on this frame
+        """
+        start_time = time.perf_counter()
+
+        cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        if self.background is None:
+            self.background = self.gray.astype(np.float32)
+        cv2.convertScaleAbs(self.background, dst=self.background_u8)
+        cv2.absdiff(self.gray, self.background_u8, dst=self.diff)
+        cv2.threshold(self.diff, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=self.diff)
+        self.activity = cv2.countNonZero(self.diff) / self.diff.size
+        cv2.accumulateWeighted(self.gray, self.background, self.learning_rate)
+
+        if self.activity >= self.on_threshold:
+            if not self.active:
+                self.num_openings += 1
+            self.active = True
+            self.still_frames = 0
+        elif self.active and self.activity < self.off_threshold:
+            self.still_frames += 1
+            if self.still_frames >= self.hold_frames:
+                self.active = False
+
+        self.num_frames += 1
+        self.num_active += self.active
+        self.gate_time += time.perf_counter() - start_time
+
+        return self.active
+
+    def stats(self) -> dict:
+        """Statistics of the stream so far."""
+        return {
+            "frames": self.num_frames,
+            "active_frames": self.num_active,
+            "duty_cycle": self.num_active / self.num_frames if self.num_frames else 0.0,
+            "openings": self.num_openings,
+            "gate_ms_per_frame": self.gate_time * 1000 / self.num_frames if self.num_frames else 0.0,
+        }
+
+    def print_stats(self):
+        """Print the statistics of the stream."""
+        stats = self.stats()
+        print(f"    [INFO]\tMotion gate \"{self.name}\": {stats['active_frames']} / {stats['frames']} frames active "
+              f"({stats['duty_cycle']:.1%}), opened {stats['openings']} time(s), "
+              f"{stats['gate_ms_per_frame']:.3f} ms/frame")
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    gate = MotionGate(args['<video_path>'], on_threshold=float(args['--on']),
+                      off_threshold=float(args['--off']), hold_frames=int(args['--hold']))
+
+    with FrameReader(args['<video_path>'], reuse_buffer=True) as reader:
+        for frame in reader:
+            gate.update(frame)
+    gate.print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Script to compute the optical flow of the prepared clips, as input for the temporal stream
+(`Models/Temporal_CNN.py`) of the two-stream model.
+
+The flow between every pair of consecutive frames is computed with Farneback's method (or DIS), and
+saved next to its clip as "<clip>.flow.npz", quantized to uint8 along with the min/max values of
+every flow frame to restore it. Clips are processed in parallel worker processes, and clips whose
+flow is already cached (and newer than the clip) are skipped.
+
+Usage:
+    optical_flow.py <dataset_dir> [--method=METHOD] [--workers=N] [--force]
+    optical_flow.py --benchmark <dataset_dir> [--method=METHOD] [--workers=N] [--max-videos=N]
+    optical_flow.py (-h | --help)
+
+Options:
+    --method=METHOD     Optical flow method, "farneback" or "dis" [default: farneback]
+    --workers=N         Number of worker processes (defaults to the number of CPUs)
+    --force             Recompute the flow even if it is already cached
+    --benchmark         Report the throughput in flow-frames/sec without saving the results
+    --max-videos=N      Number of videos to use for the benchmark [default: 50]
+"""
+
+from multiprocessing import Pool
+from typing import List
+from typing import Optional
+from typing import Tuple
+import os
+import time
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+from constants import VIDEO_EXT
+from profiling import profile_run
+from video_reader import FrameReader
+
+FLOW_EXT = ".flow.npz"
+
+# Number of stacked flow frames expected by the temporal stream (18 = 9 x (dx, dy) channels)
+FLOW_STACK_LENGTH = 9
+
+# Frame size expected by the temporal stream
+FLOW_STACK_SIZE = 216
+
+
+def flow_path(video_path: str) -> str:
+    """Path of the cached flow of a clip."""
+    return os.path.splitext(video_path)[0] + FLOW_EXT
+
+
+def _flow_estimator(method: str):
+    """Return a function computing the flow between two grayscale frames with the given method."""
+    if method == "dis":
+        dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_MEDIUM)
+        return lambda prev, curr: dis.calc(prev, curr, None)
+    if method == "farneback":
+        return lambda prev, curr: cv2.calcOpticalFlowFarneback(prev, curr, None, pyr_scale=0.5, levels=3,
+                                                                winsize=15, iterations=3, poly_n=5,
+                                                                poly_sigma=1.2, flags=0)
+    raise ValueError(f"Unknown optical flow method \"{method}\"")
+
+
+def compute_flow(video_path: str, method: str = "farneback") -> np.ndarray:
+    """
+    Compute the optical flow between all pairs of consecutive frames of a video.
+
+    :param video_path:
+        Path to the video
+    :param method:
+        "farneback" or "dis"
+    :return:
+        Array of shape (num_frames - 1, height, width, 2) with the (dx, dy) flow in pixels
+    """
+    estimate = _flow_estimator(method)
+    with FrameReader(video_path, reuse_buffer=True) as reader:
+        flows = []
+        prev_gray = None
+        for frame in reader:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if prev_gray is not None:
+                flows.append(estimate(prev_gray, gray))
+            prev_gray = gray
+        shape = (0, reader.height, reader.width, 2)
+
+    return np.stack(flows) if flows else np.empty(shape, dtype=np.float32)
+
+
+def quantize_flow(flow: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize the flow to uint8, linearly between the min and max of every flow frame and channel.
+
+    :param flow:
+        Array of shape (num_flows, height, width, 2)
+    :return:
+        The quantized flow, and the (num_flows, 2, 2) array of [min, max] values per channel
+    """
+    low = flow.min(axis=(1, 2))
+    high = flow.max(axis=(1, 2))
+    scale = np.where(high > low, high - low, 1.0)[:, None, None, :]
+    quantized = np.round((flow - low[:, None, None, :]) * (255.0 / scale)).astype(np.uint8)
+
+    return quantized, np.stack((low, high), axis=-1).astype(np.float32)
+
+
+def dequantize_flow(quantized: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """Restore the float32 flow from the output of `quantize_flow`."""
+    low = bounds[:, None, None, :, 0]
+    high = bounds[:, None, None, :, 1]
+
+    return low + quantized.astype(np.float32) * ((high - low) / 255.0)
+
+
+def save_flow(video_path: str, method: str = "farneback") -> int:
+    """
+    Compute, quantize and cache the flow of a clip next to it.
+
+    :return:
+        The number of flow frames computed
+    """
+    quantized, bounds = quantize_flow(compute_flow(video_path, method))
+    np.savez(flow_path(video_path), flow=quantized, bounds=bounds, method=method)
+
+    return len(quantized)
+
+
+def load_flow_stack(video_path: str,
+                    start: int = 0,
+                    length: int = FLOW_STACK_LENGTH,
+                    size: Optional[int] = FLOW_STACK_SIZE) -> np.ndarray:
+    """
+    Load `length` consecutive flow frames of a clip from its cache as a stacked input for the
+    temporal stream, with the dx and dy channels of every flow frame interleaved.
+
+    :param video_path:
+        Path to the clip (the flow is read from its ".flow.npz" cache)
+    :param start:
+        Index of the first flow frame of the stack
+    :param length:
+        Number of flow frames in the stack
+    :param size:
+        Size to resize the flow frames to (the flow values are scaled accordingly), or None
+    :return:
+        float32 array of shape (2 * length, size, size)
+    """
+    with np.load(flow_path(video_path)) as cache:
+        flow = dequantize_flow(cache['flow'][start:start + length], cache['bounds'][start:start + length])
+
+    if size is not None:
+        height, width = flow.shape[1:3]
+        scale = np.array([size / width, size / height], dtype=np.float32)
+        flow = np.stack([cv2.resize(flow_frame, (size, size)) for flow_frame in flow]) * scale
+
+    # (length, H, W, 2) -> (length, 2, H, W) -> (2 * length, H, W)
+    return np.ascontiguousarray(flow.transpose(0, 3, 1, 2).reshape(-1, *flow.shape[1:3]))
+
+
+def _is_cached(video_path: str) -> bool:
+    """Whether the flow of the clip is cached and newer than the clip."""
+    cache_path = flow_path(video_path)
+    return os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(video_path)
+
+
+def _init_worker():
+    """Keep every worker process on a single OpenCV thread, parallelism comes from the pool."""
+    cv2.setNumThreads(1)
+
+
+def _save_flow_task(task: Tuple[str, str]) -> int:
+    return save_flow(*task)
+
+
+def _compute_flow_task(task: Tuple[str, str]) -> int:
+    return len(compute_flow(*task))
+
+
+def find_videos(dataset_dir: str) -> List[str]:
+    """Paths of all videos in the class folders of the dataset."""
+    videos = []
+    for class_name in sorted(os.listdir(dataset_dir)):
+        class_path = os.path.join(dataset_dir, class_name)
+        if os.path.isdir(class_path):
+            videos.extend(os.path.join(class_path, video) for video in sorted(os.listdir(class_path))
+                          if video.lower().endswith(VIDEO_EXT))
+    return videos
+
+
+def process_dataset(dataset_dir: str,
+                    method: str = "farneback",
+                    num_workers: Optional[int] = None,
+                    force: bool = False) -> int:
+    """
+    Compute and cache the flow of every clip of the dataset in parallel.
+
+    :param dataset_dir:
+        Path to the dataset folder, with one sub-folder of clips per class
+    :param method:
+        "farneback" or "dis"
+    :param num_workers:
+        Number of worker processes (defaults to the number of CPUs)
+    :param force:
+        Recompute the flow of clips that are already cached
+    :return:
+        The number of clips processed
+    """
+    videos = [video for video in find_videos(dataset_dir) if force or not _is_cached(video)]
+    num_videos = len(videos)
+    print(f"    [INFO]\tComputing optical flow for {num_videos} videos.")
+
+    with Pool(num_workers, initializer=_init_worker) as pool:
+        tasks = [(video, method) for video in videos]
+        for video_idx, _ in enumerate(pool.imap_unordered(_save_flow_task, tasks, chunksize=4)):
+            if (video_idx + 1) % 100 == 0 or video_idx + 1 == num_videos:
+                print(f"    [INFO]\t\t({video_idx + 1}/{num_videos})")
+
+    return num_videos
+
+
+def benchmark(dataset_dir: str,
+              method: str = "farneback",
+              num_workers: Optional[int] = None,
+              max_videos: int = 50) -> float:
+    """
+    Measure the optical flow throughput on the first videos of the dataset.
+
+    :return:
+        The throughput in flow-frames/sec
+    """
+    tasks = [(video, method) for video in find_videos(dataset_dir)[:max_videos]]
+    with Pool(num_workers, initializer=_init_worker) as pool:
+        start_time = time.perf_counter()
+        num_flows = sum(pool.map(_compute_flow_task, tasks))
+        elapsed = time.perf_counter() - start_time
+
+    flows_per_sec = num_flows / elapsed if elapsed > 0 else 0.0
+    print(f"    [INFO]\tMethod: {method}\tWorkers: {num_workers or os.cpu_count()}")
+    print(f"    [INFO]\t{num_flows} flow frames from {len(tasks)} videos in {elapsed:.2f}s")
+    print(f"    [INFO]\tThroughput: {flows_per_sec:.1f} flow-frames/sec")
+
+    return flows_per_sec
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    dataset_dir = args['<dataset_dir>']
+    method = args['--method']
+    num_workers = int(args['--workers']) if args['--workers'] else None
+
+    if not os.path.isdir(dataset_dir):
+        print(f"    [ERROR]\tThe folder \"{dataset_dir}\" doesn't exist.")
+        return
+
+    if args['--benchmark']:
+        benchmark(dataset_dir, method, num_workers, int(args['--max-videos']))
+    else:
+        process_dataset(dataset_dir, method, num_workers, args['--force'])
+
+    print("    [INFO]\tDone!")
+
+
+if __name__ == "__main__":
+    with profile_run("optical_flow"):
+        main()
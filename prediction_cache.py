@@ -0,0 +1,277 @@
+"""
+Cache of the model predictions, so that an unchanged model isn't run again on unchanged inputs.
+
+The predictions (class scores) are keyed by:
+
+    - the model fingerprint: hash of the model file(s) and of the input preprocessing settings,
+      so a retrained, re-exported or differently preprocessed model never reads stale entries
+    - the content fingerprint of the input: hash of the video file (`file_fingerprint`, checked
+      without decoding the video) or hash of the signature of a decoded clip (`clip_fingerprint`)
+
+Entries are kept in memory (LRU) and, if a database path is given, in an SQLite file shared by
+all the evaluation runs.
+
+Live clips are looked up by the fingerprint of their signature (a few gray pixels per frame), so
+only a clip with exactly the same signature as a cached one (e.g. a still scene) reuses its
+prediction. `get_similar` also matches the cached clips whose signature is within a tolerance, but
+different gestures can have close signatures (a thumbs-up and a thumbs-down clip differ by about one
+gray level), so the approximate lookup is opt-in (`test_inference.py --cache-tolerance`).
+
+Usage:
+    prediction_cache.py <database_path> [--clear]
+    prediction_cache.py (-h | --help)
+
+Options:
+    --clear             Remove all the cached predictions
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+from typing import Tuple
+import hashlib
+import os
+import sqlite3
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+from preprocessing import INPUT_SCALE
+from preprocessing import INPUT_SIZE
+
+# Size of the chunks read when hashing files
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _hash_file(path: str, digest):
+    with open(path, "rb") as file_in:
+        for chunk in iter(lambda: file_in.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+
+def model_fingerprint(model_path: str, preprocessing: str = f"{INPUT_SIZE}-{INPUT_SCALE}") -> str:
+    """
+    Fingerprint of a saved model and of the preprocessing of its inputs.
+
+    :param model_path:
+        Path to the model file, or to a SavedModel folder
+    :param preprocessing:
+        Description of the input preprocessing settings
+    :return:
+        The hex digest
+    """
+    digest = hashlib.blake2b(preprocessing.encode(), digest_size=16)
+    if os.path.isdir(model_path):
+        for root, dirs, files in os.walk(model_path):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, model_path).encode())
+                _hash_file(path, digest)
+    else:
+        _hash_file(model_path, digest)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> str:
+    """
+    Fingerprint of the content of a file (e.g. a test video).
+
+    :param path:
+        Path to the file
+    :return:
+        The hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    _hash_file(path, digest)
+    return "file:" + digest.hexdigest()
+
+
+def clip_signature(clip: np.ndarray,
+                   size: Tuple[int, int] = (8, 8),
+                   value_range: float = 255.0 * INPUT_SCALE) -> np.ndarray:
+    """
+    Perceptual signature of a preprocessed clip: every frame averaged down to a few gray pixels.
+
+    :param clip:
+        The model input clip, of shape (..., height, width, channels)
+    :param size:
+        Size (width, height) of the downscaled frames
+    :param value_range:
+        Maximum pixel value of the clip
+    :return:
+        The uint8 signature of shape (num_frames, size[1], size[0])
+    """
+    frames = clip.reshape((-1,) + clip.shape[-3:])
+    small = np.stack([cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames])
+    return np.clip(small.mean(axis=-1) * (255.0 / value_range), 0, 255).astype(np.uint8)
+
+
+def clip_fingerprint(signature: np.ndarray) -> str:
+    """
+    Fingerprint of a clip signature.
+
+    :param signature:
+        The signature from `clip_signature`
+    :return:
+        The hex digest
+    """
+    return "clip:" + hashlib.blake2b(signature.tobytes(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """In-memory LRU of the predictions, backed by an optional SQLite database."""
+
+    def __init__(self, database_path: Optional[str] = None, max_entries: int = 1024):
+        """
+        :param database_path:
+            Path to the SQLite database of the disk tier, or None to only cache in memory
+        :param max_entries:
+            Number of predictions kept in memory
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.signatures = dict()
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.database = None
+        if database_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+            self.database = sqlite3.connect(database_path, check_same_thread=False)
+            self.database.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                                  "model TEXT, content TEXT, scores BLOB, PRIMARY KEY (model, content))")
+            self.database.commit()
+
+    def _remember(self, key: Tuple[str, str], scores: np.ndarray):
+        self.entries[key] = scores
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            old_key, _ = self.entries.popitem(last=False)
+            self.signatures.pop(old_key, None)
+
+    def get(self, model: str, content: str) -> Optional[np.ndarray]:
+        """
+        Get cached class scores.
+
+        :param model:
+            The model fingerprint
+        :param content:
+            The content fingerprint of the input
+        :return:
+            The class scores, None if not cached
+        """
+        key = (model, content)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if self.database is not None:
+                row = self.database.execute("SELECT scores FROM predictions WHERE model = ? AND content = ?",
+                                            key).fetchone()
+                if row is not None:
+                    scores = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, scores)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return scores
+
+            self.misses += 1
+            return None
+
+    def get_similar(self, model: str, signature: np.ndarray, tolerance: float) -> Optional[np.ndarray]:
+        """
+        Get the cached class scores of the clip closest to the given one, from memory only.
+
+        :param model:
+            The model fingerprint
+        :param signature:
+            The signature of the clip, from `clip_signature`
+        :param tolerance:
+            Maximum mean absolute difference (gray levels) between the signatures of similar clips
+        :return:
+            The class scores, None if no similar clip is cached
+        """
+        with self.lock:
+            best_key, best_distance = None, tolerance
+            for key, cached_signature in self.signatures.items():
+                if key[0] != model or cached_signature.shape != signature.shape:
+                    continue
+                distance = np.mean(cv2.absdiff(cached_signature, signature))
+                if distance <= best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return self.entries[best_key]
+
+    def put(self, model: str, content: str, scores: np.ndarray, signature: Optional[np.ndarray] = None):
+        """
+        Cache the class scores of an input.
+
+        :param model:
+            The model fingerprint
+        :param content:
+            The content fingerprint of the input
+        :param scores:
+            The class scores of the input
+        :param signature:
+            The signature of the clip (from `clip_signature`), to find it with `get_similar`
+        """
+        scores = np.ascontiguousarray(scores, dtype=np.float32).ravel()
+        with self.lock:
+            self._remember((model, content), scores)
+            if signature is not None:
+                self.signatures[(model, content)] = signature
+            if self.database is not None:
+                self.database.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                                      (model, content, scores.tobytes()))
+                self.database.commit()
+
+    def clear(self):
+        """Remove all the cached predictions, in memory and on disk."""
+        with self.lock:
+            self.entries.clear()
+            self.signatures.clear()
+            if self.database is not None:
+                self.database.execute("DELETE FROM predictions")
+                self.database.commit()
+
+    def print_stats(self):
+        """Print the hit rate of the cache."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        print(f"    [INFO]\tPrediction cache: {self.hits} / {total} hits ({hit_rate:.1%}), "
+              f"{self.disk_hits} from disk")
+
+    def close(self):
+        """Close the database."""
+        if self.database is not None:
+            self.database.close()
+            self.database = None
+
+
+def main():
+    """Print (or clear) the content of a prediction cache database."""
+    args = docopt(__doc__)
+    cache = PredictionCache(args['<database_path>'])
+    if args['--clear']:
+        cache.clear()
+    rows = cache.database.execute("SELECT model, COUNT(*) FROM predictions GROUP BY model").fetchall()
+    for model, count in rows:
+        print(f"    [INFO]\tModel {model}: {count} cached prediction(s)")
+    if not rows:
+        print(f"    [INFO]\tNo cached predictions.")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
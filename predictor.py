@@ -0,0 +1,193 @@
+"""
+Runtime-agnostic predictors for the gesture models, and a side-by-side latency benchmark of the
+backends.
+
+Every predictor takes numpy inputs and returns the numpy class scores, whatever runs the model:
+
+    - `OnnxPredictor`           : ONNX Runtime on CPU (".onnx" files from `export_models.py`)
+    - `TorchScriptPredictor`    : TorchScript (".pt" files from `export_models.py`)
+    - `KerasPredictor`          : Keras (".h5" files, ".keras" files or SavedModel folders)
+
+Use `load_predictor` to pick the backend from the model path. The frameworks are only imported
+by the backend that needs them.
+
+Usage:
+    predictor.py <model_path>... [--shape=SHAPE]... [--iterations=N]
+    predictor.py (-h | --help)
+
+Options:
+    --shape=SHAPE       Comma separated shape of every model input [default: 1,20,100,100,3]
+    --iterations=N      Number of timed predictions per model [default: 50]
+"""
+
+from abc import ABC
+from abc import abstractmethod
+from typing import List
+from typing import Optional
+from typing import Sequence
+import os
+import time
+
+from docopt import docopt
+import numpy as np
+
+
+class Predictor(ABC):
+    """Common interface of all backends: numpy inputs in, numpy class scores out."""
+
+    backend = None
+
+    @abstractmethod
+    def predict(self, *inputs: np.ndarray) -> np.ndarray:
+        """
+        Get the class scores for a batch of inputs.
+
+        :param inputs:
+            One array per model input, batch first
+        :return:
+            The class scores of shape (batch, num_classes)
+        """
+
+
+class OnnxPredictor(Predictor):
+    """Run an ONNX model with ONNX Runtime on CPU."""
+
+    backend = "onnxruntime"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        :param model_path:
+            Path to the ".onnx" file
+        :param num_threads:
+            Number of intra-op threads (defaults to ONNX Runtime's choice)
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def predict(self, *inputs: np.ndarray) -> np.ndarray:
+        feed = {name: np.ascontiguousarray(array, dtype=np.float32) for name, array in zip(self.input_names, inputs)}
+        return self.session.run(None, feed)[0]
+
+
+class TorchScriptPredictor(Predictor):
+    """Run a TorchScript model with PyTorch on CPU."""
+
+    backend = "torchscript"
+
+    def __init__(self, model_path: str):
+        """
+        :param model_path:
+            Path to the TorchScript ".pt" file
+        """
+        import torch
+
+        self.torch = torch
+        self.model = torch.jit.load(model_path, map_location="cpu").eval()
+
+    def predict(self, *inputs: np.ndarray) -> np.ndarray:
+        with self.torch.inference_mode():
+            tensors = [self.torch.from_numpy(np.ascontiguousarray(array, dtype=np.float32)) for array in inputs]
+            return self.model(*tensors).numpy()
+
+
+class KerasPredictor(Predictor):
+    """
+    Run a Keras model (e.g. the C3D model saved by `train_c3d.py`).
+
+    With a fixed input shape, the model is called through a `tf.function` traced once for that
+    shape and warmed up on load, instead of `model.predict` which sets up a data adapter and
+    callbacks at every call (most of the latency for a single clip).
+    """
+
+    backend = "keras"
+
+    def __init__(self, model_path: str, input_shape: Optional[Sequence[int]] = None):
+        """
+        :param model_path:
+            Path to the ".h5" / ".keras" file or SavedModel folder
+        :param input_shape:
+            Fixed input shape, batch included, e.g. (1, 20, 100, 100, 3) for live inference. Use
+            `model.predict` for any input shape if not given
+        """
+        import keras
+
+        self.model = keras.models.load_model(model_path)
+        self.input_shape = tuple(input_shape) if input_shape is not None else None
+        self._predict_fn = None
+
+        if self.input_shape is not None:
+            import tensorflow as tf
+
+            self.backend = "keras-graph"
+            self._predict_fn = tf.function(lambda x: self.model(x, training=False),
+                                           input_signature=[tf.TensorSpec(self.input_shape, tf.float32)])
+            # Trace and run the graph once, so that the first clip isn't slowed down
+            self.predict(np.zeros(self.input_shape, dtype=np.float32))
+
+    def predict(self, *inputs: np.ndarray) -> np.ndarray:
+        if self._predict_fn is not None:
+            return self._predict_fn(np.ascontiguousarray(inputs[0], dtype=np.float32)).numpy()
+        return self.model.predict(inputs[0] if len(inputs) == 1 else list(inputs), verbose=0)
+
+
+def load_predictor(model_path: str, input_shape: Optional[Sequence[int]] = None) -> Predictor:
+    """
+    Create the predictor for the given model, with the backend matching its file type.
+
+    :param model_path:
+        Path to the ".onnx", ".pt", ".h5" or ".keras" file, or to a SavedModel folder
+    :param input_shape:
+        Fixed input shape of a Keras model, to run it as a compiled graph (see `KerasPredictor`)
+    :return:
+        The predictor
+    """
+    ext = os.path.splitext(model_path)[1].lower()
+    if ext == ".onnx":
+        return OnnxPredictor(model_path)
+    if ext in (".pt", ".ts"):
+        return TorchScriptPredictor(model_path)
+    return KerasPredictor(model_path, input_shape)
+
+
+def benchmark(model_paths: Sequence[str],
+              shapes: List[Sequence[int]],
+              iterations: int = 50):
+    """
+    Print the prediction latency of every model on random inputs of the given shapes.
+
+    :param model_paths:
+        Paths to the models to compare, e.g. the same model exported to several formats
+    :param shapes:
+        Shape of every model input
+    :param iterations:
+        Number of timed predictions per model
+    """
+    inputs = [np.random.rand(*shape).astype(np.float32) for shape in shapes]
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tBACKEND LATENCY (input shapes {[tuple(shape) for shape in shapes]})")
+    print(f"    [INFO]\t{'=' * 50}")
+    for model_path in model_paths:
+        predictor = load_predictor(model_path)
+        predictor.predict(*inputs)      # warm-up
+        start_time = time.perf_counter()
+        for _ in range(iterations):
+            predictor.predict(*inputs)
+        latency = (time.perf_counter() - start_time) * 1000 / iterations
+        print(f"    [INFO]\t{predictor.backend:<12}\t{latency:8.2f} ms\t{os.path.basename(model_path)}")
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    shapes = [[int(dim) for dim in shape.split(',')] for shape in args['--shape']]
+    benchmark(args['<model_path>'], shapes, int(args['--iterations']))
+
+
+if __name__ == "__main__":
+    main()
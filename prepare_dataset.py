@@ -24,48 +24,66 @@ The dataset folder structure before using this script should be something as fol
         ---------------------
 
 Usage:
+    prepare_dataset.py [--config=PATH] [--headless]
     prepare_dataset.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 import os
 import shutil
 
+from docopt import docopt
 from natsort import natsorted
 from natsort import ns
-from PyInquirer import prompt
-import numpy as np
 
 from augment_dataset import augment_dataset
+from cli import ask
+from cli import load_config
+from clip_sampler import ClipSampler
 from constants import AUGMENTATION_METHODS
-from constants import TEST_NUM_TEST_VIDEOS_PER_CLASS
+from constants import CLIP_SAMPLING_METHODS
+from constants import TEST_NUM_CLIPS_PER_VIDEO
 from constants import TEST_PATH_IN
 from constants import TEST_PATH_OUT
-from constants import TEST_PATH_TEST_VIDEOS
 from constants import TEST_RESIZE_FRAME_HEIGHT
 from constants import TEST_RESIZE_FRAME_WIDTH
+from constants import TEST_SPLIT_FRACTIONS
+from constants import TEST_SPLIT_SEED
 from constants import TEST_TARGET_FPS
 from constants import TEST_TARGET_FRAMES
 from constants import VIDEO_EXT
 from downsize_video import parse_video
-from preprocess_videos import pad_videos
+from optical_flow import process_dataset
 from preprocess_videos import resize_videos
+from preprocess_videos import sample_clips
 from preprocess_videos import video2images
+from profiling import count
+from profiling import profile_run
+from profiling import stage
+from split_dataset import make_splits
+from split_dataset import save_manifest
+from split_dataset import SPLIT_NAMES
 
 
 def main():
     """Main body"""
-    test_videos_dir = TEST_PATH_TEST_VIDEOS
-    num_test_videos_per_class = TEST_NUM_TEST_VIDEOS_PER_CLASS
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="prepare_dataset")
+    split_fractions = dict(TEST_SPLIT_FRACTIONS)
+    split_seed = TEST_SPLIT_SEED
 
     # ----------------------------------------------------------------------------------------------
     #                       Step 1 : Get path to the raw videos directory
     # ----------------------------------------------------------------------------------------------
 
-    answer_path_in = prompt({
+    answer_path_in = ask({
         'type': 'input',
         'name': 'path_in',
         'message': 'Enter the path to the videos directory: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_in = answer_path_in['path_in']
 
     # Check if the directory exists or not
@@ -80,30 +98,30 @@ def main():
     if is_dir:
         folder_names = natsorted(os.listdir(path_in), alg=ns.IC)
     else:
-        answer_folder_names = prompt({
+        answer_folder_names = ask({
             'type': 'checkbox',
             'name': 'folder_names',
             'message': 'Select the folders to process: ',
             'choices': [{'name': _file} for _file in natsorted(os.listdir(path_in), alg=ns.IC)]
-        })
+        }, config)
         folder_names = answer_folder_names['folder_names']
 
     # Get the path to save the new data folder
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save the prepared videos to: ',
         'default': TEST_PATH_OUT
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
     # Get the target FPS to downsize the videos
-    answer_target_fps = prompt({
+    answer_target_fps = ask({
         'type': 'input',
         'name': 'target_fps',
         'message': 'Enter the target FPS for the downsized videos: ',
         'default': str(TEST_TARGET_FPS)
-    })
+    }, config)
     target_fps = float(answer_target_fps['target_fps'])
 
     # New folder inside the directory to save all downsized videos to
@@ -111,74 +129,105 @@ def main():
     os.makedirs(downsized_path_out, exist_ok=True)
 
     # Get the number of frames for constant video length
-    answer_target_frames = prompt({
+    answer_target_frames = ask({
         'type': 'input',
         'name': 'target_frames',
         'message': 'Enter the number of frames per video for padding: ',
         'default': str(TEST_TARGET_FRAMES)
-    })
+    }, config)
     target_frames = float(answer_target_frames['target_frames'])
 
+    # Get the method to sample fixed-length clips from videos longer than `target_frames`
+    answer_sampling_method = ask({
+        'type': 'list',
+        'name': 'sampling_method',
+        'message': 'Select the method to sample clips from longer videos: ',
+        'choices': list(CLIP_SAMPLING_METHODS.keys())
+    }, config)
+    sampling_method = CLIP_SAMPLING_METHODS[answer_sampling_method['sampling_method']]
+
+    num_clips_per_video = 1
+    if sampling_method in ("random", "segment"):
+        answer_num_clips = ask({
+            'type': 'input',
+            'name': 'num_clips',
+            'message': 'Enter the number of clips to sample per video: ',
+            'default': str(TEST_NUM_CLIPS_PER_VIDEO)
+        }, config)
+        num_clips_per_video = int(answer_num_clips['num_clips'])
+    clip_sampler = ClipSampler(target_frames, method=sampling_method, num_clips=num_clips_per_video)
+
     # Create new directories for padded videos and respective frames
     padded_videos_directory = os.path.join(path_out, 'padded_data')
     os.makedirs(padded_videos_directory, exist_ok=True)
 
-    answer_augmentation_methods = prompt({
+    answer_augmentation_methods = ask({
         'type': 'checkbox',
         'name': 'augmentation_methods',
         'message': 'Select the data augmentation methods to apply on videos:',
         'choices': [{'name': method} for method in AUGMENTATION_METHODS.keys()]
-    })
+    }, config)
     augmentation_methods = answer_augmentation_methods['augmentation_methods']
 
     augmented_dataset_path = os.path.join(path_out, 'augmented_dataset')
     os.makedirs(augmented_dataset_path, exist_ok=True)
 
     # Get the frame size to resize the video for model training
-    answer_frame_width = prompt({
+    answer_frame_width = ask({
         'type': 'input',
         'name': 'frame_width',
         'message': 'Enter the new frame width to resize video: ',
         'default': str(TEST_RESIZE_FRAME_WIDTH)
-    })
-    answer_frame_height = prompt({
+    }, config)
+    answer_frame_height = ask({
         'type': 'input',
         'name': 'frame_height',
         'message': 'Enter the new frame width to resize video: ',
         'default': str(TEST_RESIZE_FRAME_HEIGHT)
-    })
+    }, config)
     frame_width = int(answer_frame_width['frame_width'])
     frame_height = int(answer_frame_height['frame_height'])
     new_dims = (frame_width, frame_height)
 
-    answer_create_test_set = prompt({
+    answer_compute_flow = ask({
         'type': 'list',
-        'name': 'create_test_set',
-        'message': 'Do you wish to create a test-set as well?',
+        'name': 'compute_flow',
+        'message': 'Do you wish to compute the optical flow of the clips (for the temporal stream)?',
         'choices': [
             'Yes',
             'No'
         ]
-    })
-    create_test_set = answer_create_test_set['create_test_set'] == 'Yes'
+    }, config)
+    compute_flow = answer_compute_flow['compute_flow'] == 'Yes'
 
-    if create_test_set:
-        answer_test_videos_dir = prompt({
-            'type': 'input',
-            'name': 'test_videos_dir',
-            'message': 'Enter the path to test-videos directory (auto created from this script): ',
-            'default': TEST_PATH_TEST_VIDEOS
-        })
-        test_videos_dir = answer_test_videos_dir['test_videos_dir']
-        os.makedirs(test_videos_dir, exist_ok=True)
-
-        answer_num_test_videos = prompt({
+    answer_create_splits = ask({
+        'type': 'list',
+        'name': 'create_splits',
+        'message': 'Do you wish to create train/val/test splits as well?',
+        'choices': [
+            'Yes',
+            'No'
+        ]
+    }, config)
+    create_splits = answer_create_splits['create_splits'] == 'Yes'
+
+    if create_splits:
+        for split_name in ("val", "test"):
+            answer_fraction = ask({
+                'type': 'input',
+                'name': 'fraction',
+                'message': f'Enter the fraction of recordings per class to use for the {split_name} split: ',
+                'default': str(TEST_SPLIT_FRACTIONS[split_name])
+            }, config, scope=split_name)
+            split_fractions[split_name] = float(answer_fraction['fraction'])
+
+        answer_split_seed = ask({
             'type': 'input',
-            'name': 'num_test_videos',
-            'message': 'Enter the number of test videos to be selected (per class): ',
-            'default': str(TEST_NUM_TEST_VIDEOS_PER_CLASS)
-        })
-        num_test_videos_per_class = int(answer_num_test_videos['num_test_videos'])
+            'name': 'split_seed',
+            'message': 'Enter the random seed for the splits: ',
+            'default': str(TEST_SPLIT_SEED)
+        }, config)
+        split_seed = int(answer_split_seed['split_seed'])
 
     # ----------------------------------------------------------------------------------------------
     #                           Step 2 : Downsize all videos to a target FPS
@@ -211,12 +260,12 @@ def main():
             parse_video(video_path_in, video_path_out, target_fps)
 
     # ----------------------------------------------------------------------------------------------
-    #                           Step 3 : Pad / remove frames for all videos
+    #                   Step 3 : Pad short videos / sample clips from long videos
     # ----------------------------------------------------------------------------------------------
 
     print()
     print(f"    [INFO]\t{'=' * 50}")
-    print(f"    [INFO]\t\t\tPADDING VIDEOS")
+    print(f"    [INFO]\t\t\tPADDING / SAMPLING CLIPS")
     print(f"    [INFO]\t{'=' * 50}")
 
     # Iterate through all the folders (classes) and process all videos
@@ -235,8 +284,8 @@ def main():
             video_path_in = os.path.join(folder_path, video_name)
             video_path_out = os.path.join(new_videos_folder_path, video_name)
 
-            # Call the method to pad video frames
-            pad_videos(video_path_in, video_path_out, target_frames)
+            # Call the method to pad video frames, or sample clips of `target_frames` frames
+            sample_clips(video_path_in, video_path_out, clip_sampler)
 
     # ----------------------------------------------------------------------------------------------
     #                           Step 4 : Resize video frames (width, height)
@@ -269,8 +318,9 @@ def main():
             resize_videos(video_path_in, video_path_out, new_dims)
 
             # Overwrite the existing video
-            os.remove(video_path_in)
-            os.rename(video_path_out, video_path_in)
+            with stage("io"):
+                os.remove(video_path_in)
+                os.rename(video_path_out, video_path_in)
 
     # ----------------------------------------------------------------------------------------------
     #                           Step 5 : Perform Video Data Augmentation
@@ -296,7 +346,9 @@ def main():
         for video_idx, video_name in enumerate(file_names):
             print(f"    [INFO]\t\t({video_idx + 1}/{num_videos})\tProcessing video \"{video_name}\"")
             video_path_in = os.path.join(folder_path, video_name)
-            shutil.copy(video_path_in, augmented_videos_folder_path)
+            with stage("io"):
+                shutil.copy(video_path_in, augmented_videos_folder_path)
+            count("io.bytes", os.path.getsize(video_path_in))
             for augmentation in augmentation_methods:
                 method = AUGMENTATION_METHODS.get(augmentation)
                 augmented_video_name = f"{video_name.split('.')[0]}_{method}{VIDEO_EXT}"
@@ -322,45 +374,52 @@ def main():
         new_frames_folder_path = os.path.join(padded_frames_directory, folder_name)
         os.makedirs(new_frames_folder_path, exist_ok=True)
 
-        # Get all videos inside each class folder
-        file_names = natsorted(os.listdir(folder_path), alg=ns.IC)
+        # Get all videos inside each class folder, without the optical flow caches of step 8
+        file_names = natsorted([name for name in os.listdir(folder_path) if name.lower().endswith(VIDEO_EXT)],
+                               alg=ns.IC)
         num_videos = len(file_names)
         print(f"    [INFO]\t\tFound {num_videos} videos.")
         for video_idx, video_name in enumerate(file_names):
             print(f"    [INFO]\t\t({video_idx + 1}/{num_videos})\tProcessing video \"{video_name}\"")
             video_path_in = os.path.join(folder_path, video_name)
-            frames_path_out = os.path.join(new_frames_folder_path, video_name.split('.')[0])
+            frames_path_out = os.path.join(new_frames_folder_path, os.path.splitext(video_name)[0])
             os.makedirs(frames_path_out, exist_ok=True)
 
             # Call the method to convert video to frames
             video2images(video_path_in, frames_path_out)
 
     # ----------------------------------------------------------------------------------------------
-    #                           Step 7 : Prepare test-videos directory
-    #                                   from training videos
+    #                       Step 7 : Write the train/val/test split manifest
+    # ----------------------------------------------------------------------------------------------
+
+    if create_splits:
+        # Videos stay in the augmented dataset, the manifest only lists which split they belong to
+        with stage("splits"):
+            manifest = make_splits(augmented_dataset_path, split_fractions, split_seed)
+            manifest_path = os.path.join(path_out, 'splits.json')
+            save_manifest(manifest, manifest_path)
+        print()
+        print(f"    [INFO]\tSaved split manifest to \"{manifest_path}\"")
+        for split_name in SPLIT_NAMES:
+            print(f"    [INFO]\t\t{split_name}: {len(manifest['splits'][split_name])} videos")
+
+    # ----------------------------------------------------------------------------------------------
+    #                           Step 8 : Compute optical flow of the clips
     # ----------------------------------------------------------------------------------------------
 
-    if create_test_set:
-        # Iterate through all class folders
-        for class_name in os.listdir(padded_videos_directory):
-            class_path = os.path.join(padded_videos_directory, class_name)
-            new_class_path = os.path.join(test_videos_dir, class_name)
-            os.makedirs(new_class_path, exist_ok=True)
-
-            # Get all videos in directory and randomly shuffle them
-            all_videos = natsorted(os.listdir(class_path), alg=ns.IC)
-            np.random.shuffle(all_videos)
-            # Select the first `n` videos for testing
-            video_names = all_videos[:num_test_videos_per_class]
-
-            # Copy the selected `n` videos from original dataset to test-videos directory
-            for video in video_names:
-                path_in = os.path.join(class_path, video)
-                path_out = os.path.join(new_class_path, video)
-                shutil.copy(path_in, path_out)
+    if compute_flow:
+        print()
+        print(f"    [INFO]\t{'=' * 50}")
+        print(f"    [INFO]\t\t\tCOMPUTING OPTICAL FLOW")
+        print(f"    [INFO]\t{'=' * 50}")
+
+        # The flow of every clip is cached next to it in the augmented dataset
+        with stage("optical_flow"):
+            process_dataset(augmented_dataset_path)
 
     print(f"\n    [INFO]\tDone!")
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("prepare_dataset"):
+        main()
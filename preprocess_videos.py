@@ -2,7 +2,12 @@
 Script to preprocess video.
 
 Usage:
-    preprocess_video.py (-h | --help)
+    preprocess_videos.py [--config=PATH] [--headless]
+    preprocess_videos.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
 # ===================================================================================================
@@ -56,50 +61,47 @@ import cv2
 import numpy as np
 import os
 from PIL import Image
-from constants import FOURCC
+from cli import ask
+from cli import load_config
+from clip_sampler import center_indices
+from clip_sampler import write_clips
 from constants import TEST_PATH_IN
 from constants import TEST_PATH_OUT
-from constants import PROP_ID_FPS
-from constants import PROP_ID_WIDTH
-from constants import PROP_ID_HEIGHT
 from natsort import natsorted
 from natsort import ns
-from PyInquirer import prompt
+from profiling import count
+from profiling import profile_run
+from profiling import stage
+from profiling import timed
+from docopt import docopt
+from video_codecs import open_writer
+from video_reader import count_frames
+from video_reader import FrameReader
 
 
+@timed("resize")
 def resize_videos(path_in, path_out, resize_dims):
     """Resize the current video and overwrite with the resized size video"""
-    cap = cv2.VideoCapture(path_in)
-    out = cv2.VideoWriter(path_out, FOURCC, cap.get(PROP_ID_FPS), resize_dims)
-    frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-    cap.release()
-
-    for frame in frames:
-        frame = np.array(Image.fromarray(frame).resize(resize_dims))
-        out.write(frame)
+    with FrameReader(path_in, reuse_buffer=True) as reader:
+        out = open_writer(path_out, reader.fps, resize_dims)
+        for frame in reader:
+            with stage("compute"):
+                frame = np.array(Image.fromarray(frame).resize(resize_dims))
+            with stage("encode"):
+                out.write(frame)
+            count("encode.frames")
     out.release()
 
 
+@timed("video2images")
 def video2images(path_in, path_out):
     """Convert video to frames and save as .jpg images"""
-    cap = cv2.VideoCapture(path_in)
-    frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame = np.flip(frame, axis=-1)
-        frames.append(frame)
-    cap.release()
-
-    for _id, img in enumerate(frames):
-        img = Image.fromarray(img)
-        img.save(os.path.join(path_out, f"{_id}.jpg"))
+    with FrameReader(path_in, reuse_buffer=True) as reader:
+        for _id, frame in enumerate(reader):
+            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            with stage("encode"):
+                img.save(os.path.join(path_out, f"{_id}.jpg"))
+            count("encode.frames")
 
 
 def images2video(path_in, path_out, fps):
@@ -107,7 +109,7 @@ def images2video(path_in, path_out, fps):
     frames = natsorted(os.listdir(path_in), alg=ns.IC)
     print(frames)
     img = Image.open(os.path.join(path_in, frames[0]))
-    out = cv2.VideoWriter(path_out, FOURCC, fps, img.size)
+    out = open_writer(path_out, fps, img.size)
     for frame in frames:
         img = np.array(Image.open(os.path.join(path_in, frame)))
         out.write(img)
@@ -116,75 +118,60 @@ def images2video(path_in, path_out, fps):
 
 def pad_videos(video_path_in, video_path_out, target_frames):
     """Add or remove frames for constant video length"""
-    cap = cv2.VideoCapture(video_path_in)
-    out = cv2.VideoWriter(video_path_out, FOURCC, cap.get(PROP_ID_FPS),
-                          (int(cap.get(PROP_ID_WIDTH)), int(cap.get(PROP_ID_HEIGHT))))
-
-    frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
-    cap.release()
-
-    frames = np.array(frames)
-    num_frames = len(frames)
-    diff = int(num_frames - target_frames)
-
-    new_frames = frames
-    if diff == 0:
-        pass
+    # The frame count comes from the container (see `count_frames`), so that the video is streamed
+    # and decoded only once instead of kept in memory
+    num_frames = count_frames(video_path_in)
+    if num_frames == 0:
+        print(f"    [WARN]\tSkipping \"{video_path_in}\", which has no frames")
+        return
+    write_clips(video_path_in, [video_path_out], center_indices(num_frames, int(target_frames)))
+
+
+@timed("sample_clips")
+def sample_clips(video_path_in, video_path_out, sampler):
+    """
+    Write several fixed-length clips from a single video with the given `ClipSampler`, decoding it
+    only once (the frame count comes from the container, see `count_frames`). Clips are saved as
+    "<video_path_out>_clip<i>.mp4", unless a single clip is sampled in which case it is saved at
+    `video_path_out` directly.
+
+    :return:
+        The paths the clips were saved to
+    """
+    num_frames = count_frames(video_path_in)
+    if num_frames == 0:
+        print(f"    [WARN]\tSkipping \"{video_path_in}\", which has no frames")
+        return []
+    clips = sampler(num_frames)
+    if len(clips) == 1:
+        paths_out = [video_path_out]
     else:
-        if diff > 0:
-            if diff % 2 == 0:
-                new_start_idx = diff // 2
-                new_end_idx = num_frames - diff // 2
-            else:
-                new_start_idx = diff // 2 + 1
-                new_end_idx = num_frames - diff // 2
-            new_frames = frames[new_start_idx:new_end_idx]
-
-        else:
-            diff = abs(diff)
-            if diff % 2 == 0:
-                pad_to_start = diff // 2
-                pad_to_end = diff - diff // 2
-            else:
-                pad_to_start = diff // 2
-                pad_to_end = diff - diff // 2
-
-            new_frames = []
-            for start in range(pad_to_start):
-                new_frames.append(frames[0])
-            for frame in frames:
-                new_frames.append(frame)
-            for end in range(pad_to_end):
-                new_frames.append(frames[-1])
-            new_frames = np.array(new_frames)
-
-    for frame_idx, frame in enumerate(new_frames):
-        out.write(frame)
-    out.release()
+        root, ext = os.path.splitext(video_path_out)
+        paths_out = [f"{root}_clip{clip_idx}{ext}" for clip_idx in range(len(clips))]
+    write_clips(video_path_in, paths_out, clips)
+
+    return paths_out
 
 
 def main():
     """Main body"""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="preprocess_videos")
 
     target_frames = 40
 
-    answer_path_in = prompt({
+    answer_path_in = ask({
         'type': 'input',
         'name': 'path_in',
         'message': 'Enter the path to the videos directory: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_in = answer_path_in['path_in']
     if not os.path.isdir(path_in):
         print(f"    [ERROR]\tThe folder \"{path_in}\" doesn't exist.")
         return
 
-    answer_is_dataset = prompt({
+    answer_is_dataset = ask({
         'type': 'list',
         'name': 'is_dataset',
         'message': 'Do you wish to process the complete dataset or selected folders?',
@@ -192,29 +179,29 @@ def main():
             'Complete Dataset',
             'Select Folders'
         ]
-    })
+    }, config)
     is_dataset = answer_is_dataset['is_dataset'] == "Complete Dataset"
 
     if is_dataset:
         folder_names = os.listdir(path_in)
     else:
-        answer_folder_names = prompt({
+        answer_folder_names = ask({
             'type': 'checkbox',
             'name': 'folder_names',
             'message': 'Select the folders to process: ',
             'choices': [{'name': _file} for _file in os.listdir(path_in)]
-        })
+        }, config)
         folder_names = answer_folder_names['folder_names']
 
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save the converted videos to: ',
         'default': TEST_PATH_OUT
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
-    answer_save_frames = prompt({
+    answer_save_frames = ask({
         'type': 'list',
         'name': 'save_frames',
         'message': 'Do you want to save the padded videos as frames?',
@@ -222,7 +209,7 @@ def main():
             'Yes',
             'No'
         ]
-    })
+    }, config)
     save_frames = answer_save_frames['save_frames'] == 'Yes'
 
     os.makedirs(path_out, exist_ok=True)
@@ -237,7 +224,7 @@ def main():
 
         file_names = os.listdir(folder_path)
         if not is_dataset:
-            answer_is_dir = prompt({
+            answer_is_dir = ask({
                 'type': 'list',
                 'name': 'is_dir',
                 'message': f'Do you wish to process the complete folder \"{folder.upper()}\" or selected videos?',
@@ -245,18 +232,18 @@ def main():
                     'Complete Folder',
                     'Select Videos'
                 ]
-            })
+            }, config, scope=folder)
             is_dir = answer_is_dir['is_dir'] == "Complete Folder"
 
             if is_dir:
                 file_names = os.listdir(folder_path)
             else:
-                answer_file_names = prompt({
+                answer_file_names = ask({
                     'type': 'checkbox',
                     'name': 'file_names',
                     'message': 'Select the videos to blur: ',
                     'choices': [{'name': _file} for _file in os.listdir(folder_path)]
-                })
+                }, config, scope=folder)
                 file_names = answer_file_names['file_names']
 
         num_videos = len(file_names)
@@ -275,4 +262,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("preprocess_videos"):
+        main()
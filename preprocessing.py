@@ -0,0 +1,94 @@
+"""
+Input preprocessing of the C3D model, shared by training (`train_c3d.py`, `video_dataset.py`) and
+inference (`test_videos.py`, `test_inference.py`) so that the model gets the same inputs in both.
+
+Decoded (BGR, uint8) frames are turned into the model input (RGB, float32, channels last) with a
+single contiguous pass per step and no intermediate copies:
+
+    1. resize to the model input size (skipped if the frame already has that size)
+    2. uint8 -> float32 conversion and scaling, written straight into the output buffer
+    3. BGR -> RGB conversion in place (`cv2.cvtColor` with `dst`)
+
+The output buffer can be given, e.g. a slot of a preallocated batch or of the live clip.
+"""
+
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from constants import TEST_RESIZE_FRAME_HEIGHT
+from constants import TEST_RESIZE_FRAME_WIDTH
+
+# Frame size (width, height) of the model input
+INPUT_SIZE = (TEST_RESIZE_FRAME_WIDTH, TEST_RESIZE_FRAME_HEIGHT)
+
+# Scale of the pixel values. The saved models were trained on raw 0-255 values, so keep it at 1.0
+# unless training a new model (e.g. 1 / 255 for inputs in [0, 1])
+INPUT_SCALE = 1.0
+
+
+def preprocess_frame(frame: np.ndarray,
+                     dst: Optional[np.ndarray] = None,
+                     size: Optional[Tuple[int, int]] = INPUT_SIZE,
+                     scale: float = INPUT_SCALE,
+                     bgr: bool = True) -> np.ndarray:
+    """
+    Turn a decoded frame into a model input frame.
+
+    :param frame:
+        The uint8 frame of shape (height, width, 3)
+    :param dst:
+        Contiguous float32 array of shape (size[1], size[0], 3) to write the result to, or None to
+        allocate it
+    :param size:
+        Frame size (width, height) of the model input, or None to keep the frame size
+    :param scale:
+        Factor applied to the pixel values
+    :param bgr:
+        Whether the frame is BGR (as decoded by OpenCV) and has to be converted to RGB
+    :return:
+        The float32 RGB frame (`dst` if given)
+    """
+    if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+        frame = cv2.resize(frame, tuple(size))
+
+    if dst is None:
+        dst = np.empty(frame.shape, dtype=np.float32)
+    np.multiply(frame, scale, out=dst)
+    if bgr:
+        cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+
+    return dst
+
+
+def preprocess_clip(frames: np.ndarray,
+                    dst: Optional[np.ndarray] = None,
+                    size: Optional[Tuple[int, int]] = INPUT_SIZE,
+                    scale: float = INPUT_SCALE,
+                    bgr: bool = True) -> np.ndarray:
+    """
+    Turn the decoded frames of a clip into a model input clip.
+
+    :param frames:
+        The uint8 frames of shape (clip_len, height, width, 3)
+    :param dst:
+        Contiguous float32 array of shape (clip_len, size[1], size[0], 3) to write the result to,
+        or None to allocate it
+    :param size:
+        Frame size (width, height) of the model input, or None to keep the frame size
+    :param scale:
+        Factor applied to the pixel values
+    :param bgr:
+        Whether the frames are BGR (as decoded by OpenCV) and have to be converted to RGB
+    :return:
+        The float32 RGB clip (`dst` if given)
+    """
+    if dst is None:
+        width, height = size if size is not None else (frames.shape[2], frames.shape[1])
+        dst = np.empty((len(frames), height, width, 3), dtype=np.float32)
+    for frame, frame_dst in zip(frames, dst):
+        preprocess_frame(frame, frame_dst, size, scale, bgr)
+
+    return dst
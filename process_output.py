@@ -1,28 +1,155 @@
-import keras
-import numpy as np
-import cv2
+"""
+Prediction of the MNIST/ASL models on the bounding-box image of `test_output.py`.
+
+The bounding-box image (280 x 280, BGR, mirrored for display) is turned into the model input
+(1 x 28 x 28 x 1, float32 in [0, 1] as in `train_model.py`) by a fused kernel that only makes one
+pass over the full size image:
+
+    1. `cv2.resize` with INTER_AREA straight to 28 x 28 (averages the 10 x 10 blocks, no aliasing)
+    2. grayscale conversion of the 28 x 28 image
+    3. un-mirroring and /255 scaling in the same pass, written into a preallocated input buffer
+
+`OutputModel` then calls the model through a `tf.function` traced once for that input, instead of
+`model.predict` which sets up a data adapter and callbacks at every call. Keras (and TensorFlow)
+isn't imported by this module: the caller loads the model, so importing it stays cheap.
+
+Usage:
+    process_output.py <model_path> [--iterations=N]
+    process_output.py (-h | --help)
+
+Options:
+    --iterations=N      Number of timed predictions [default: 200]
+"""
+
+from typing import Optional
 import os
+import time
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+# Input shape (batch included) of the models trained by `train_model.py`
+MODEL_INPUT_SHAPE = (1, 28, 28, 1)
+
+# Scale of the pixel values, the models were trained on inputs in [0, 1]
+INPUT_SCALE = 1.0 / 255
 
 
-def process_output(model: keras.models.Sequential, frame: np.ndarray) -> int:
+def preprocess_output(frame: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Turn the bounding-box image into the model input.
+
+    :param frame:
+        The bounding-box image (BGR, uint8), mirrored as displayed
+    :param dst:
+        Float32 array of shape (1, height, width, 1) to write the input to, or None to allocate it
+    :return:
+        The model input (`dst` if given)
+    """
+    if dst is None:
+        dst = np.empty(MODEL_INPUT_SHAPE, dtype=np.float32)
+    height, width = dst.shape[1:3]
+
+    # Area resize and grayscale are both averages, so resizing first gives the same input while
+    # converting 100 times fewer pixels
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    # The display is mirrored, the model expects the camera orientation
+    np.multiply(small[:, ::-1], INPUT_SCALE, out=dst[0, :, :, 0])
+
+    return dst
+
+
+class OutputModel:
+    """Trained model called as a compiled graph on a reused input buffer, warmed up on creation."""
+
+    def __init__(self, model):
+        """
+        :param model:
+            The saved model weights to get predictions
+        """
+        import tensorflow as tf
+
+        self.model = model
+        self.input = np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+        self._predict_fn = tf.function(lambda x: self.model(x, training=False),
+                                       input_signature=[tf.TensorSpec(self.input.shape, tf.float32)])
+        # Trace and run the graph once, so that the first frame isn't slowed down
+        self._predict_fn(self.input)
+
+    def __call__(self, frame: np.ndarray) -> int:
+        """
+        Get the predicted class of the bounding-box image.
+
+        :param frame:
+            The bounding-box image (BGR, uint8)
+        :return:
+            The predicted class
+        """
+        preprocess_output(frame, self.input)
+        return int(np.argmax(self._predict_fn(self.input).numpy()))
+
+
+def process_output(model, frame: np.ndarray) -> int:
     """
     Process the current frame from the trained model and return output class.
 
     :param model:
-        The saved model weights to get predictions
+        The `OutputModel`, or the saved model weights (run with `model.predict`, slower)
     :param frame:
         The VideoCapture frame to process
     :return:
         The predicted class
     """
+    if isinstance(model, OutputModel):
+        return model(frame)
+
+    return int(np.argmax(model.predict(preprocess_output(frame), verbose=0)))
+
+
+def benchmark(model_path: str, iterations: int = 200):
+    """
+    Print the per-frame latency of the former pipeline (full size grayscale and flip, uint8 input,
+    `model.predict`) and of `OutputModel`.
+
+    :param model_path:
+        Path to the saved model
+    :param iterations:
+        Number of timed predictions
+    """
+    import keras
+
+    model = keras.models.load_model(model_path)
+    frame = np.random.default_rng(0).integers(0, 256, (280, 280, 3), dtype=np.uint8)
+
+    def former(image):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        image = cv2.flip(image, 1)
+        image = cv2.resize(image, (28, 28))
+        return int(np.argmax(model.predict(np.reshape(image, (1, 28, 28, 1)), verbose=0)))
+
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tPER-FRAME LATENCY ({os.path.basename(model_path)})")
+    print(f"    [INFO]\t{'=' * 50}")
+    for name, predict in (("model.predict", former), ("OutputModel", OutputModel(model))):
+        predict(frame)      # warm-up
+        timings = []
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            predict(frame)
+            timings.append(time.perf_counter() - start_time)
+        timings = np.array(timings) * 1000
+        print(f"    [INFO]\t{name:<14}\tmean {timings.mean():6.2f} ms\tp50 {np.percentile(timings, 50):6.2f} ms\t"
+              f"p95 {np.percentile(timings, 95):6.2f} ms")
+
 
-    # Resize the frame from (280 x 280 x 3) to (28 x 28 x 1)
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    frame = cv2.flip(frame, 1)
-    frame = cv2.resize(frame, (28, 28))
-    input_frame = np.reshape(frame, (1, 28, 28, 1))
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    benchmark(args['<model_path>'], int(args['--iterations']))
 
-    # Get prediction
-    prediction = int(np.argmax(model.predict(input_frame)))
 
-    return prediction
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Profiling of the batch scripts: where the time of a run goes, and how fast it processes data.
+
+The scripts record into the active `Profiler` with:
+
+    - `stage(name)`             : context manager timing a stage (stages nest, e.g. "downsize/encode")
+    - `timed(name)`             : decorator timing every call of a function as a stage
+    - `count(name, value)`      : counter, e.g. "decode.frames" or "encode.bytes". The rate of a
+                                  counter is per second of the stage named by its prefix ("decode"),
+                                  or per second of the run
+
+The shared helpers are instrumented (`FrameReader` decoding as "decode", and the writes of the
+processing scripts as "encode"), so every script gets its decode / compute / encode / IO breakdown.
+A script runs its `main` in `profile_run(name)`, which writes a JSON report per run to the reports
+folder ("profiles" by default, `PROFILE_DIR` environment variable) and prints a summary. Reports are
+named "<name>-<date>-<time>-<microseconds>-<host>-<pid>.json".
+
+`cProfile` and `tracemalloc` captures are opt-in, with the `PROFILE_CPROFILE=1` and
+`PROFILE_TRACEMALLOC=1` environment variables or with `profiling.py run`. Use
+`profiling.py compare` to compare two reports and catch regressions.
+
+Usage:
+    profiling.py run [--cprofile] [--tracemalloc] [--report-dir=DIR] [--] <script> [<args>...]
+    profiling.py compare <baseline_report> <report> [--threshold=FRACTION]
+    profiling.py (-h | --help)
+
+Options:
+    --cprofile              Capture a cProfile of the run (saved next to the report)
+    --tracemalloc           Trace the memory allocations of the run (peak and top allocation sites)
+    --report-dir=DIR        Folder to save the report to (defaults to `PROFILE_DIR` or "profiles")
+    --threshold=FRACTION    Slow down of a stage reported as a regression [default: 0.1]
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from threading import local
+from typing import Optional
+import cProfile
+import datetime
+import io
+import json
+import os
+import platform
+import pstats
+import runpy
+import sys
+import time
+import tracemalloc
+
+from docopt import docopt
+
+# Default folder of the reports
+PROFILE_DIR = "profiles"
+
+# Number of functions (cProfile) and allocation sites (tracemalloc) kept in the reports
+NUM_TOP_ENTRIES = 20
+
+
+class Profiler:
+    """Stage timers and counters of one run, with optional cProfile and tracemalloc captures."""
+
+    def __init__(self, name: str = "run"):
+        """
+        :param name:
+            Name of the run (usually the script name)
+        """
+        self.name = name
+        self.stages = dict()
+        self.counters = dict()
+        self.lock = Lock()
+        self._local = local()
+        self._profile = None
+        self._start_time = None
+        self._wall_time = None
+        self._memory = None
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the enclosed block as a stage, nested in the enclosing stage of the same thread.
+
+        :param name:
+            Name of the stage
+        """
+        stack = self._stack()
+        stack.append(name)
+        path = "/".join(stack)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            stack.pop()
+            with self.lock:
+                stats = self.stages.get(path)
+                if stats is None:
+                    self.stages[path] = [1, elapsed, elapsed]
+                else:
+                    stats[0] += 1
+                    stats[1] += elapsed
+                    stats[2] = max(stats[2], elapsed)
+
+    def count(self, name: str, value: float = 1):
+        """
+        Add to a counter.
+
+        :param name:
+            Name of the counter, prefixed by the stage its rate is computed over (e.g. "decode.frames")
+        :param value:
+            Value to add
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def running(self) -> bool:
+        """Whether the run is started and not stopped yet."""
+        return self._start_time is not None and self._wall_time is None
+
+    def start(self, cprofile: bool = False, trace_memory: bool = False):
+        """
+        Start the run.
+
+        :param cprofile:
+            Capture a cProfile of the run
+        :param trace_memory:
+            Trace the memory allocations of the run
+        """
+        if trace_memory:
+            tracemalloc.start()
+        if cprofile:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._start_time = time.perf_counter()
+
+    def stop(self):
+        """Stop the run and its captures."""
+        self._wall_time = time.perf_counter() - self._start_time
+        if self._profile is not None:
+            self._profile.disable()
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self._memory = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top_allocations": [{"site": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                                    for stat in snapshot.statistics("lineno")[:NUM_TOP_ENTRIES]],
+            }
+
+    def _stage_time(self, name: str) -> float:
+        """Total time of the stages with the given name, at any nesting level."""
+        return sum(stats[1] for path, stats in self.stages.items() if path.split("/")[-1] == name)
+
+    def report(self) -> dict:
+        """The machine-readable report of the run."""
+        wall_time = self._wall_time if self._wall_time is not None else time.perf_counter() - self._start_time
+        report = {
+            "name": self.name,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "argv": sys.argv,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "wall_time": wall_time,
+            "stages": {
+                path: {"calls": calls, "total": total, "mean": total / calls, "max": longest,
+                       "share": total / wall_time if wall_time > 0 else 0.0}
+                for path, (calls, total, longest) in sorted(self.stages.items())
+            },
+            "counters": dict(),
+        }
+        for name, value in sorted(self.counters.items()):
+            stage_time = self._stage_time(name.split(".")[0]) if "." in name else 0.0
+            duration = stage_time if stage_time > 0 else wall_time
+            report["counters"][name] = {"total": value, "per_sec": value / duration if duration > 0 else 0.0}
+
+        if self._profile is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=stream)
+            report["cprofile"] = [
+                {"function": f"{filename}:{line}({function})", "calls": calls, "total": total, "cumulative": cumulative}
+                for (filename, line, function), (_, calls, total, cumulative, _) in
+                sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:NUM_TOP_ENTRIES]
+            ]
+        if self._memory is not None:
+            report["memory"] = self._memory
+        return report
+
+    def save(self, report_dir: str) -> str:
+        """
+        Write the report (and the cProfile stats, if captured) to the given folder.
+
+        :param report_dir:
+            Folder of the reports
+        :return:
+            Path of the report
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        # Concurrent runs (e.g. the workers of `distributed.py`) each write their own report
+        timestamp = f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}"
+        path = os.path.join(report_dir, f"{self.name}-{timestamp}-{platform.node()}-{os.getpid()}.json")
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+        if self._profile is not None:
+            self._profile.dump_stats(os.path.splitext(path)[0] + ".prof")
+        return path
+
+    def print_report(self):
+        """Print the stages and counters of the run."""
+        report = self.report()
+        print(f"    [INFO]\t{'=' * 50}")
+        print(f"    [INFO]\t\tPROFILE ({self.name}, {report['wall_time']:.2f}s)")
+        print(f"    [INFO]\t{'=' * 50}")
+        for path, stats in report["stages"].items():
+            print(f"    [INFO]\t{path:<30}\t{stats['total']:8.2f}s\t{stats['share']:6.1%}\t{stats['calls']} call(s)")
+        for name, stats in report["counters"].items():
+            print(f"    [INFO]\t{name:<30}\t{stats['total']:12.0f}\t{stats['per_sec']:12.1f} /s")
+        if "memory" in report:
+            print(f"    [INFO]\tPeak traced memory: {report['memory']['peak_bytes'] / 2 ** 20:.1f} MB")
+
+
+# Profiler of the current run, the helpers record into it
+_active = Profiler()
+
+
+def active_profiler() -> Profiler:
+    """The profiler of the current run."""
+    return _active
+
+
+def stage(name: str):
+    """Time the enclosed block as a stage of the current run (see `Profiler.stage`)."""
+    return _active.stage(name)
+
+
+def timed(name: Optional[str] = None):
+    """Decorator timing every call of a function as a stage of the current run."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with _active.stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: float = 1):
+    """Add to a counter of the current run (see `Profiler.count`)."""
+    _active.count(name, value)
+
+
+@contextmanager
+def profile_run(name: str):
+    """
+    Profile a run of a script: the enclosed block is recorded into a new profiler, whose report is
+    printed and saved when the block exits (even on error or interruption).
+
+    :param name:
+        Name of the run (usually the script name)
+    """
+    global _active
+
+    # Already in a run (e.g. a script started by `profiling.py run`), record into it
+    if _active.running:
+        yield _active
+        return
+
+    previous = _active
+    _active = Profiler(name)
+    _active.start(cprofile=os.environ.get("PROFILE_CPROFILE") == "1",
+                  trace_memory=os.environ.get("PROFILE_TRACEMALLOC") == "1")
+    try:
+        yield _active
+    finally:
+        _active.stop()
+        _active.print_report()
+        path = _active.save(os.environ.get("PROFILE_DIR", PROFILE_DIR))
+        print(f"    [INFO]\tProfile saved to \"{path}\"")
+        _active = previous
+
+
+def compare(baseline_path: str, report_path: str, threshold: float = 0.1) -> bool:
+    """
+    Print the stage times and counter rates of a report against a baseline report.
+
+    :param baseline_path:
+        Path to the report of the reference run
+    :param report_path:
+        Path to the report of the new run
+    :param threshold:
+        Relative slow down of a stage (or of the whole run) reported as a regression
+    :return:
+        Whether a regression was found
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+
+    rows = [("wall_time", baseline["wall_time"], report["wall_time"])]
+    rows += [(path, baseline["stages"][path]["total"], stats["total"])
+             for path, stats in report["stages"].items() if path in baseline["stages"]]
+
+    regression = False
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tCOMPARISON ({baseline['name']} -> {report['name']})")
+    print(f"    [INFO]\t{'=' * 50}")
+    for name, before, after in rows:
+        change = after / before - 1.0 if before > 0 else 0.0
+        level = "[INFO]"
+        if change > threshold:
+            level = "[WARN]"
+            regression = True
+        print(f"    {level}\t{name:<30}\t{before:8.2f}s -> {after:8.2f}s\t{change:+7.1%}")
+    for name, stats in report["counters"].items():
+        if name in baseline["counters"]:
+            print(f"    [INFO]\t{name:<30}\t{baseline['counters'][name]['per_sec']:10.1f} -> "
+                  f"{stats['per_sec']:10.1f} /s")
+    return regression
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+
+    if args['compare']:
+        if compare(args['<baseline_report>'], args['<report>'], float(args['--threshold'])):
+            sys.exit(1)
+        return
+
+    # The script's own `profile_run` picks the options up from the environment
+    if args['--cprofile']:
+        os.environ["PROFILE_CPROFILE"] = "1"
+    if args['--tracemalloc']:
+        os.environ["PROFILE_TRACEMALLOC"] = "1"
+    if args['--report-dir']:
+        os.environ["PROFILE_DIR"] = args['--report-dir']
+
+    script = args['<script>']
+    sys.argv = [script] + args['<args>']
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+
+    # The script records into the `profiling` module it imports, not into this `__main__` copy
+    import profiling
+    with profiling.profile_run(os.path.splitext(os.path.basename(script))[0]):
+        runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,23 +2,30 @@
 Script to record videos and save at desired location on local system.
 
 Usage:
+    record_video.py [--config=PATH] [--headless]
     record_video.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
-from PyInquirer import prompt
+from docopt import docopt
 from typing import Tuple
 import cv2
 import os
 import time
 
+from cli import ask
+from cli import load_config
 from constants import FPS16
 from constants import FPS24
 from constants import FPS30
-from constants import FOURCC
 from constants import STD_DIMENSIONS
 from constants import TEST_FILE_NAME
 from constants import TEST_PATH_IN
 from constants import VIDEO_EXT
+from video_codecs import open_writer
 
 FONT_STYLE = cv2.FONT_HERSHEY_PLAIN
 
@@ -151,7 +158,7 @@ def record_videos(path_out: str,
             start_time = time.time()
             is_recording = True
             path_to_save = os.path.join(path_out, video_name_num)
-            out = cv2.VideoWriter(path_to_save, FOURCC, FPS30, dims)
+            out = open_writer(path_to_save, FPS30, dims)
 
         # Hit "E" to end recording
         if key_press == ord('e') and is_recording:
@@ -181,8 +188,10 @@ def record_videos(path_out: str,
 
 def main():
     """Main body of the script to be run."""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="record_video")
 
-    answer_video_res = prompt({
+    answer_video_res = ask({
         'type': 'list',
         'name': 'video_res',
         'message': 'Select the video resolution',
@@ -191,23 +200,23 @@ def main():
             '720p',
             '1080p'
         ],
-    })
+    }, config)
     video_res = answer_video_res['video_res']
 
-    answer_path_out = prompt({
+    answer_path_out = ask({
         'type': 'input',
         'name': 'path_out',
         'message': 'Enter the path to save video to: ',
         'default': TEST_PATH_IN
-    })
+    }, config)
     path_out = answer_path_out['path_out']
 
-    answer_video_name = prompt({
+    answer_video_name = ask({
         'type': 'input',
         'name': 'video_name',
         'message': 'Enter the video name: ',
         'default': TEST_FILE_NAME
-    })
+    }, config)
     video_name = answer_video_name['video_name']
 
     if len(video_name.split('.')) < 2:
@@ -0,0 +1,220 @@
+"""
+Script to create seeded, stratified train/val/test splits of a prepared dataset as a manifest
+file, without copying any video.
+
+Videos are split per class (stratified), and all the videos coming from the same source recording
+(its clips and their augmented versions, e.g. "user02_0.mp4", "user02_0_clip1.mp4" and
+"user02_0_clip1_flipped.mp4") always end up in the same split, so that no recording leaks from the
+training set into the validation or test sets.
+
+The manifest is a JSON file that looks like:
+
+    {
+        "dataset_dir": "/path-to-the-dataset",
+        "seed": 42,
+        "fractions": {"val": 0.15, "test": 0.15},
+        "class_names": ["background", "clap", ...],
+        "splits": {
+            "train": [{"path": "clap/user02_0.mp4", "label": 1}, ...],
+            "val": [...],
+            "test": [...]
+        }
+    }
+
+with video paths relative to `dataset_dir`, so the dataset folder can be moved as long as the new
+location is passed to `manifest_videos`.
+
+Usage:
+    split_dataset.py [--config=PATH] [--headless]
+    split_dataset.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import json
+import os
+import re
+
+from docopt import docopt
+from natsort import natsorted
+from natsort import ns
+import numpy as np
+
+from cli import ask
+from cli import load_config
+from constants import AUGMENTATION_METHODS
+from constants import TEST_PATH_OUT
+from constants import TEST_SPLIT_FRACTIONS
+from constants import TEST_SPLIT_SEED
+from constants import VIDEO_EXT
+
+SPLIT_NAMES = ("train", "val", "test")
+
+# Suffixes added to the video names by `sample_clips` and the data augmentation methods
+_AUGMENTATION_SUFFIX = re.compile(f"_({'|'.join(AUGMENTATION_METHODS.values())})$")
+_CLIP_SUFFIX = re.compile(r"_clip\d+$")
+
+
+def recording_group(video_name: str) -> str:
+    """
+    Name of the source recording of a video, i.e. its name without the clip and augmentation
+    suffixes.
+
+    :param video_name:
+        File name of the video, e.g. "user02_0_clip1_flipped.mp4"
+    :return:
+        The name of the recording, e.g. "user02_0"
+    """
+    name = os.path.splitext(video_name)[0]
+    name = _AUGMENTATION_SUFFIX.sub("", name)
+    return _CLIP_SUFFIX.sub("", name)
+
+
+def _split_sizes(num_groups: int, fractions: Dict[str, float]) -> Dict[str, int]:
+    """Number of groups per split, keeping at least one group for training."""
+    sizes = {name: int(round(num_groups * fractions.get(name, 0.0))) for name in ("val", "test")}
+    while sizes["val"] + sizes["test"] >= num_groups and sizes["val"] + sizes["test"] > 0:
+        largest = "test" if sizes["test"] >= sizes["val"] else "val"
+        sizes[largest] -= 1
+    sizes["train"] = num_groups - sizes["val"] - sizes["test"]
+
+    return sizes
+
+
+def make_splits(dataset_dir: str,
+                fractions: Dict[str, float],
+                seed: int) -> dict:
+    """
+    Split the videos of every class of the dataset by source recording.
+
+    :param dataset_dir:
+        Path to the dataset folder, with one sub-folder of videos per class
+    :param fractions:
+        Fraction of the recordings of each class to put in the "val" and "test" splits, the rest
+        goes to "train"
+    :param seed:
+        Seed for the random assignment of recordings to splits
+    :return:
+        The manifest, as described in the module docstring
+    """
+    rng = np.random.default_rng(seed)
+    class_names = natsorted(os.listdir(dataset_dir), alg=ns.IC)
+    splits = {name: [] for name in SPLIT_NAMES}
+
+    for label, class_name in enumerate(class_names):
+        videos = natsorted([video for video in os.listdir(os.path.join(dataset_dir, class_name))
+                            if video.lower().endswith(VIDEO_EXT)], alg=ns.IC)
+        groups = dict()
+        for video in videos:
+            groups.setdefault(recording_group(video), []).append(video)
+
+        group_names = list(groups.keys())
+        rng.shuffle(group_names)
+        sizes = _split_sizes(len(group_names), fractions)
+
+        start = 0
+        for split_name in SPLIT_NAMES:
+            for group_name in group_names[start:start + sizes[split_name]]:
+                for video in groups[group_name]:
+                    splits[split_name].append({'path': f"{class_name}/{video}", 'label': label})
+            start += sizes[split_name]
+
+    return {
+        'dataset_dir': os.path.abspath(dataset_dir),
+        'seed': seed,
+        'fractions': {name: fractions.get(name, 0.0) for name in ("val", "test")},
+        'class_names': class_names,
+        'splits': splits,
+    }
+
+
+def save_manifest(manifest: dict, path_out: str):
+    """Save the manifest as a JSON file."""
+    with open(path_out, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def load_manifest(path_in: str) -> dict:
+    """Load a manifest saved with `save_manifest`."""
+    with open(path_in) as manifest_file:
+        return json.load(manifest_file)
+
+
+def manifest_videos(manifest: dict,
+                    split_name: str,
+                    dataset_dir: Optional[str] = None) -> List[Tuple[str, int]]:
+    """
+    Videos of one split of the manifest.
+
+    :param manifest:
+        The loaded manifest
+    :param split_name:
+        One of "train", "val" or "test"
+    :param dataset_dir:
+        Path to the dataset folder, if it was moved since the manifest was made
+    :return:
+        List of (video path, class index) pairs
+    """
+    dataset_dir = dataset_dir or manifest['dataset_dir']
+    return [(os.path.join(dataset_dir, *entry['path'].split('/')), entry['label'])
+            for entry in manifest['splits'][split_name]]
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="split_dataset")
+
+    answer_dataset_dir = ask({
+        'type': 'input',
+        'name': 'dataset_dir',
+        'message': 'Enter the path to the prepared dataset directory: ',
+        'default': os.path.join(TEST_PATH_OUT, 'augmented_dataset')
+    }, config)
+    dataset_dir = answer_dataset_dir['dataset_dir']
+    if not os.path.isdir(dataset_dir):
+        print(f"    [ERROR]\tThe folder \"{dataset_dir}\" doesn't exist.")
+        return
+
+    fractions = dict()
+    for split_name in ("val", "test"):
+        answer_fraction = ask({
+            'type': 'input',
+            'name': 'fraction',
+            'message': f'Enter the fraction of recordings per class to use for the {split_name} split: ',
+            'default': str(TEST_SPLIT_FRACTIONS[split_name])
+        }, config, scope=split_name)
+        fractions[split_name] = float(answer_fraction['fraction'])
+
+    answer_seed = ask({
+        'type': 'input',
+        'name': 'seed',
+        'message': 'Enter the random seed for the splits: ',
+        'default': str(TEST_SPLIT_SEED)
+    }, config)
+    seed = int(answer_seed['seed'])
+
+    answer_path_out = ask({
+        'type': 'input',
+        'name': 'path_out',
+        'message': 'Enter the path to save the split manifest to: ',
+        'default': os.path.join(os.path.dirname(os.path.abspath(dataset_dir)), 'splits.json')
+    }, config)
+    path_out = answer_path_out['path_out']
+
+    manifest = make_splits(dataset_dir, fractions, seed)
+    save_manifest(manifest, path_out)
+    for split_name in SPLIT_NAMES:
+        print(f"    [INFO]\t{split_name}: {len(manifest['splits'][split_name])} videos")
+
+    print("    [INFO]\tDone!")
+
+
+if __name__ == "__main__":
+    main()
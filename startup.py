@@ -0,0 +1,189 @@
+"""
+Startup cost of the scripts: what they import, and how long the live scripts take to show their
+first frame.
+
+The heavy frameworks (Keras / TensorFlow, Torch, ONNX Runtime, PyInquirer) are only imported on
+first use, by the function that needs them. The live scripts (`test_inference.py`, `test_output.py`)
+load their model with `ModelLoader`, on a background thread: the camera opens and frames are shown
+while the model (and TensorFlow) loads, and predictions start once it's ready.
+
+`startup.py imports` runs `python -X importtime -c "import <module>"` for every module, and prints
+its import time, its heaviest top-level imports and the heavy frameworks it pulls in at startup.
+`startup.py first-frame` starts a live script with `--first-frame` on a video file standing in for
+the camera, and prints the time from the start of the process to its first frame.
+
+Usage:
+    startup.py imports [<module>...] [--top=N]
+    startup.py first-frame <source> [<script>...] [--runs=N]
+    startup.py (-h | --help)
+
+Options:
+    --top=N             Number of heaviest imports printed per module [default: 5]
+    --runs=N            Number of runs per script (the fastest is kept) [default: 3]
+"""
+
+from glob import glob
+from threading import Event
+from threading import Thread
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import os
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+# Top-level packages that should never be imported at startup
+HEAVY_PACKAGES = ("keras", "tensorflow", "torch", "onnxruntime", "PyInquirer", "prompt_toolkit", "sklearn", "pandas")
+
+# Live scripts timed by `startup.py first-frame`
+LIVE_SCRIPTS = ("test_inference.py", "test_output.py")
+
+# Line printed by the live scripts with `--first-frame`
+FIRST_FRAME_MESSAGE = "First frame ready"
+
+
+class ModelLoader(Thread):
+    """Load a model on a background thread, to overlap it with the camera warm-up."""
+
+    def __init__(self, load: Callable[[], object]):
+        """
+        :param load:
+            Function loading and returning the model (imports of its framework included)
+        """
+        Thread.__init__(self, daemon=True)
+        self.load = load
+        self.model = None
+        self.error = None
+        self.load_time = None
+        self.loaded = Event()
+
+    def run(self):
+        start_time = time.perf_counter()
+        try:
+            self.model = self.load()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.load_time = time.perf_counter() - start_time
+            self.loaded.set()
+
+    @property
+    def ready(self) -> bool:
+        """Whether the model is loaded (or failed to load)."""
+        return self.loaded.is_set()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get the model, waiting for it to be loaded.
+
+        :param timeout:
+            Maximum time to wait in seconds, None to wait until it's loaded
+        :return:
+            The model, None if it's not loaded before the timeout
+        """
+        if not self.loaded.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+
+def _run_importtime(code: str) -> List[Tuple[int, int, int, str]]:
+    """(self us, cumulative us, nesting level, module name) of every module imported by the code."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(self_time), int(cumulative), level, name.strip()))
+    return entries
+
+
+def import_times(module: str) -> Tuple[float, Dict[str, float], List[str]]:
+    """
+    Import time of a module, on top of the interpreter startup.
+
+    :param module:
+        Name of the module
+    :return:
+        The total import time in seconds, the cumulative import time of every top-level import of
+        the module in seconds (heaviest first), and the heavy packages (see `HEAVY_PACKAGES`) it imports
+    """
+    baseline = {name for _, _, _, name in _run_importtime("pass")}
+    entries = [entry for entry in _run_importtime(f"import {module}") if entry[3] not in baseline]
+
+    # The module is at level 0, its own imports at level 1
+    total = sum(cumulative for _, cumulative, level, _ in entries if level == 0) / 1e6
+    imports = {name: cumulative / 1e6 for _, cumulative, level, name in entries if level == 1}
+    packages = {name.split(".")[0] for _, _, _, name in entries}
+    heavy = [package for package in HEAVY_PACKAGES if package in packages]
+    return total, dict(sorted(imports.items(), key=lambda item: item[1], reverse=True)), heavy
+
+
+def first_frame_time(script: str, source: str) -> Optional[float]:
+    """
+    Time from the start of a live script to its first frame.
+
+    :param script:
+        Path to the live script
+    :param source:
+        Video file (or camera index) used as the camera
+    :return:
+        The time in seconds, None if the script exited without showing a frame
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script, "--first-frame", f"--source={source}"],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    elapsed = None
+    for line in process.stdout:
+        if FIRST_FRAME_MESSAGE in line:
+            elapsed = time.perf_counter() - start_time
+            break
+    process.kill()
+    process.wait()
+    return elapsed
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+
+    if args['imports']:
+        modules = args['<module>'] or sorted(os.path.splitext(os.path.basename(path))[0]
+                                             for path in glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+        print(f"    [INFO]\t{'=' * 50}")
+        print(f"    [INFO]\t\tIMPORT TIME")
+        print(f"    [INFO]\t{'=' * 50}")
+        for module in modules:
+            total, imports, heavy = import_times(module)
+            heaviest = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in list(imports.items())[:int(args['--top'])])
+            level = "[WARN]" if heavy else "[INFO]"
+            print(f"    {level}\t{module:<20}\t{total:6.2f}s\t{heaviest}")
+            if heavy:
+                print(f"    [WARN]\t\tHeavy packages imported at startup: {', '.join(heavy)}")
+        return
+
+    scripts = args['<script>'] or [os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+                                   for script in LIVE_SCRIPTS]
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tTIME TO FIRST FRAME ({args['<source>']})")
+    print(f"    [INFO]\t{'=' * 50}")
+    for script in scripts:
+        timings = [first_frame_time(script, args['<source>']) for _ in range(int(args['--runs']))]
+        timings = [timing for timing in timings if timing is not None]
+        if not timings:
+            print(f"    [ERROR]\t{os.path.basename(script)} exited without showing a frame.")
+            continue
+        print(f"    [INFO]\t{os.path.basename(script):<20}\t{min(timings):6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Streaming mode of the C3D model for the overlapping live windows of `test_inference.py`.
+
+The live clips overlap (a new 20-frame clip every 10 frames), so the full model would process
+every frame twice. The first Conv3D / MaxPooling3D blocks are local in time: their output at a
+given temporal position only depends on a few consecutive frames. `StreamingC3D` caches those
+outputs by the index of the first frame they depend on, and for every new clip only computes the
+positions that weren't in the previous clips, then runs the rest of the model on the cached
+features. The scores are the same as the full model's (up to float rounding).
+
+The overlap with the previous clip is found from the frames themselves, so `StreamingC3D` is a
+drop-in `Predictor` for clips built by shifting new frames in (and a clip without overlap is
+simply computed in full).
+
+The benchmark compares the latency per clip of the full model and of the streaming model on a
+stream of random frames, with the given step between two clips.
+
+Usage:
+    streaming_c3d.py [<model_path>] [--step=N] [--cached-blocks=N] [--iterations=N]
+    streaming_c3d.py (-h | --help)
+
+Options:
+    --step=N            Number of new frames between two clips [default: 10]
+    --cached-blocks=N   Number of Conv3D / MaxPooling3D blocks with cached outputs [default: 2]
+    --iterations=N      Number of timed clips [default: 50]
+"""
+
+from typing import Optional
+import time
+
+from docopt import docopt
+import numpy as np
+
+from predictor import Predictor
+
+
+class StreamingC3D(Predictor):
+    """Run the C3D model on overlapping clips, reusing the outputs of its first blocks."""
+
+    backend = "keras-streaming"
+
+    def __init__(self, model, cached_blocks: int = 2):
+        """
+        :param model:
+            The C3D model (see `train_c3d.get_c3d_model`)
+        :param cached_blocks:
+            Number of leading Conv3D / MaxPooling3D blocks whose outputs are cached. Every block
+            must have a "valid" Conv3D of temporal stride 1 followed by a MaxPooling3D
+        """
+        import keras
+        import tensorflow as tf
+
+        self.model = model
+        self.clip_shape = tuple(model.input_shape[1:])
+
+        # Sub-models sharing the layers (and weights) of the model: one per cached block, with any
+        # number of frames, and the rest of the model on the output of the last cached block
+        self.blocks = []
+        self.strides = [1]
+        self.kernels = []
+        outputs = keras.Input(self.clip_shape)
+        for block_idx in range(cached_blocks):
+            conv, pool = model.layers[2 * block_idx:2 * block_idx + 2]
+            if not isinstance(conv, keras.layers.Conv3D) or not isinstance(pool, keras.layers.MaxPooling3D):
+                raise ValueError(f"Layers {2 * block_idx} and {2 * block_idx + 1} of the model aren't a "
+                                 f"Conv3D / MaxPooling3D block")
+            if conv.padding != "valid" or conv.strides[0] != 1 or pool.strides[0] != pool.pool_size[0]:
+                raise ValueError(f"Block {block_idx} of the model can't be computed incrementally in time")
+
+            block_input = keras.Input((None,) + tuple(outputs.shape[2:]))
+            block = keras.Model(block_input, pool(conv(block_input)))
+            self.blocks.append(tf.function(lambda x, block=block: block(x, training=False), reduce_retracing=True))
+            self.kernels.append((conv.kernel_size[0], pool.pool_size[0]))
+            self.strides.append(self.strides[-1] * pool.pool_size[0])
+            outputs = pool(conv(outputs))
+
+        head_input = x = keras.Input(tuple(outputs.shape[1:]))
+        for layer in model.layers[2 * cached_blocks:]:
+            x = layer(x)
+        head = keras.Model(head_input, x)
+        self.head = tf.function(lambda x: head(x, training=False), reduce_retracing=True)
+
+        # Outputs of every cached level (level 0 being the frames), by first frame index
+        self.features = [dict() for _ in range(cached_blocks + 1)]
+        self.last_clip = None
+        self.start = 0
+        self.num_computed = np.zeros(cached_blocks, dtype=np.int64)
+        self.num_reused = np.zeros(cached_blocks, dtype=np.int64)
+
+    def reset(self):
+        """Forget the cached features (e.g. when the stream is interrupted)."""
+        for features in self.features:
+            features.clear()
+        self.last_clip = None
+
+    def _shift(self, clip: np.ndarray) -> Optional[int]:
+        """Number of frames the clip is ahead of the previous one, None if they don't overlap."""
+        if self.last_clip is None:
+            return None
+        for shift in range(1, len(clip)):
+            if np.array_equal(clip[0], self.last_clip[shift]) and np.array_equal(clip[:-shift], self.last_clip[shift:]):
+                return shift
+        return None
+
+    def predict(self, *inputs: np.ndarray) -> np.ndarray:
+        clip = inputs[0]
+        if clip.shape[0] != 1:
+            return np.concatenate([self.predict(single[np.newaxis]) for single in clip])
+        clip = np.ascontiguousarray(clip[0], dtype=np.float32)
+
+        shift = self._shift(clip)
+        if shift is None:
+            self.reset()
+            self.start += len(clip)
+        else:
+            self.start += shift
+        self.last_clip = clip
+
+        # Drop what the new clip doesn't need anymore
+        for features in self.features:
+            for first_frame in [first_frame for first_frame in features if first_frame < self.start]:
+                del features[first_frame]
+
+        for idx, frame in enumerate(clip):
+            self.features[0][self.start + idx] = frame
+
+        num_positions = len(clip)
+        for level, (block, (kernel, pool)) in enumerate(zip(self.blocks, self.kernels), start=1):
+            stride, input_stride = self.strides[level], self.strides[level - 1]
+            num_positions = (num_positions - kernel + 1) // pool
+            starts = [self.start + stride * position for position in range(num_positions)]
+            missing = [position for position, first_frame in enumerate(starts) if first_frame not in self.features[level]]
+            self.num_reused[level - 1] += num_positions - len(missing)
+            self.num_computed[level - 1] += len(missing)
+            if not missing:
+                continue
+
+            # The missing positions are the last ones of the clip, computed in one call from the
+            # inputs they depend on
+            first, last = missing[0], missing[-1]
+            block_inputs = np.stack([self.features[level - 1][self.start + input_stride * position]
+                                     for position in range(first * pool, last * pool + pool + kernel - 1)])
+            outputs = block(block_inputs[np.newaxis]).numpy()[0]
+            for position, output in zip(range(first, last + 1), outputs):
+                self.features[level][starts[position]] = output
+
+        head_inputs = np.stack([self.features[-1][self.start + self.strides[-1] * position]
+                                for position in range(num_positions)])
+        return self.head(head_inputs[np.newaxis]).numpy()
+
+    def print_stats(self):
+        """Print the fraction of the cached block outputs reused from previous clips."""
+        for level, (computed, reused) in enumerate(zip(self.num_computed, self.num_reused), start=1):
+            total = computed + reused
+            print(f"    [INFO]\tBlock {level}: {reused} / {total} outputs reused ({reused / max(total, 1):.1%})")
+
+
+def benchmark(model, step: int = 10, cached_blocks: int = 2, iterations: int = 50):
+    """
+    Print the latency per clip of the full model and of the streaming model, on a stream of random
+    frames with a new clip every `step` frames.
+
+    :param model:
+        The C3D model
+    :param step:
+        Number of new frames between two clips
+    :param cached_blocks:
+        Number of blocks with cached outputs
+    :param iterations:
+        Number of timed clips
+    """
+    import tensorflow as tf
+
+    clip_shape = (1,) + tuple(model.input_shape[1:])
+    full_model = tf.function(lambda x: model(x, training=False), input_signature=[tf.TensorSpec(clip_shape, tf.float32)])
+    streaming = StreamingC3D(model, cached_blocks)
+
+    rng = np.random.default_rng(0)
+    frames = rng.uniform(0, 255, (clip_shape[1] + step * (iterations + 2),) + clip_shape[2:]).astype(np.float32)
+    clips = [frames[np.newaxis, start:start + clip_shape[1]] for start in range(0, step * (iterations + 2), step)]
+
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tLATENCY PER CLIP (new clip every {step} frames)")
+    print(f"    [INFO]\t{'=' * 50}")
+    latencies = dict()
+    for name, predict in (("full model", lambda clip: full_model(clip).numpy()), ("streaming", streaming.predict)):
+        predict(clips[0])     # warm-up (the streaming model traces both call shapes)
+        predict(clips[1])
+        timings = []
+        scores = []
+        for clip in clips[2:]:
+            start_time = time.perf_counter()
+            scores.append(predict(clip))
+            timings.append((time.perf_counter() - start_time) * 1000)
+        latencies[name] = (np.array(timings), np.concatenate(scores))
+        print(f"    [INFO]\t{name:<12}\tmean {np.mean(timings):7.2f} ms\tp50 {np.percentile(timings, 50):7.2f} ms")
+
+    difference = np.abs(latencies["full model"][1] - latencies["streaming"][1]).max()
+    print(f"    [INFO]\tMax score difference: {difference:.2e}")
+    streaming.print_stats()
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    if args['<model_path>']:
+        import keras
+
+        model = keras.models.load_model(args['<model_path>'])
+    else:
+        from constants import TEST_RESIZE_FRAME_HEIGHT
+        from constants import TEST_RESIZE_FRAME_WIDTH
+        from constants import TEST_TARGET_FRAMES
+        from train_c3d import get_c3d_model
+
+        print(f"    [INFO]\tNo model given, benchmarking an untrained C3D model.")
+        model = get_c3d_model((TEST_TARGET_FRAMES, TEST_RESIZE_FRAME_HEIGHT, TEST_RESIZE_FRAME_WIDTH, 3), 8)
+
+    benchmark(model, int(args['--step']), int(args['--cached-blocks']), int(args['--iterations']))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,64 @@
+"""
+Script to run live inference of the C3D model on the webcam stream.
+
+The Keras model is run as a `tf.function` graph compiled for the fixed clip shape (see
+`KerasPredictor`). Use `--benchmark` to compare its latency per clip with `model.predict`.
+
+Clips are only predicted while something moves in front of the camera (see `motion_gate.py`),
+the idle stream is shown as "background" without running the model. Clips with the same perceptual
+signature as a recently predicted one (see `prediction_cache.py`) reuse its prediction. Reusing the
+prediction of clips with close signatures is opt-in (`--cache-tolerance`), since different gestures
+can have close signatures.
+With `--streaming`, the outputs of the first C3D blocks are reused between overlapping clips (see
+`streaming_c3d.py`).
+
+The model (and its framework) is loaded on a background thread while the camera opens (see
+`startup.py`): frames are shown right away, and clips are predicted once the model is ready. Use
+`--first-frame` to only time the startup.
+
+Usage:
+    test_inference.py [--no-motion-gate] [--no-cache | --cache-tolerance=T] [--streaming] [--source=SOURCE] [--first-frame]
+    test_inference.py --benchmark [--iterations=N]
+    test_inference.py (-h | --help)
+
+Options:
+    --no-motion-gate    Predict every clip, even when nothing moves
+    --no-cache          Predict every clip, even when the same one was just predicted
+    --cache-tolerance=T  Also reuse the prediction of a cached clip whose signature differs by at most
+                         T gray levels on average (approximate: similar gestures can be mixed up)
+    --streaming         Only compute the first C3D blocks on the new frames of every clip (Keras model)
+    --source=SOURCE     Camera index, or video file to use instead of the camera [default: 0]
+    --first-frame       Exit once the first frame is ready to be shown (see `startup.py first-frame`)
+    --benchmark         Print the latency per clip of the compiled graph vs. `model.predict`
+    --iterations=N      Number of timed clips per predict path [default: 100]
+"""
+
 import time
 
+from docopt import docopt
 import cv2
 import numpy as np
-import keras
 from threading import Thread
 import queue
 
+from motion_gate import MotionGate
+from prediction_cache import PredictionCache
+from prediction_cache import clip_fingerprint
+from prediction_cache import clip_signature
+from prediction_cache import model_fingerprint
+from predictor import KerasPredictor
+from predictor import load_predictor
+from preprocessing import preprocess_frame
+from startup import FIRST_FRAME_MESSAGE
+from startup import ModelLoader
+
+# Keras model, or its ONNX / TorchScript export from `export_models.py`
 weights_path = r"E:/LakeheadU/Final Project Data/model_weights/complete_model.h5"
 FONT_STYLE = cv2.FONT_HERSHEY_PLAIN
 
+# Input shape of the model: a single clip of 20 frames of (100 x 100 x 3)
+CLIP_SHAPE = (1, 20, 100, 100, 3)
+
 class_names = [
     'background',
     'clap',
@@ -29,9 +79,12 @@ class Inference(Thread):
     Thread to get the predictions for a set of 20 frames from the input video stream.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, cache=None, model_key=None, tolerance=None):
         Thread.__init__(self)
         self.model = model
+        self.cache = cache
+        self.model_key = model_key
+        self.tolerance = tolerance
         self.shutdown = False
         self.queue_in = queue.Queue(1)
         self.queue_out = queue.Queue(1)
@@ -80,7 +133,20 @@ class Inference(Thread):
                 self.queue_out.put(predictions, False)
 
     def infer(self, frames):
+        if self.cache is not None:
+            signature = clip_signature(frames)
+            if self.tolerance is None:
+                scores = self.cache.get(self.model_key, clip_fingerprint(signature))
+            else:
+                scores = self.cache.get_similar(self.model_key, signature, self.tolerance)
+            if scores is not None:
+                return np.argmax(scores[np.newaxis], axis=1)
+
         predictions = self.model.predict(frames)
+        if self.cache is not None:
+            # The signatures are only kept for the approximate lookups
+            self.cache.put(self.model_key, clip_fingerprint(signature), predictions[0],
+                           signature if self.tolerance is not None else None)
         predictions = np.argmax(predictions, axis=1)
 
         return predictions
@@ -104,7 +170,7 @@ class VideoStream(Thread):
         self.shutdown = True
 
     def get_image(self):
-        """Get the set of frames from the FIFO queue of frames."""
+        """Get the set of frames from the FIFO queue of frames, None once the stream has ended."""
         return self.frames.get()
 
     def run(self):
@@ -126,22 +192,70 @@ class VideoStream(Thread):
             if delay > 0:
                 time.sleep(delay)
 
+        # Wake up the consumer at the end of the stream (e.g. of a video file)
+        if self.frames.full():
+            self.frames.get_nowait()
+        self.frames.put(None, False)
+
+
+def benchmark(iterations=100):
+    """
+    Print the latency per clip of the compiled `tf.function` predict path vs. `model.predict`.
+
+    :param iterations:
+        Number of timed clips per predict path
+    """
+    clip = np.random.randint(0, 256, CLIP_SHAPE).astype(np.float32)
+    predictors = [
+        ("model.predict", KerasPredictor(weights_path)),
+        ("tf.function", KerasPredictor(weights_path, input_shape=CLIP_SHAPE)),
+    ]
+
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tLIVE INFERENCE LATENCY PER CLIP")
+    print(f"    [INFO]\t{'=' * 50}")
+    for name, predictor in predictors:
+        predictor.predict(clip)     # warm-up
+        latencies = []
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            predictor.predict(clip)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        print(f"    [INFO]\t{name:<14}\tmean {np.mean(latencies):7.2f} ms\t"
+              f"p50 {np.percentile(latencies, 50):7.2f} ms\tp95 {np.percentile(latencies, 95):7.2f} ms")
+
 
 def main():
     """Main body"""
+    args = docopt(__doc__)
+    if args['--benchmark']:
+        benchmark(int(args['--iterations']))
+        return
+
     for c_idx, c_name in enumerate(class_names):
         INT2LAB[c_idx] = c_name
         LAB2INT[c_name] = c_idx
 
-    model = keras.models.load_model(weights_path)
-    cap = cv2.VideoCapture(0)
+    # Load the model in the background while the camera opens
+    def load():
+        if args['--streaming']:
+            from streaming_c3d import StreamingC3D
+            return StreamingC3D(KerasPredictor(weights_path).model)
+        return load_predictor(weights_path, input_shape=CLIP_SHAPE)
+
+    loader = ModelLoader(load)
+    loader.start()
+
+    source = args['--source']
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
 
     # initial random frames to get prediction
-    frames = np.random.randn(1, 20, 100, 100, 3)
+    frames = np.random.randn(*CLIP_SHAPE).astype(np.float32)
 
-    inference = Inference(model)
+    cache = None if args['--no-cache'] else PredictionCache(max_entries=64)
+    tolerance = float(args['--cache-tolerance']) if args['--cache-tolerance'] else None
+    inference = None
     video_stream = VideoStream(video_source=cap)
-    inference.start()
     video_stream.start()
 
     # Current frame index to use while comparing with `step_size`
@@ -153,6 +267,9 @@ def main():
     # Save previous predictions in case new predictions is `None`
     old_predictions = 0
 
+    # Skip the model while nothing moves
+    gate = None if args['--no-motion-gate'] else MotionGate("camera")
+
     while True:
         try:
             frame_idx += 1
@@ -161,29 +278,41 @@ def main():
             if frame is None:
                 break
 
+            if inference is None and loader.ready:
+                model = loader.get()
+                inference = Inference(model, cache, model_fingerprint(weights_path), tolerance)
+                inference.start()
+                print(f"    [INFO]\tModel loaded in {loader.load_time:.2f}s")
+
             frame = cv2.flip(frame, 1)
             frame_copy = frame.copy()
-            frame = cv2.resize(frame, (100, 100))
             frames = np.roll(frames, -1, 1)
-            frames[:, -1, :, :, :] = frame
+            preprocess_frame(frame, dst=frames[0, -1])
+            active = gate is None or gate.update(frame)
 
-            if frame_idx == step_size:
+            if frame_idx == step_size and active and inference is not None:
                 # A new clip is ready
                 inference.put_nowait(frames)
 
             frame_idx = frame_idx % step_size
 
-            predictions = inference.get_nowait()
+            predictions = inference.get_nowait() if inference is not None else None
 
-            if predictions is None:
+            if not active:
+                predictions = LAB2INT['background']
+            elif predictions is None:
                 predictions = old_predictions
 
             old_predictions = predictions
 
-            cv2.putText(frame_copy, f"Predicted : {INT2LAB[predictions]}",
+            label = INT2LAB[predictions] if inference is not None else "loading model"
+            cv2.putText(frame_copy, f"Predicted : {label}",
                         (20, 20), FONT_STYLE, 1.5, (255, 255, 255), 2)
             cv2.putText(frame_copy, f"Q : Quit", (frame_copy.shape[1] - 150, frame_copy.shape[0] - 20),
                         FONT_STYLE, 1.5, (255, 255, 255), 2)
+            if args['--first-frame']:
+                print(f"    [INFO]\t{FIRST_FRAME_MESSAGE}")
+                break
             cv2.imshow("Inference", frame_copy)
 
             if cv2.waitKey(1) == ord('q'):
@@ -197,7 +326,14 @@ def main():
     cap.release()
     cv2.destroyAllWindows()
     video_stream.stop()
-    inference.stop()
+    if inference is not None:
+        inference.stop()
+    if gate is not None:
+        gate.print_stats()
+    if cache is not None:
+        cache.print_stats()
+    if args['--streaming'] and inference is not None:
+        inference.model.print_stats()
 
 
 if __name__ == "__main__":
@@ -1,29 +1,174 @@
 """
 Script to run output test window for final testing.
 
+The model runs on a background thread (`AsyncPredictor`), so the window is refreshed at the camera
+frame rate however slow the model is: only the latest bounding-box image is predicted, every
+`stride` frames (adapted to the model latency), and the last predictions are smoothed so that the
+displayed class doesn't flicker. Images are only predicted while something moves in the bounding-box
+(see `motion_gate.py`), the last prediction is kept while it's still.
+
+The overlay (dimmed background, bounding-box and text) is composited in place into the camera frame
+by `OverlayCompositor`, from layers precomputed once per resolution.
+
+The model (and TensorFlow) is loaded on a background thread while the camera opens (see
+`startup.py`): the window shows the camera right away, and predictions start once the model is
+ready. Use `--first-frame` to only time the startup.
+
 Usage:
-    test_output.py [--dataset=DATASET]
+    test_output.py [--dataset=DATASET] [--smoothing=METHOD] [--window=K] [--no-motion-gate] [--source=SOURCE] [--first-frame]
+    test_output.py --benchmark [--iterations=N]
     test_output.py (-h | --help)
 
 Options:
     --dataset=DATASET   Select the dataset to get the trained model (MNIST or ASL)
+    --smoothing=METHOD  Smoothing of the predictions, majority "vote" or "ema" [default: vote]
+    --window=K          Number of last predictions to smooth over [default: 5]
+    --no-motion-gate    Predict the bounding-box image even when nothing moves
+    --source=SOURCE     Camera index, or video file to use instead of the camera [default: 0]
+    --first-frame       Exit once the first frame is ready to be shown (see `startup.py first-frame`)
+    --benchmark         Print the per-frame cost of the overlay at 480p, 720p and 1080p
+    --iterations=N      Number of frames composited per resolution [default: 200]
 """
 
+from collections import Counter
+from collections import OrderedDict
+from collections import deque
 from docopt import docopt
-from keras.models import load_model
+from threading import Condition
+from threading import Thread
+from typing import Optional
 from typing import Tuple
 import cv2
+import math
 import numpy as np
 import os
+import time
 
 from constants import DATASETS
 from constants import INT2LAB
 from constants import MODEL_BASE_PATH
 from constants import STD_COLORS
+from motion_gate import MotionGate
+from process_output import OutputModel
 from process_output import process_output
+from startup import FIRST_FRAME_MESSAGE
+from startup import ModelLoader
 
 FONT_STYLE = cv2.FONT_HERSHEY_PLAIN
 
+# Maximum number of frames between two predictions
+MAX_INFERENCE_STRIDE = 10
+
+
+class PredictionSmoother:
+    """
+    Temporal smoothing of the predicted classes: majority vote over the last `window` predictions,
+    or exponential moving average of their one-hot encodings (with the same center of mass).
+    """
+
+    def __init__(self, window: int = 5, method: str = 'vote'):
+        """
+        :param window:
+            Number of last predictions to smooth over
+        :param method:
+            Either "vote" or "ema"
+        """
+        if method not in ('vote', 'ema'):
+            raise ValueError(f"Unknown smoothing method \"{method}\", expected \"vote\" or \"ema\"")
+        self.method = method
+        self.history = deque(maxlen=window)
+        self.alpha = 2.0 / (window + 1)
+        self.scores = dict()
+
+    def update(self, prediction: int) -> int:
+        """
+        Add a new prediction and get the smoothed one.
+
+        :param prediction:
+            The latest predicted class
+        :return:
+            The smoothed predicted class
+        """
+        if self.method == 'vote':
+            self.history.append(prediction)
+            # Ties go to the most recent prediction
+            counts = Counter(self.history)
+            best = max(counts.values())
+            return next(label for label in reversed(self.history) if counts[label] == best)
+
+        for label in self.scores:
+            self.scores[label] *= 1.0 - self.alpha
+        self.scores[prediction] = self.scores.get(prediction, 0.0) + self.alpha
+        return max(self.scores, key=self.scores.get)
+
+
+class AsyncPredictor(Thread):
+    """
+    Thread running the model on the latest submitted image (latest-frame-wins: an image that
+    wasn't predicted yet is replaced by a newer one), with smoothed predictions.
+    """
+
+    def __init__(self, model, camera_fps: float = 30.0, smoother: Optional[PredictionSmoother] = None):
+        """
+        :param model:
+            The trained model (or `OutputModel`), run with `process_output`
+        :param camera_fps:
+            Frame rate of the camera, to adapt the inference stride to the model latency
+        :param smoother:
+            Smoothing of the predictions (none if None)
+        """
+        Thread.__init__(self, daemon=True)
+        self.model = model
+        self.frame_interval = 1.0 / camera_fps
+        self.smoother = smoother
+        self.shutdown = False
+        self.condition = Condition()
+        self.pending = None
+        self.prediction = None
+        self.latency = 0.0
+        self.stride = 1
+        self.num_predictions = 0
+        self.num_dropped = 0
+
+    def submit(self, image: np.ndarray):
+        """
+        Set the image to predict next, replacing the pending one if the model is still busy.
+
+        :param image:
+            The bounding-box image, not modified afterwards by the caller
+        """
+        with self.condition:
+            if self.pending is not None:
+                self.num_dropped += 1
+            self.pending = image
+            self.condition.notify()
+
+    def stop(self):
+        """Terminate the predictor."""
+        with self.condition:
+            self.shutdown = True
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.shutdown:
+                    self.condition.wait()
+                if self.shutdown:
+                    return
+                image, self.pending = self.pending, None
+
+            start_time = time.perf_counter()
+            prediction = process_output(self.model, image)
+            latency = time.perf_counter() - start_time
+
+            # Moving average of the latency, and the number of frames it lasts
+            self.latency = latency if self.num_predictions == 0 else 0.8 * self.latency + 0.2 * latency
+            self.stride = min(max(math.ceil(self.latency / self.frame_interval), 1), MAX_INFERENCE_STRIDE)
+            self.num_predictions += 1
+
+            self.prediction = self.smoother.update(prediction) if self.smoother is not None else prediction
+
 
 def put_background(frame: np.ndarray,
                    top_left: Tuple[int, int],
@@ -84,48 +229,261 @@ def put_bbox(frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     return frame, sub_img
 
 
+class OverlayCompositor:
+    """
+    Same overlay as `put_bbox` (dimmed background, bounding-box outline) and text, composited in
+    place into the frame without any full-frame allocation.
+
+    The overlay is precomputed once per frame resolution as a per-pixel gain and an additive layer,
+    so that every frame only costs one `cv2.multiply` and one `cv2.add`:
+
+        frame = frame * gain / 255 + layer
+
+    The gain is 255 inside the bounding-box, `(1 - alpha) * 255` outside and 0 on the outline,
+    which the layer paints (anti-aliased edges are blended by the gain and layer values). Texts are
+    rendered the same way once per string, on their own small region.
+    """
+
+    def __init__(self,
+                 alpha: float = 0.65,
+                 color: str = 'Black',
+                 box_color: str = 'Pink',
+                 box_size: int = 280,
+                 max_texts: int = 64):
+        """
+        :param alpha:
+            The weight of darkness of the background
+        :param color:
+            The color to fill the background with
+        :param box_color:
+            The bounding-box outline color
+        :param box_size:
+            Size in pixels of the square bounding-box (right of the frame center)
+        :param max_texts:
+            Number of rendered texts to keep
+        """
+        self.alpha = alpha
+        self.color = STD_COLORS[color]
+        self.box_color = STD_COLORS[box_color]
+        self.box_size = box_size
+        self.max_texts = max_texts
+        self.shape = None
+        self.box = None
+        self.gain = None
+        self.layer = None
+        self.texts = OrderedDict()
+
+    def _build(self, shape: Tuple[int, ...]):
+        """Precompute the gain and layer of the overlay for frames of the given shape."""
+        height, width = shape[:2]
+        mid_y, mid_x = height // 2, width // 2
+        half = self.box_size // 2
+        self.box = (slice(mid_y - half, mid_y + half), slice(mid_x, mid_x + self.box_size))
+
+        gain = np.full((height, width), 1.0 - self.alpha, dtype=np.float32)
+        gain[self.box] = 1.0
+        layer = np.empty((height, width, 3), dtype=np.float32)
+        layer[:] = np.multiply(self.color, self.alpha, dtype=np.float32)
+        layer[self.box] = 0.0
+
+        # Coverage of the anti-aliased outline, drawn over the dimmed background
+        outline = np.zeros((height, width), dtype=np.uint8)
+        cv2.rectangle(outline, (mid_x, mid_y - half), (mid_x + self.box_size, mid_y + half), 255, 2, cv2.LINE_AA)
+        coverage = outline.astype(np.float32) / 255.0
+        gain *= 1.0 - coverage
+        layer = layer * (1.0 - coverage[..., None]) + np.multiply.outer(coverage, self.box_color)
+
+        self.gain = cv2.merge([np.rint(gain * 255.0).astype(np.uint8)] * 3)
+        self.layer = np.rint(layer).astype(np.uint8)
+        self.shape = shape
+        self.texts.clear()
+
+    def apply(self, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Put the dimmed background and the bounding-box on the frame, in place.
+
+        :param frame:
+            The VideoCapture frame to add the bounding-box to
+        :return:
+            The frame with the bounding-box, and a copy of the bounding-box image
+        """
+        if frame.shape != self.shape:
+            self._build(frame.shape)
+
+        # Copied before compositing, and a new image for every frame (it's handed to the predictor)
+        sub_img = frame[self.box].copy()
+        cv2.multiply(frame, self.gain, dst=frame, scale=1.0 / 255.0)
+        cv2.add(frame, self.layer, dst=frame)
+
+        return frame, sub_img
+
+    def put_text(self,
+                 frame: np.ndarray,
+                 text: str,
+                 org: Tuple[int, int] = (10, 30),
+                 scale: float = 1.5,
+                 color: str = 'White',
+                 thickness: int = 2):
+        """
+        Put a text on the frame, in place (same as `cv2.putText` with `FONT_STYLE`).
+
+        :param frame:
+            The frame to put the text on
+        :param text:
+            The text
+        :param org:
+            The x and y coordinates of the bottom-left corner of the text
+        :param scale:
+            Font scale
+        :param color:
+            Color of the text
+        :param thickness:
+            Thickness of the text strokes
+        """
+        key = (text, org, scale, color, thickness)
+        if key not in self.texts:
+            (text_width, text_height), baseline = cv2.getTextSize(text, FONT_STYLE, scale, thickness)
+            x, y = org
+            top, bottom = max(y - text_height - thickness, 0), min(y + baseline + thickness, frame.shape[0])
+            left, right = max(x - thickness, 0), min(x + text_width + thickness, frame.shape[1])
+
+            coverage = np.zeros((bottom - top, right - left), dtype=np.uint8)
+            cv2.putText(coverage, text, (x - left, y - top), FONT_STYLE, scale, 255, thickness, cv2.LINE_AA)
+            coverage = coverage.astype(np.float32) / 255.0
+            gain = cv2.merge([np.rint((1.0 - coverage) * 255.0).astype(np.uint8)] * 3)
+            layer = np.rint(np.multiply.outer(coverage, STD_COLORS[color])).astype(np.uint8)
+
+            self.texts[key] = ((slice(top, bottom), slice(left, right)), gain, layer)
+            if len(self.texts) > self.max_texts:
+                self.texts.popitem(last=False)
+        self.texts.move_to_end(key)
+
+        region, gain, layer = self.texts[key]
+        roi = frame[region]
+        cv2.multiply(roi, gain, dst=roi, scale=1.0 / 255.0)
+        cv2.add(roi, layer, dst=roi)
+
+
+def benchmark(iterations: int = 200):
+    """
+    Print the per-frame cost of the overlay with `put_bbox` and with `OverlayCompositor`.
+
+    :param iterations:
+        Number of frames composited per resolution
+    """
+    rng = np.random.default_rng(0)
+    for width, height in ((640, 480), (1280, 720), (1920, 1080)):
+        frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        compositor = OverlayCompositor()
+
+        def legacy(image):
+            image, _ = put_bbox(image)
+            cv2.putText(image, "Predicted : 7", (10, 30), FONT_STYLE, 1.5, (255, 255, 255), 2, cv2.LINE_AA)
+
+        def composited(image):
+            compositor.apply(image)
+            compositor.put_text(image, "Predicted : 7")
+
+        results = []
+        for overlay in (legacy, composited):
+            overlay(frame.copy())
+            timings = []
+            for _ in range(iterations):
+                image = frame.copy()
+                start_time = time.perf_counter()
+                overlay(image)
+                timings.append(time.perf_counter() - start_time)
+            results.append(np.median(timings) * 1000)
+
+        print(f"    [INFO]\t{width}x{height}\tput_bbox {results[0]:.2f} ms/frame\t"
+              f"compositor {results[1]:.2f} ms/frame\t(x{results[0] / results[1]:.1f})")
+
+
 def main():
     """Main body of the script to be run."""
 
     args = docopt(__doc__)
+    if args["--benchmark"]:
+        benchmark(int(args["--iterations"]))
+        return
+
     dataset = args["--dataset"] or "MNIST"
 
     if dataset not in DATASETS.keys():
         print(f"    [INFO]\t\"{dataset} not in the list of datasets trained on.\"")
         return
 
-    cap = cv2.VideoCapture(0)
-
     use_int2lab = False
     if dataset == "ASL":
         use_int2lab = True
 
-    # Load the saved model
+    # Load the saved model in the background while the camera opens, called as a compiled graph on
+    # a reused input buffer (see `process_output.py`)
     model_select = DATASETS[dataset]
     MODEL_PATH = os.path.join(MODEL_BASE_PATH, model_select)
 
-    model = load_model(MODEL_PATH)
+    def load():
+        from keras.models import load_model
+        return OutputModel(load_model(MODEL_PATH))
+
+    loader = ModelLoader(load)
+    loader.start()
+
+    source = args["--source"]
+    cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+    # Post-processing and prediction run in the background on the latest "sub_img", once the model
+    # is loaded
+    smoother = PredictionSmoother(int(args["--window"]), args["--smoothing"])
+    predictor = None
 
+    compositor = OverlayCompositor()
+    gate = None if args["--no-motion-gate"] else MotionGate("bounding-box")
+    frame_idx = 0
     while True:
         _, frame = cap.read()
+        if frame is None:
+            break
         frame = cv2.flip(frame, 1)
-        frame, sub_img = put_bbox(frame)
-
-        # Do post-processing and prediction on "sub_img"
-        prediction = process_output(model, sub_img)
-
-        # Convert int label to alphabet if ASL dataset is selected
-        if use_int2lab:
+        frame, sub_img = compositor.apply(frame)
+
+        if predictor is None and loader.ready:
+            predictor = AsyncPredictor(loader.get(), camera_fps=cap.get(cv2.CAP_PROP_FPS) or 30.0, smoother=smoother)
+            predictor.start()
+            print(f"    [INFO]\tModel loaded in {loader.load_time:.2f}s")
+
+        # "sub_img" is a new image for every frame, so it is handed over without copy
+        active = gate is None or gate.update(sub_img)
+        if predictor is not None and active and frame_idx % predictor.stride == 0:
+            predictor.submit(sub_img)
+        frame_idx += 1
+
+        prediction = predictor.prediction if predictor is not None else None
+        if predictor is None:
+            prediction = "loading model"
+        elif prediction is None:
+            prediction = "..."
+        elif use_int2lab:
+            # Convert int label to alphabet if ASL dataset is selected
             prediction = INT2LAB[prediction]
 
-        cv2.putText(frame, f"Predicted : {prediction}", (10, 30), FONT_STYLE, 1.5, (255, 255, 255), 2, cv2.LINE_AA)
+        compositor.put_text(frame, f"Predicted : {prediction}")
 
+        if args["--first-frame"]:
+            print(f"    [INFO]\t{FIRST_FRAME_MESSAGE}")
+            break
         cv2.imshow("Video", frame)
 
         if cv2.waitKey(1) == ord('q'):
             cv2.destroyAllWindows()
             break
 
+    if predictor is not None:
+        predictor.stop()
+        print(f"    [INFO]\t{predictor.num_predictions} predictions ({predictor.latency * 1000:.1f} ms), "
+              f"{predictor.num_dropped} images dropped, inference stride {predictor.stride}")
+    if gate is not None:
+        gate.print_stats()
     cap.release()
 
 
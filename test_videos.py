@@ -1,7 +1,11 @@
 """
 Script to select saved model and run on test-videos to get testing accuracy.
 
-Test videos directory should be of the following format:
+The saved model can be the Keras model (".h5") or one of its exports from `export_models.py`
+(".onnx" run with ONNX Runtime, ".pt" run with TorchScript), see `predictor.py`.
+
+The test videos are either the "test" split of a manifest created by `split_dataset.py` (or by
+`prepare_dataset.py`), or a test videos directory of the following format:
 
     /path-to-test-videos/
         |--- class_1
@@ -22,63 +26,140 @@ Test videos directory should be of the following format:
         |   |--- video_n.mp4
         ---------------------
 
+The predictions are cached per (model, video file) in an SQLite database (see
+`prediction_cache.py`), so evaluating an unchanged model on unchanged test videos again doesn't
+decode nor predict anything.
+
 Usage:
+    test_videos.py [--config=PATH] [--headless]
     test_videos.py (-h | --help)
+
+Options:
+    --config=PATH       YAML file with the answers to the prompts (see `cli.py`)
+    --headless          Never prompt, the answers missing from the config take their defaults
 """
 
 import os
 
+from docopt import docopt
 from natsort import natsorted
 from natsort import ns
-from PyInquirer import prompt
-import cv2
-import keras
 import numpy as np
 
+from cli import ask
+from cli import load_config
+from constants import TEST_PATH_OUT
 from constants import TEST_PATH_TEST_VIDEOS
+from constants import TEST_PREDICTION_CACHE
 from constants import TEST_SAVED_MODELS_DIRECTORY
+from prediction_cache import PredictionCache
+from prediction_cache import file_fingerprint
+from prediction_cache import model_fingerprint
+from predictor import load_predictor
+from preprocessing import preprocess_clip
+from profiling import profile_run
+from split_dataset import load_manifest
+from split_dataset import manifest_videos
+from video_reader import FrameReader
 
 
 def main():
     """Main body."""
-    answer_test_videos_dir = prompt({
-        'type': 'input',
-        'name': 'test_videos_dir',
-        'message': 'Enter the path to test-videos directory: ',
-        'default': TEST_PATH_TEST_VIDEOS
-    })
-    test_videos_dir = answer_test_videos_dir['test_videos_dir']
-    if not os.path.isdir(test_videos_dir):
-        print(f"    [ERROR]\tThe folder \"{test_videos_dir}\" doesn't exist.")
-        return
-
-    answer_saved_models_dir = prompt({
+    args = docopt(__doc__)
+    config = load_config(args['--config'], args['--headless'], section="test_videos")
+
+    answer_test_source = ask({
+        'type': 'list',
+        'name': 'test_source',
+        'message': 'Select the test videos to use: ',
+        'choices': [
+            'Split manifest',
+            'Test-videos directory'
+        ]
+    }, config)
+    use_manifest = answer_test_source['test_source'] == 'Split manifest'
+
+    if use_manifest:
+        answer_manifest_path = ask({
+            'type': 'input',
+            'name': 'manifest_path',
+            'message': 'Enter the path to the split manifest: ',
+            'default': os.path.join(TEST_PATH_OUT, 'splits.json')
+        }, config)
+        manifest_path = answer_manifest_path['manifest_path']
+        if not os.path.isfile(manifest_path):
+            print(f"    [ERROR]\tThe file \"{manifest_path}\" doesn't exist.")
+            return
+        manifest = load_manifest(manifest_path)
+        class_names = manifest['class_names']
+        test_videos = manifest_videos(manifest, 'test')
+    else:
+        answer_test_videos_dir = ask({
+            'type': 'input',
+            'name': 'test_videos_dir',
+            'message': 'Enter the path to test-videos directory: ',
+            'default': TEST_PATH_TEST_VIDEOS
+        }, config)
+        test_videos_dir = answer_test_videos_dir['test_videos_dir']
+        if not os.path.isdir(test_videos_dir):
+            print(f"    [ERROR]\tThe folder \"{test_videos_dir}\" doesn't exist.")
+            return
+        class_names = natsorted(os.listdir(test_videos_dir), alg=ns.IC)
+        test_videos = []
+        for label, class_name in enumerate(class_names):
+            class_path = os.path.join(test_videos_dir, class_name)
+            for video in natsorted(os.listdir(class_path), alg=ns.IC):
+                test_videos.append((os.path.join(class_path, video), label))
+
+    answer_saved_models_dir = ask({
         'type': 'input',
         'name': 'saved_models_dir',
         'message': 'Enter the path to saved models directory: ',
         'default': TEST_SAVED_MODELS_DIRECTORY
-    })
+    }, config)
     saved_models_dir = answer_saved_models_dir['saved_models_dir']
     saved_models = natsorted(os.listdir(saved_models_dir), alg=ns.IC)
 
-    answer_model_weights = prompt({
+    answer_model_weights = ask({
         'type': 'list',
         'name': 'model_weights',
         'message': 'Select the model weights to use for testing',
         'choices': saved_models
-    })
+    }, config)
     model_weights = answer_model_weights['model_weights']
     model_weights_path = os.path.join(saved_models_dir, model_weights)
-    model = keras.models.load_model(model_weights_path)
+
+    answer_use_cache = ask({
+        'type': 'confirm',
+        'name': 'use_cache',
+        'message': 'Use the cached predictions of this model (if any)? ',
+        'default': True
+    }, config)
+    cache = None
+    cached_scores = dict()
+    if answer_use_cache['use_cache']:
+        cache = PredictionCache(TEST_PREDICTION_CACHE)
+        model_key = model_fingerprint(model_weights_path)
+        for video_path, _ in test_videos:
+            cached_scores[video_path] = cache.get(model_key, file_fingerprint(video_path))
+
+    # The model (and its framework) is only loaded if some predictions aren't cached
+    model = None
+    if any(cached_scores.get(video_path) is None for video_path, _ in test_videos):
+        model = load_predictor(model_weights_path)
 
     print()
     print(f"    [INFO]\t{'=' * 50}")
     print(f"    [INFO]\t\t\tMODEL SUMMARY")
     print(f"    [INFO]\t{'=' * 50}")
-    print(model.summary())
+    if model is None:
+        print(f"    [INFO]\tAll the predictions are cached, the model wasn't loaded")
+    else:
+        print(f"    [INFO]\tBackend: {model.backend}")
+        if hasattr(model, 'model') and hasattr(model.model, 'summary'):
+            print(model.model.summary())
     print()
 
-    class_names = natsorted(os.listdir(test_videos_dir), alg=ns.IC)
     lab2int_mapping = dict()
     int2lab_mapping = dict()
     _idx = 0
@@ -97,25 +178,23 @@ def main():
     true_labels = []
     predicted_labels = []
     for class_name in class_names:
-        class_path = os.path.join(test_videos_dir, class_name)
         class_actual = []
         class_predictions = []
-        videos_list = natsorted(os.listdir(class_path), alg=ns.IC)
-        for video in videos_list:
-            video_path = os.path.join(class_path, video)
-            cap = cv2.VideoCapture(video_path)
-            frames = []
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                frame = np.flip(frame, axis=-1)
-                frames.append(frame)
-            cap.release()
-            frames = np.array(frames)
-            frames = np.expand_dims(frames, axis=0)
-
-            prediction = np.argmax(model.predict(frames))
+        videos_list = [path for path, label in test_videos if label == lab2int_mapping[class_name]]
+        if not videos_list:
+            continue
+        for video_path in videos_list:
+            scores = cached_scores.get(video_path)
+            if scores is None:
+                with FrameReader(video_path, reuse_buffer=True) as reader:
+                    frames = preprocess_clip(reader.read_all())
+                frames = np.expand_dims(frames, axis=0)
+
+                scores = model.predict(frames)[0]
+                if cache is not None:
+                    cache.put(model_key, file_fingerprint(video_path), scores)
+
+            prediction = int(np.argmax(scores))
             class_predictions.append(prediction)
             class_actual.append(lab2int_mapping[class_name])
             true_labels.append(class_name)
@@ -145,9 +224,14 @@ def main():
     print(f"    [INFO]\t\tModel Testing Accuracy: {overall_accuracy}")
     print(f"    [INFO]\t{'=' * 50}")
 
+    if cache is not None:
+        cache.print_stats()
+        cache.close()
+
     print(f"    [INFO]")
     print(f"    [INFO]\tDone!")
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("test_videos"):
+        main()
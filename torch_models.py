@@ -0,0 +1,323 @@
+"""
+Script to run the Torch models (Models folder) on the prepared dataset, from the repository root
+like the other scripts:
+
+    - features : extract the frozen ResNet-50 features of the dataset frames once into a
+                 `Feature_Store`, then train the custom head of `Spatial_CNN` on them
+    - quantize : compare the accuracy, latency and size of the fp32, int8 dynamic and int8 static
+                 (calibrated on the first half of the batches) versions of a stream, see `Quantization`
+    - fusion   : train the SVM fusion of the two-stream model (`Two_Stream`) on the class scores
+                 of the trained streams, for the clips with an optical flow cache
+    - train    : data-parallel training of a stream (torch.distributed, gloo backend), on the
+                 prepared clips or on synthetic inputs to benchmark the throughput. Run it on several
+                 workers with `python distributed.py launch torch <N> -- torch_models.py train ...`
+
+The samples are read from the prepared clips with the helpers of the other scripts (`FrameReader`,
+and the optical flow cache of `optical_flow.py` for the temporal stream).
+
+Usage:
+    torch_models.py features <dataset_dir> <store_dir> [--frame-stride=N]
+    torch_models.py quantize (spatial | temporal) <dataset_dir> [<weights_path>] [--batches=N]
+    torch_models.py fusion <dataset_dir> <spatial_weights> <temporal_weights> <svm_weights> [--epochs=N] [--batch-size=N]
+    torch_models.py train (spatial | temporal) (<dataset_dir> | --synthetic) [--epochs=N] [--batch-size=N]
+    torch_models.py (-h | --help)
+
+Options:
+    --frame-stride=N    Only use every N-th frame of the clips [default: 1]
+    --batches=N         Number of batches of 16 samples to calibrate and evaluate with [default: 16]
+    --synthetic         Train on random inputs, without decoding
+    --epochs=N          Number of training epochs, 1 by default (50 passes over the stream scores for fusion)
+    --batch-size=N      Number of samples per batch (and per worker) [default: 16]
+"""
+
+from typing import Optional
+import os
+import sys
+import time
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+from optical_flow import find_videos
+from optical_flow import flow_path
+from optical_flow import load_flow_stack
+from video_reader import FrameReader
+
+# The Torch models import each other as sibling modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Models"))
+
+
+def class_index(video_path: str, class_names: list) -> int:
+    """Label of a clip, from the name of its class folder."""
+    return class_names.index(os.path.basename(os.path.dirname(video_path)))
+
+
+def normalized_frame(frame: np.ndarray, size: int = 216):
+    """Frame resized to (size, size) and normalized for ResNet-50, as a (3, H, W) float tensor."""
+    import torch
+    from Feature_Store import IMAGENET_MEAN
+    from Feature_Store import IMAGENET_STD
+
+    frame = cv2.cvtColor(cv2.resize(frame, (size, size)), cv2.COLOR_BGR2RGB)
+    frame = (frame.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return torch.from_numpy(frame.transpose(2, 0, 1))
+
+
+def video_frame_samples(dataset_dir: str, frame_stride: int = 1, size: int = 216, seed: Optional[int] = None):
+    """
+    Frames of the videos of a dataset folder (one sub-folder per class), normalized for ResNet-50,
+    as (key, label, frame) samples for `Feature_Store.build`. Keys are "<class>/<video>:<frame>".
+
+    :param dataset_dir:
+        Path to the dataset folder
+    :param frame_stride:
+        Only use every `frame_stride`-th frame of the videos
+    :param size:
+        Size of the square frames
+    :param seed:
+        Seed to shuffle the videos with, or None to go through them class by class
+    """
+    class_names = sorted(os.listdir(dataset_dir))
+    videos = find_videos(dataset_dir)
+    if seed is not None:
+        np.random.default_rng(seed).shuffle(videos)
+    for video_path in videos:
+        label = class_index(video_path, class_names)
+        key = f"{os.path.basename(os.path.dirname(video_path))}/{os.path.basename(video_path)}"
+        with FrameReader(video_path, stride=frame_stride) as reader:
+            for idx, frame in enumerate(reader):
+                yield f"{key}:{idx * frame_stride}", label, normalized_frame(frame, size)
+
+
+def center_frame(video_path: str, size: int = 216):
+    """Middle frame of a clip, normalized for the spatial stream."""
+    with FrameReader(video_path) as reader:
+        middle = max(reader.frame_count // 2, 0)
+    with FrameReader(video_path, start=middle, stop=middle + 1) as reader:
+        frame = next(iter(reader))
+    return normalized_frame(frame, size)
+
+
+class CenterFrameDataset:
+    """Middle frame of every prepared clip, normalized for the spatial stream (a map-style dataset)."""
+
+    def __init__(self, dataset_dir: str, size: int = 216):
+        self.class_names = sorted(os.listdir(dataset_dir))
+        self.videos = find_videos(dataset_dir)
+        self.size = size
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __getitem__(self, idx):
+        video = self.videos[idx]
+        return center_frame(video, self.size), class_index(video, self.class_names)
+
+
+class FlowStackDataset:
+    """First optical flow stack of every prepared clip with a flow cache (see `optical_flow.py`)."""
+
+    def __init__(self, dataset_dir: str):
+        self.class_names = sorted(os.listdir(dataset_dir))
+        self.videos = [video for video in find_videos(dataset_dir) if os.path.isfile(flow_path(video))]
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __getitem__(self, idx):
+        import torch
+
+        video = self.videos[idx]
+        return torch.from_numpy(load_flow_stack(video)), class_index(video, self.class_names)
+
+
+def batches(samples, batch_size: int, max_batches: int):
+    """Group (input, label) samples into at most `max_batches` (inputs, labels) batches."""
+    import torch
+
+    inputs, labels, num_batches = [], [], 0
+    for sample, label in samples:
+        inputs.append(sample)
+        labels.append(label)
+        if len(inputs) == batch_size:
+            yield torch.stack(inputs), torch.tensor(labels)
+            inputs, labels, num_batches = [], [], num_batches + 1
+            if num_batches == max_batches:
+                return
+    if inputs:
+        yield torch.stack(inputs), torch.tensor(labels)
+
+
+def spatial_batches(dataset_dir: str, batch_size: int = 16, max_batches: int = 8, frame_stride: int = 10) -> list:
+    """Batches of normalized RGB frames of the prepared clips, in a seeded random order, for `Spatial_CNN`."""
+    samples = ((frame, label) for _, label, frame in video_frame_samples(dataset_dir, frame_stride, seed=0))
+    return list(batches(samples, batch_size, max_batches))
+
+
+def temporal_batches(dataset_dir: str, batch_size: int = 16, max_batches: int = 8) -> list:
+    """Batches of cached optical flow stacks of the prepared clips (see `optical_flow.py`), for `Temporal_CNN`."""
+    import torch
+
+    class_names = sorted(os.listdir(dataset_dir))
+    videos = [video for video in find_videos(dataset_dir) if os.path.isfile(flow_path(video))]
+    rng = np.random.default_rng(0)
+    rng.shuffle(videos)
+    samples = ((torch.from_numpy(load_flow_stack(video)), class_index(video, class_names)) for video in videos)
+    return list(batches(samples, batch_size, max_batches))
+
+
+def features(dataset_dir: str, store_dir: str, frame_stride: int = 1):
+    """
+    Build the feature store of the dataset (unless it already exists), and train the custom head of
+    `Spatial_CNN` on it.
+
+    :param dataset_dir:
+        Path to the dataset folder
+    :param store_dir:
+        Folder of the feature store
+    :param frame_stride:
+        Only use every `frame_stride`-th frame of the videos
+    """
+    from Feature_Store import Feature_Store
+    from Feature_Store import INDEX_FILE
+    from Feature_Store import train_head
+    from Spatial_CNN import Spatial_CNN
+
+    model = Spatial_CNN(len(os.listdir(dataset_dir)))
+    if not os.path.isfile(os.path.join(store_dir, INDEX_FILE)):
+        start_time = time.perf_counter()
+        store = Feature_Store.build(model, video_frame_samples(dataset_dir, frame_stride), store_dir)
+        print(f"    [INFO]\tExtracted {len(store)} features in {time.perf_counter() - start_time:.2f}s")
+
+    train_head(model, Feature_Store(store_dir))
+
+
+def quantize(stream: str, dataset_dir: str, weights_path: Optional[str] = None, max_batches: int = 16):
+    """
+    Print the accuracy, latency and size of the quantized versions of a stream.
+
+    :param stream:
+        "spatial" or "temporal"
+    :param dataset_dir:
+        Path to the dataset folder
+    :param weights_path:
+        Trained weights (state dict) of the stream, or None for the pretrained / initial weights
+    :param max_batches:
+        Number of batches, the first half to calibrate and the second half to evaluate
+    """
+    import torch
+    from Quantization import report
+
+    num_classes = len([name for name in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir, name))])
+    if stream == "spatial":
+        from Spatial_CNN import Spatial_CNN
+
+        model = Spatial_CNN(num_classes, pretrained=weights_path is None)
+        data = spatial_batches(dataset_dir, max_batches=max_batches)
+    else:
+        from Temporal_CNN import Temporal_CNN
+
+        model = Temporal_CNN(num_classes)
+        data = temporal_batches(dataset_dir, max_batches=max_batches)
+    if weights_path is not None:
+        model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+
+    half = max(len(data) // 2, 1)
+    report(model, data[:half], data[half:] or data)
+
+
+def fusion(dataset_dir: str, spatial_weights: str, temporal_weights: str, svm_weights: str,
+           epochs: int = 50, batch_size: int = 16):
+    """
+    Train the SVM fusion of the two-stream model on the clips with an optical flow cache.
+
+    :param dataset_dir:
+        Path to the dataset folder
+    :param spatial_weights:
+        Trained weights of the spatial stream
+    :param temporal_weights:
+        Trained weights of the temporal stream
+    :param svm_weights:
+        Path to save the weights of the SVM fusion to
+    :param epochs:
+        Number of passes over the stream scores
+    :param batch_size:
+        Number of clips per forward pass of the streams
+    """
+    import torch
+    from Two_Stream import Two_Stream
+    from Two_Stream import train_svm_fusion
+
+    class_names = sorted(os.listdir(dataset_dir))
+    videos = [video for video in find_videos(dataset_dir) if os.path.isfile(flow_path(video))]
+    if not videos:
+        print(f"    [ERROR]\tNo clip of \"{dataset_dir}\" has an optical flow cache, run `optical_flow.py` first.")
+        return
+
+    def clip_batches():
+        for start in range(0, len(videos), batch_size):
+            chunk = videos[start:start + batch_size]
+            yield (torch.stack([center_frame(video) for video in chunk]),
+                   torch.stack([torch.from_numpy(load_flow_stack(video)) for video in chunk]),
+                   torch.tensor([class_index(video, class_names) for video in chunk]))
+
+    model = Two_Stream(len(class_names), spatial_weights, temporal_weights)
+    train_svm_fusion(model, clip_batches(), svm_weights, epochs=epochs)
+    print(f"    [INFO]\tSVM fusion weights saved to \"{svm_weights}\"")
+
+
+def train(stream: str, dataset_dir: Optional[str], epochs: int = 1, batch_size: int = 16):
+    """
+    Data-parallel training of a stream on the workers started by `distributed.py` (a single worker
+    if not launched), see `Distributed.train`. The first worker saves the weights to "<stream>_ddp.pt".
+
+    :param stream:
+        "spatial" or "temporal"
+    :param dataset_dir:
+        Path to the dataset folder, or None to train on synthetic inputs
+    :param epochs:
+        Number of training epochs
+    :param batch_size:
+        Number of samples per batch and per worker
+    """
+    import torch
+    import torch.distributed as dist
+    from Distributed import INPUT_SHAPES
+    from Distributed import SyntheticDataset
+    from Distributed import init_distributed
+    from Distributed import train as train_distributed
+
+    if dataset_dir is None:
+        data = SyntheticDataset(INPUT_SHAPES[stream], n_classes=8)
+    elif stream == "spatial":
+        data = CenterFrameDataset(dataset_dir)
+    else:
+        data = FlowStackDataset(dataset_dir)
+
+    init_distributed()
+    model = train_distributed(stream, data, epochs, batch_size, pretrained=dataset_dir is not None)
+    if dist.get_rank() == 0 and dataset_dir is not None:
+        torch.save(model.state_dict(), f"{stream}_ddp.pt")
+    dist.destroy_process_group()
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+
+    if args['features']:
+        features(args['<dataset_dir>'], args['<store_dir>'], int(args['--frame-stride']))
+    elif args['quantize']:
+        stream = "spatial" if args['spatial'] else "temporal"
+        quantize(stream, args['<dataset_dir>'], args['<weights_path>'], int(args['--batches']))
+    elif args['fusion']:
+        fusion(args['<dataset_dir>'], args['<spatial_weights>'], args['<temporal_weights>'], args['<svm_weights>'],
+               int(args['--epochs'] or 50), int(args['--batch-size']))
+    elif args['train']:
+        stream = "spatial" if args['spatial'] else "temporal"
+        train(stream, args['<dataset_dir>'], int(args['--epochs'] or 1), int(args['--batch-size']))
+
+
+if __name__ == "__main__":
+    main()
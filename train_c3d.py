@@ -1,11 +1,37 @@
 """
 Training script to train a simple C3D model (3D-ConvNet) on the dataset.
 
+By default, clips are decoded on demand from the prepared videos ("augmented_dataset" folder
+created by `prepare_dataset.py`). Use `--from-frames` to train from the extracted frames
+("frames_dir" folder) loaded into memory as a single array instead.
+
 Usage:
+    train_c3d.py [--dataset=PATH] [--split=MANIFEST] [--balanced] [--workers=N] [--profile=NAME] [--resume]
+                 [--epochs=N] [--distributed]
+    train_c3d.py --from-frames [--profile=NAME] [--resume] [--epochs=N]
     train_c3d.py (-h | --help)
+
+Options:
+    --dataset=PATH      Path to the prepared videos dataset (defaults to DATASET_PATH)
+    --split=MANIFEST    Train on the "train" split of a manifest from `split_dataset.py` and
+                        validate on its "val" split, instead of using all videos of the dataset
+    --balanced          Sample the videos of every epoch with equal probability per class
+    --workers=N         Number of threads decoding the clips [default: 4]
+    --from-frames       Train from the frames array instead of decoding the videos
+    --profile=NAME      Training performance profile (threads, precision, XLA, prefetching), one
+                        of the `training_profiles.TRAINING_PROFILES` [default: default]
+    --resume            Continue from the latest checkpoint in CHECKPOINT_DIR (weights, optimizer,
+                        epoch, random states and data order), appending to its history
+    --epochs=N          Number of epochs to train for (defaults to EPOCHS)
+    --distributed       Data-parallel training on the workers described by the TF_CONFIG
+                        environment variable (`tf.distribute.MultiWorkerMirroredStrategy`), every
+                        worker decoding its own shard of the videos. Start local workers with
+                        `python distributed.py launch tf <N> -- train_c3d.py --distributed`
 """
 
 from typing import Tuple
+from docopt import docopt
+import contextlib
 from natsort import natsorted
 from natsort import ns
 import keras
@@ -15,12 +41,27 @@ from keras.layers import Dropout
 from keras.layers import Flatten
 from keras.layers import MaxPooling3D
 from keras.models import Sequential
-from PIL import Image
 from sklearn.preprocessing import LabelBinarizer
+import cv2
 import numpy as np
 import os
+import shutil
+import tempfile
 import time
 
+from checkpoints import CheckpointCallback
+from checkpoints import CheckpointManager
+from clip_sampler import ClipSampler
+from preprocessing import preprocess_frame
+from profiling import profile_run
+from profiling import stage
+from profiling import timed
+from split_dataset import load_manifest
+from split_dataset import manifest_videos
+from training_profiles import ThroughputLogger
+from training_profiles import apply_profile
+from video_dataset import VideoClipDataset
+
 NUM_FRAMES = 20
 IMAGE_SIZE = 100
 BATCH_SIZE = 16
@@ -28,12 +69,15 @@ EPOCHS = 100
 
 INPUT_3D_SHAPE = (NUM_FRAMES, IMAGE_SIZE, IMAGE_SIZE, 3)
 
+DATASET_PATH = r"E:/LakeheadU/Final Project Data/augmented_dataset"
 FRAMES_PATH = r"E:/LakeheadU/Final Project Data/frames_dir"
 FRAMES_ARRAY_PATH = r"E:/LakeheadU/Final Project Data/frames_array.npy"
 LABELS_ARRAY_PATH = r"E:/LakeheadU/Final Project Data/labels_array.npy"
 ACCURACY_PATH = r"E:/LakeheadU/Final Project Data/model_accuracy.npy"
 LOSS_PATH = r"E:/LakeheadU/Final Project Data/model_loss.npy"
 MODEL_SAVE_PATH = r"E:/LakeheadU/Final Project Data/model_weights/complete_model.h5"
+CHECKPOINT_DIR = r"E:/LakeheadU/Final Project Data/checkpoints"
+CHECKPOINT_EVERY = 1        # epochs between two checkpoints
 
 
 def get_c3d_model(input_shape: Tuple[int, int, int, int],
@@ -59,18 +103,59 @@ def get_c3d_model(input_shape: Tuple[int, int, int, int],
             # fc 1
             Dense(256, activation="relu"),
             Dropout(0.5),
-            # output
-            Dense(num_classes, activation="softmax"),
+            # output, kept in float32 for a numerically stable softmax under mixed precision
+            Dense(num_classes, activation="softmax", dtype="float32"),
         ]
     )
 
     return model
 
 
+class VideoClipSequence(keras.utils.Sequence):
+    """Keras wrapper around `VideoClipDataset` to feed `model.fit` with clips decoded on demand."""
+
+    def __init__(self, dataset: VideoClipDataset):
+        super().__init__()
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, batch_idx):
+        return self.dataset.get_batch(batch_idx)
+
+    def on_epoch_end(self):
+        self.dataset.on_epoch_end()
+
+
+def prefetched(dataset: VideoClipDataset, num_batches: int):
+    """
+    Input pipeline decoding the next `num_batches` batches while the model trains on the current one.
+
+    :param dataset:
+        The dataset to get the batches from
+    :param num_batches:
+        Number of batches to prefetch
+    :return:
+        A `tf.data.Dataset` going once through the dataset every time it is iterated (every epoch)
+    """
+    import tensorflow as tf
+
+    clip_shape = (None, NUM_FRAMES, IMAGE_SIZE, IMAGE_SIZE, 3)
+    signature = (tf.TensorSpec(clip_shape, tf.float32), tf.TensorSpec((None, len(dataset.class_names)), tf.float32))
+    pipeline = tf.data.Dataset.from_generator(lambda: iter(dataset), output_signature=signature)
+
+    # In distributed training, every worker already decodes its own shard of the videos
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return pipeline.with_options(options).prefetch(num_batches)
+
+
 def time_elapsed(elapsed):
     return str(time.strftime('%H:%M:%S', time.gmtime(elapsed)))
 
 
+@timed("load_frames")
 def process_videos_for_training():
     """Process all videos and convert and save to numpy arrays to use in the future."""
 
@@ -116,7 +201,7 @@ def process_videos_for_training():
             # Gather all frames of each videos as a numpy array
             for frame in all_frames:
                 path = os.path.join(FRAMES_PATH, c_name, video, frame)
-                frame = np.array(Image.open(path))
+                frame = preprocess_frame(cv2.imread(path), size=(IMAGE_SIZE, IMAGE_SIZE))
                 frame = np.expand_dims(frame, axis=0)
 
                 # Concatenate all frames to get a video of shape = [20, 100, 100, 3]
@@ -152,19 +237,80 @@ def process_videos_for_training():
 
 def main():
     """Main body."""
-
-    if not os.path.isfile(FRAMES_ARRAY_PATH) or os.path.isfile(LABELS_ARRAY_PATH):
-        process_videos_for_training()
-
-    # Get the frames and labels arrays saved after processing the videos
-    x_train = np.load(FRAMES_ARRAY_PATH)
-    y_train = np.load(LABELS_ARRAY_PATH)
-
-    # Create the model with the given input shape and output classes
-    model = get_c3d_model(x_train.shape[1:], y_train.shape[1])
-    model.compile(optimizer='adam',
-                  loss='categorical_crossentropy',
-                  metrics=['acc'])
+    args = docopt(__doc__)
+    profile = apply_profile(args['--profile'])
+    epochs = int(args['--epochs'] or EPOCHS)
+
+    # The strategy has to be created before any other TensorFlow operation
+    strategy, num_shards, shard_index = None, 1, 0
+    if args['--distributed']:
+        import tensorflow as tf
+
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+        num_shards, shard_index = strategy.num_replicas_in_sync, strategy.cluster_resolver.task_id or 0
+        print(f"    [INFO]\tWorker {shard_index} of {num_shards}")
+    is_chief = shard_index == 0
+    # Samples per training step over all the workers (BATCH_SIZE per worker)
+    global_batch_size = BATCH_SIZE * (strategy.num_replicas_in_sync if strategy is not None else 1)
+
+    x_train, y_train = None, None
+    dataset = None
+    train_sequence = None
+    val_sequence = None
+    if args['--from-frames']:
+        if not os.path.isfile(FRAMES_ARRAY_PATH) or not os.path.isfile(LABELS_ARRAY_PATH):
+            process_videos_for_training()
+
+        # Get the frames and labels arrays saved after processing the videos (memory-mapped, so
+        # that starting or resuming a training doesn't wait for the whole array to be read)
+        x_train = np.load(FRAMES_ARRAY_PATH, mmap_mode='r')
+        y_train = np.load(LABELS_ARRAY_PATH)
+        input_shape, num_classes = x_train.shape[1:], y_train.shape[1]
+        num_samples = len(x_train)
+    else:
+        manifest = load_manifest(args['--split']) if args['--split'] else None
+        dataset_path = args['--dataset'] or (manifest['dataset_dir'] if manifest else DATASET_PATH)
+        if not os.path.isdir(dataset_path):
+            print(f"    [ERROR]\tThe folder \"{dataset_path}\" doesn't exist.")
+            return
+
+        # Decode the clips lazily from the prepared videos
+        sampler = ClipSampler(NUM_FRAMES, method="center")
+        # Batches of the global batch size (BATCH_SIZE per worker), split between the workers
+        dataset_kwargs = dict(batch_size=global_batch_size,
+                              resize_dims=(IMAGE_SIZE, IMAGE_SIZE),
+                              num_workers=int(args['--workers']),
+                              num_shards=num_shards,
+                              shard_index=shard_index)
+        if manifest is not None:
+            dataset = VideoClipDataset(manifest_videos(manifest, 'train', dataset_path),
+                                       manifest['class_names'], sampler,
+                                       balanced=args['--balanced'], **dataset_kwargs)
+            val_videos = manifest_videos(manifest, 'val', dataset_path)
+            if val_videos:
+                val_dataset = VideoClipDataset(val_videos, manifest['class_names'], sampler,
+                                               shuffle=False, **dataset_kwargs)
+                val_sequence = VideoClipSequence(val_dataset)
+        else:
+            dataset = VideoClipDataset.from_directory(dataset_path, sampler,
+                                                      balanced=args['--balanced'], **dataset_kwargs)
+        print(f"    [INFO]\tFound {len(dataset.videos)} videos in {len(dataset.class_names)} classes.")
+        train_sequence = VideoClipSequence(dataset)
+        if profile['prefetch'] or strategy is not None:
+            train_sequence = prefetched(dataset, max(profile['prefetch'], 1))
+            if val_sequence is not None:
+                val_sequence = prefetched(val_sequence.dataset, max(profile['prefetch'], 1))
+        # Samples per epoch over all the workers (the shards all have the same size)
+        num_samples = len(dataset.order) * num_shards
+        input_shape, num_classes = INPUT_3D_SHAPE, len(dataset.class_names)
+
+    # Create the model with the given input shape and output classes (mirrored on all workers)
+    with stage("build_model"), strategy.scope() if strategy is not None else contextlib.nullcontext():
+        model = get_c3d_model(input_shape, num_classes)
+        model.compile(optimizer='adam',
+                      loss='categorical_crossentropy',
+                      metrics=['acc'],
+                      jit_compile=profile['jit_compile'])
     print()
     print(model.summary())
     print()
@@ -173,14 +319,49 @@ def main():
     print(f"    [INFO]\t{'=' * 50}")
     print(f"    [INFO]\t\tMODEL TRAINING")
     print(f"    [INFO]\t{'=' * 50}")
-    history = model.fit(x_train, y_train, batch_size=BATCH_SIZE, epochs=EPOCHS, shuffle=True)
+    # In distributed training, every worker saves the same way (saving can involve collective ops),
+    # but only the chief worker saves to the actual paths, the others to temporary ones
+    checkpoint_dir, model_save_path = CHECKPOINT_DIR, MODEL_SAVE_PATH
+    if not is_chief:
+        worker_dir = os.path.join(tempfile.gettempdir(), f"train_c3d_worker_{shard_index}")
+        checkpoint_dir = os.path.join(worker_dir, "checkpoints")
+        model_save_path = os.path.join(worker_dir, os.path.basename(MODEL_SAVE_PATH))
+
+    checkpoints = CheckpointManager(checkpoint_dir)
+    initial_epoch, past_history = 0, None
+    if args['--resume']:
+        # Every worker resumes from the latest checkpoint of the chief
+        resume_path = CheckpointManager(CHECKPOINT_DIR).latest()
+        if resume_path is None:
+            print(f"    [WARN]\tNo checkpoint found in \"{CHECKPOINT_DIR}\", training from scratch.")
+        else:
+            start_time = time.perf_counter()
+            with stage("resume"):
+                state = checkpoints.restore(model, dataset, resume_path)
+            initial_epoch, past_history = state['epoch'], state['history']
+            print(f"    [INFO]\tResumed from epoch {initial_epoch} in {time.perf_counter() - start_time:.2f}s")
+
+    checkpoint_callback = CheckpointCallback(checkpoints, CHECKPOINT_EVERY, past_history, dataset)
+    callbacks = [ThroughputLogger(global_batch_size, num_samples), checkpoint_callback]
+    with stage("train"):
+        if train_sequence is not None:
+            model.fit(train_sequence, epochs=epochs, initial_epoch=initial_epoch,
+                      validation_data=val_sequence, callbacks=callbacks)
+        else:
+            model.fit(x_train, y_train, batch_size=global_batch_size, epochs=epochs, initial_epoch=initial_epoch,
+                      shuffle=True, callbacks=callbacks)
+    checkpoints.close()
 
     # Save the trained model to run inference on
-    model.save(MODEL_SAVE_PATH)
+    with stage("save"):
+        model.save(model_save_path)
+    if not is_chief:
+        shutil.rmtree(worker_dir, ignore_errors=True)
+        return
 
-    # Save model scores in arrays
-    accuracy_scores = history.history['acc']
-    loss_scores = history.history['loss']
+    # Save model scores in arrays (all epochs, including the ones before resuming)
+    accuracy_scores = checkpoint_callback.history['acc']
+    loss_scores = checkpoint_callback.history['loss']
 
     np.save(ACCURACY_PATH, accuracy_scores)
     np.save(LOSS_PATH, loss_scores)
@@ -189,4 +370,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with profile_run("train_c3d"):
+        main()
@@ -0,0 +1,178 @@
+"""
+Training performance profiles for `train_c3d.py` on CPU training nodes.
+
+A profile sets, before the model is built:
+
+    - the TensorFlow intra-op / inter-op thread pools
+    - the Keras precision policy: float32, mixed_float16 or mixed_bfloat16 ("auto" picks the
+      fastest one supported by the CPU, mixed precision is only faster with native fp16/bf16
+      instructions such as AVX512-FP16, AVX512-BF16 or AMX)
+    - XLA compilation of the training step
+    - the number of batches prefetched by the input pipeline while the model trains
+
+Use `ThroughputLogger` to log the samples/sec and step time of every epoch.
+
+Usage:
+    training_profiles.py
+    training_profiles.py (-h | --help)
+"""
+
+import os
+import time
+
+from docopt import docopt
+import keras
+import numpy as np
+
+# Number of threads: 0 lets TensorFlow decide, None uses the number of logical CPUs
+TRAINING_PROFILES = {
+    # TensorFlow defaults (fp32, no XLA, batches decoded when requested)
+    "default": {
+        "intra_op_threads": 0,
+        "inter_op_threads": 0,
+        "precision": "float32",
+        "jit_compile": False,
+        "prefetch": 0,
+    },
+    # All cores for the ops, XLA-compiled step, input decoded ahead of the training step
+    "cpu": {
+        "intra_op_threads": None,
+        "inter_op_threads": 2,
+        "precision": "float32",
+        "jit_compile": True,
+        "prefetch": 2,
+    },
+    # Same as "cpu", with mixed precision if the CPU has native fp16/bf16 support
+    "cpu-mixed": {
+        "intra_op_threads": None,
+        "inter_op_threads": 2,
+        "precision": "auto",
+        "jit_compile": True,
+        "prefetch": 2,
+    },
+}
+
+# CPU flags (/proc/cpuinfo) of the native half precision instructions
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+FP16_CPU_FLAGS = ("avx512_fp16", "amx_fp16")
+
+
+def cpu_flags() -> set:
+    """Flags of the CPU, empty if they can't be read (non-Linux systems)."""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def resolve_precision(precision: str) -> str:
+    """
+    Get the Keras precision policy to use on this CPU.
+
+    :param precision:
+        One of "float32", "mixed_float16", "mixed_bfloat16" or "auto"
+    :return:
+        The policy name, "float32" if the requested mixed precision isn't supported natively
+    """
+    flags = cpu_flags()
+    supports_bf16 = any(flag in flags for flag in BF16_CPU_FLAGS)
+    supports_fp16 = any(flag in flags for flag in FP16_CPU_FLAGS)
+
+    if precision == "auto":
+        if supports_bf16:
+            return "mixed_bfloat16"
+        return "mixed_float16" if supports_fp16 else "float32"
+    if (precision == "mixed_bfloat16" and not supports_bf16) or (precision == "mixed_float16" and not supports_fp16):
+        print(f"    [WARN]\tThe CPU has no native support for \"{precision}\", training in float32.")
+        return "float32"
+    return precision
+
+
+def apply_profile(name: str) -> dict:
+    """
+    Configure TensorFlow and Keras with a training profile. Must be called before any model or
+    tensor is created, the thread pools can't be changed afterwards.
+
+    :param name:
+        Name of the profile in `TRAINING_PROFILES`
+    :return:
+        The profile settings, with the thread counts and precision resolved for this machine
+    """
+    import tensorflow as tf
+
+    if name not in TRAINING_PROFILES:
+        raise ValueError(f"Unknown training profile \"{name}\", expected one of {list(TRAINING_PROFILES)}")
+
+    profile = dict(TRAINING_PROFILES[name])
+    for key in ("intra_op_threads", "inter_op_threads"):
+        if profile[key] is None:
+            profile[key] = os.cpu_count()
+    profile["precision"] = resolve_precision(profile["precision"])
+
+    tf.config.threading.set_intra_op_parallelism_threads(profile["intra_op_threads"])
+    tf.config.threading.set_inter_op_parallelism_threads(profile["inter_op_threads"])
+    keras.mixed_precision.set_global_policy(profile["precision"])
+
+    print(f"    [INFO]\tTraining profile \"{name}\": {profile}")
+    return profile
+
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """Log the training samples/sec and mean step time of every epoch (also added to the history)."""
+
+    def __init__(self, batch_size: int, num_samples: int):
+        """
+        :param batch_size:
+            Number of samples per training step, over all the workers in distributed training
+        :param num_samples:
+            Number of training samples per epoch
+        """
+        super().__init__()
+        self.batch_size = batch_size
+        self.num_samples = num_samples
+        self._epoch_start = 0.0
+        self._step_start = 0.0
+        self._step_times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._step_times = []
+        self._epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step_times.append(time.perf_counter() - self._step_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        # Training time of the epoch, without the validation run after the last step
+        train_time = self._step_start + self._step_times[-1] - self._epoch_start if self._step_times else 0.0
+        num_samples = min(len(self._step_times) * self.batch_size, self.num_samples)
+        samples_per_sec = num_samples / train_time if train_time > 0 else 0.0
+        step_time_ms = float(np.mean(self._step_times)) * 1000 if self._step_times else 0.0
+
+        print(f"    [INFO]\tEpoch {epoch + 1}: {samples_per_sec:.1f} samples/sec, "
+              f"{step_time_ms:.1f} ms/step, {train_time:.1f}s")
+        if logs is not None:
+            logs["samples_per_sec"] = samples_per_sec
+            logs["step_time_ms"] = step_time_ms
+
+
+def main():
+    """Print the training profiles as resolved on this machine."""
+    docopt(__doc__)
+    flags = cpu_flags()
+    print(f"    [INFO]\tLogical CPUs: {os.cpu_count()}")
+    print(f"    [INFO]\tNative bf16: {any(flag in flags for flag in BF16_CPU_FLAGS)}, "
+          f"native fp16: {any(flag in flags for flag in FP16_CPU_FLAGS)}")
+    for name, profile in TRAINING_PROFILES.items():
+        print(f"    [INFO]\t{name:<10}\tprecision {resolve_precision(profile['precision']):<15}\t"
+              f"XLA {profile['jit_compile']}\tprefetch {profile['prefetch']}")
+
+
+if __name__ == "__main__":
+    main()
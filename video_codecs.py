@@ -0,0 +1,241 @@
+"""
+Codec and backend selection of the `cv2.VideoCapture` / `cv2.VideoWriter` used by all the scripts.
+
+The videos are opened with the FFmpeg backend when available (falling back to the default OpenCV
+backend), with a decoding thread count hint (`CAP_PROP_N_THREADS`) and optional hardware
+acceleration. The written videos use one of the software codecs:
+
+    - "mp4v"    : MPEG-4 Part 2 (default), the smallest files and the fastest to encode and decode
+    - "MJPG"    : Motion JPEG, intra-only (every frame is a keyframe, so seeking to a clip is exact
+                  and cheap), about 6-9x larger files and a little slower than mp4v
+    - "FFV1"    : lossless intra-only, for intermediates that must not lose quality between steps.
+                  Several hundred times larger than mp4v and over 10x slower, so keep it for short
+                  intermediates that are deleted right after
+
+All three are written into the usual ".mp4" files, which every script looks for (`VIDEO_EXT`).
+MP4 has no tag for Motion JPEG, so FFmpeg prints these two lines on every MJPG video it opens
+for writing (OpenCV prints them straight to stderr, they can't be turned off):
+
+    OpenCV: FFMPEG: tag 0x47504a4d/'MJPG' is not supported with codec id 7 and format 'mp4 / ...'
+    OpenCV: FFMPEG: fallback to use tag 0x7634706d/'mp4v'
+
+They are harmless: the stream is still Motion JPEG (read back with the "MJPG" fourcc), only its
+tag in the file changes, and FFmpeg-based readers decode it fine.
+
+The defaults come from `constants.py` (`VIDEO_CODEC`, `VIDEO_THREADS`, `VIDEO_HW_ACCELERATION`) and
+can be overridden with the environment variables of the same names, e.g.
+`VIDEO_CODEC=MJPG python prepare_dataset.py`. The backend and codec actually used for every opened
+video are recorded in the profile of the run (see `profiling.py`), and on the `FrameReader`.
+
+The benchmark encodes the same frames at our clip sizes with every codec, and prints the encode
+and decode speed against the file size. With the synthetic scene (`--frames=60`), the files are
+0.07 / 0.41 / 18.2 MB at 640x480 and 0.11 / 1.00 / 54.1 MB at 1280x720 for mp4v / MJPG / FFV1.
+
+Usage:
+    video_codecs.py [<video_path>] [--frames=N] [--threads=N]
+    video_codecs.py (-h | --help)
+
+Options:
+    --frames=N          Number of frames encoded per codec and size [default: 200]
+    --threads=N         Decoding thread count hint (0 for the OpenCV default) [default: 0]
+"""
+
+from typing import Optional
+from typing import Tuple
+import os
+import tempfile
+import time
+
+from docopt import docopt
+import cv2
+import numpy as np
+
+from constants import STD_DIMENSIONS
+from constants import TEST_RESIZE_FRAME_HEIGHT
+from constants import TEST_RESIZE_FRAME_WIDTH
+from constants import VIDEO_CODEC
+from constants import VIDEO_EXT
+from constants import VIDEO_HW_ACCELERATION
+from constants import VIDEO_THREADS
+from profiling import count
+
+# Software codecs supported by the writers
+CODECS = ("mp4v", "MJPG", "FFV1")
+
+# Backends tried in order to open a video
+BACKENDS = (cv2.CAP_FFMPEG, cv2.CAP_ANY)
+
+# Frame sizes (width, height) of the benchmark: training clips, recordings at 480p and 720p
+BENCHMARK_SIZES = ((TEST_RESIZE_FRAME_WIDTH, TEST_RESIZE_FRAME_HEIGHT), STD_DIMENSIONS["480p"], STD_DIMENSIONS["720p"])
+
+
+def _setting(name: str, default):
+    """Value of a setting from `constants.py`, overridden by the environment variable of the same name."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes")
+    return type(default)(value)
+
+
+def backend_name(stream) -> str:
+    """Name of the backend of an opened VideoCapture / VideoWriter ("none" if it isn't opened)."""
+    if not stream.isOpened():
+        return "none"
+    try:
+        return stream.getBackendName()
+    except cv2.error:
+        return "unknown"
+
+
+def open_capture(path_in, threads: Optional[int] = None, hw_acceleration: Optional[bool] = None) -> cv2.VideoCapture:
+    """
+    Open a video (or a camera) for reading, with the first backend that can open it.
+
+    :param path_in:
+        Path to the video file, or camera index
+    :param threads:
+        Decoding thread count hint, 0 for the OpenCV default (`VIDEO_THREADS` if None)
+    :param hw_acceleration:
+        Decode with hardware acceleration when available (`VIDEO_HW_ACCELERATION` if None)
+    :return:
+        The VideoCapture (not opened if no backend could open the video)
+    """
+    threads = _setting("VIDEO_THREADS", VIDEO_THREADS) if threads is None else threads
+    hw_acceleration = _setting("VIDEO_HW_ACCELERATION", VIDEO_HW_ACCELERATION) if hw_acceleration is None else hw_acceleration
+
+    params = []
+    if threads > 0:
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    if hw_acceleration:
+        params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+
+    # Cameras are opened with the default backend of the platform
+    backends = BACKENDS if isinstance(path_in, str) else (cv2.CAP_ANY,)
+    for backend in backends:
+        cap = cv2.VideoCapture(path_in, backend, params)
+        if cap.isOpened():
+            break
+    count(f"capture.{backend_name(cap)}")
+    return cap
+
+
+def open_writer(path_out: str,
+                fps: float,
+                dims: Tuple[int, int],
+                is_color: bool = True,
+                codec: Optional[str] = None,
+                hw_acceleration: Optional[bool] = None) -> cv2.VideoWriter:
+    """
+    Open a video for writing with the given codec, falling back to "mp4v" if it can't be written.
+
+    :param path_out:
+        Path to the video file to write
+    :param fps:
+        Frame rate of the video
+    :param dims:
+        Frame size as (width, height)
+    :param is_color:
+        Whether the frames are BGR (or grayscale)
+    :param codec:
+        Four-char code of the codec, one of `CODECS` (`VIDEO_CODEC` if None)
+    :param hw_acceleration:
+        Encode with hardware acceleration when available (`VIDEO_HW_ACCELERATION` if None)
+    :return:
+        The VideoWriter (not opened if the video couldn't be created)
+    """
+    codec = _setting("VIDEO_CODEC", VIDEO_CODEC) if codec is None else codec
+    hw_acceleration = _setting("VIDEO_HW_ACCELERATION", VIDEO_HW_ACCELERATION) if hw_acceleration is None else hw_acceleration
+
+    params = [cv2.VIDEOWRITER_PROP_IS_COLOR, int(is_color)]
+    if hw_acceleration:
+        params += [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+
+    for fourcc in dict.fromkeys((codec, "mp4v")):
+        for backend in BACKENDS:
+            writer = cv2.VideoWriter(path_out, backend, cv2.VideoWriter_fourcc(*fourcc), fps, tuple(dims), params)
+            if writer.isOpened():
+                if fourcc != codec:
+                    print(f"    [WARN]\tCan't write \"{codec}\" videos, using \"{fourcc}\" for \"{path_out}\"")
+                count(f"writer.{backend_name(writer)}.{fourcc}")
+                return writer
+
+    print(f"    [ERROR]\tCan't write the video \"{path_out}\"")
+    return writer
+
+
+def _benchmark_frames(video_path: Optional[str], size: Tuple[int, int], num_frames: int) -> list:
+    """Frames of the benchmark: the video resized to the given size, or a synthetic moving scene."""
+    if video_path is not None:
+        from video_reader import FrameReader
+
+        with FrameReader(video_path) as reader:
+            frames = [cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in reader]
+        return [frames[idx % len(frames)] for idx in range(num_frames)]
+
+    # Smooth background with a moving square and a little sensor noise, closer to real recordings
+    # than random frames (which no codec can compress)
+    width, height = size
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.linspace(0, 255, width), np.linspace(0, 255, height))
+    background = np.dstack([x, y, (x + y) / 2]).astype(np.uint8)
+    frames = []
+    for idx in range(num_frames):
+        frame = background.copy()
+        left, top = (idx * 4) % max(width - width // 4, 1), height // 3
+        frame[top:top + height // 4, left:left + width // 4] = (40, 200, 255)
+        frames.append(cv2.add(frame, rng.integers(0, 4, frame.shape, dtype=np.uint8)))
+    return frames
+
+
+def benchmark(video_path: Optional[str] = None, num_frames: int = 200, threads: int = 0):
+    """
+    Print the encode speed, decode speed and file size of every codec at our clip sizes.
+
+    :param video_path:
+        Video whose frames are encoded (resized to every size), or None for a synthetic scene
+    :param num_frames:
+        Number of frames encoded per codec and size
+    :param threads:
+        Decoding thread count hint
+    """
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t\tCODECS ({num_frames} frames, {'synthetic' if video_path is None else os.path.basename(video_path)})")
+    print(f"    [INFO]\t{'=' * 50}")
+    print(f"    [INFO]\t{'size':<10}\t{'codec':<6}\t{'encode':>10}\t{'decode':>10}\t{'size':>10}\t{'KB/frame':>8}\tbackend")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in BENCHMARK_SIZES:
+            frames = _benchmark_frames(video_path, size, num_frames)
+            for codec in CODECS:
+                path = os.path.join(tmp_dir, f"{codec}_{size[0]}x{size[1]}{VIDEO_EXT}")
+
+                start_time = time.perf_counter()
+                writer = open_writer(path, 30.0, size, codec=codec)
+                for frame in frames:
+                    writer.write(frame)
+                writer.release()
+                encode_fps = num_frames / (time.perf_counter() - start_time)
+
+                start_time = time.perf_counter()
+                cap = open_capture(path, threads=threads)
+                backend = backend_name(cap)
+                num_decoded = 0
+                while cap.grab() and cap.retrieve()[0]:
+                    num_decoded += 1
+                cap.release()
+                decode_fps = num_decoded / (time.perf_counter() - start_time)
+
+                file_size = os.path.getsize(path)
+                print(f"    [INFO]\t{f'{size[0]}x{size[1]}':<10}\t{codec:<6}\t{encode_fps:6.0f} fps\t{decode_fps:6.0f} fps\t"
+                      f"{file_size / 2 ** 20:7.2f} MB\t{file_size / 1024 / num_frames:8.1f}\t{backend}")
+
+
+def main():
+    """Main body of the script to be run."""
+    args = docopt(__doc__)
+    benchmark(args['<video_path>'], int(args['--frames']), int(args['--threads']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Lazy, video-backed dataset decoding training clips on demand from the prepared videos.
+
+The dataset folder should have one sub-folder per class, as created by `prepare_dataset.py` in
+"augmented_dataset":
+
+    /path-to-the-dataset/
+        |--- class_1
+        |   |--- video_1.mp4
+        |   |--- ...
+        |--- ...
+
+Clips are decoded by a pool of worker threads (OpenCV releases the GIL while decoding), and
+recently decoded clips are kept in an LRU cache so that deterministic clips (e.g. center trim) are
+only decoded once across epochs. This module doesn't depend on any training framework, see
+`train_c3d.VideoClipSequence` for the Keras wrapper.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+import os
+
+from natsort import natsorted
+from natsort import ns
+import numpy as np
+
+from clip_sampler import ClipSampler
+from clip_sampler import read_clips
+from constants import VIDEO_EXT
+from preprocessing import preprocess_clip
+from video_reader import FrameReader
+
+
+class ClipCache:
+    """Thread-safe LRU cache of decoded clips, keyed by (video path, frame indices)."""
+
+    def __init__(self, max_items: int = 256):
+        """
+        :param max_items:
+            Maximum number of clips to keep in the cache (0 to disable caching)
+        """
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """Return the cached clip for the given key, or None if it isn't cached."""
+        with self._lock:
+            clip = self._items.get(key)
+            if clip is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return clip
+
+    def put(self, key, clip: np.ndarray):
+        """Add a clip to the cache, evicting the least recently used ones if the cache is full."""
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = clip
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class VideoClipDataset:
+    """
+    Batches of (clips, one-hot labels) decoded lazily from a list of labelled videos.
+
+    The dataset can be indexed batch by batch (`get_batch`, as used by `keras.utils.Sequence`), or
+    iterated for one epoch, in which case the next batch is decoded while the current one is used.
+    """
+
+    def __init__(self,
+                 videos: List[Tuple[str, int]],
+                 class_names: List[str],
+                 sampler: ClipSampler,
+                 batch_size: int = 16,
+                 resize_dims: Optional[Tuple[int, int]] = None,
+                 shuffle: bool = True,
+                 balanced: bool = False,
+                 num_workers: int = 4,
+                 cache_size: int = 256,
+                 seed: Optional[int] = None,
+                 num_shards: int = 1,
+                 shard_index: int = 0):
+        """
+        :param videos:
+            List of (video path, class index) pairs
+        :param class_names:
+            Names of the classes, in the order of the class indices
+        :param sampler:
+            Sampler giving the clips to choose from for each video (one is picked per epoch)
+        :param batch_size:
+            Number of clips per batch
+        :param resize_dims:
+            Frame size (width, height) to resize the clips to, or None to keep the video size
+        :param shuffle:
+            Shuffle the order of the videos at every epoch
+        :param balanced:
+            Draw the videos of every epoch with equal probability per class instead of once each
+        :param num_workers:
+            Number of threads decoding clips
+        :param cache_size:
+            Number of decoded clips to keep in the LRU cache
+        :param seed:
+            Seed for shuffling and class-balanced sampling (random if None). The order of every
+            epoch only depends on the seed and the epoch number, see `set_epoch`
+        :param num_shards:
+            Number of workers sharing the videos in data-parallel training
+        :param shard_index:
+            Index of this worker, which only loads its own shard of the videos. All shards have
+            the same size (some videos are repeated), so that all workers run the same number of
+            steps per epoch
+        """
+        if num_shards > 1:
+            shard_size = -(-len(videos) // num_shards)
+            indices = np.resize(np.arange(len(videos)), shard_size * num_shards)[shard_index::num_shards]
+            videos = [videos[idx] for idx in indices]
+        self.videos = videos
+        self.class_names = class_names
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.resize_dims = resize_dims
+        self.shuffle = shuffle
+        self.balanced = balanced
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 32)
+        self.epoch = 0
+        self.rng = np.random.default_rng(self.seed)
+        self.cache = ClipCache(cache_size)
+        self.pool = ThreadPoolExecutor(max_workers=num_workers)
+
+        self._labels = np.array([label for _, label in videos], dtype=np.int64)
+        self._onehot = np.eye(len(class_names), dtype=np.float32)
+        self._num_frames = dict()
+        self.order = np.arange(len(videos))
+        self.set_epoch(0)
+
+    @classmethod
+    def from_directory(cls, dataset_dir: str, sampler: ClipSampler, **kwargs):
+        """
+        Create the dataset from a folder with one sub-folder of videos per class.
+
+        :param dataset_dir:
+            Path to the dataset folder
+        :param sampler:
+            Sampler giving the clips to choose from for each video
+        :param kwargs:
+            Any other argument of the constructor
+        """
+        class_names = natsorted(os.listdir(dataset_dir), alg=ns.IC)
+        videos = []
+        for label, class_name in enumerate(class_names):
+            class_path = os.path.join(dataset_dir, class_name)
+            for video in natsorted(os.listdir(class_path), alg=ns.IC):
+                if video.lower().endswith(VIDEO_EXT):
+                    videos.append((os.path.join(class_path, video), label))
+
+        return cls(videos, class_names, sampler, **kwargs)
+
+    def __len__(self) -> int:
+        """Number of batches per epoch."""
+        return int(np.ceil(len(self.order) / self.batch_size))
+
+    def on_epoch_end(self):
+        """Draw the order of the videos for the next epoch."""
+        self.set_epoch(self.epoch + 1)
+
+    def set_epoch(self, epoch: int):
+        """
+        Draw the order of the videos for the given epoch, e.g. to continue from a checkpoint with
+        the same data order as an uninterrupted run.
+
+        :param epoch:
+            Index of the epoch, starting from 0
+        """
+        self.epoch = epoch
+        self.rng = np.random.default_rng([self.seed, epoch])
+        num_videos = len(self.videos)
+        if self.balanced and num_videos > 0:
+            # Every class gets the same total probability, split between its videos
+            class_counts = np.bincount(self._labels, minlength=len(self.class_names))
+            weights = 1.0 / class_counts[self._labels]
+            self.order = self.rng.choice(num_videos, size=num_videos, p=weights / weights.sum())
+        elif self.shuffle:
+            self.order = self.rng.permutation(num_videos)
+        else:
+            self.order = np.arange(num_videos)
+        # The clip of every video is drawn here rather than by the decoding threads, which share
+        # the generator and would pick the clips in a different order at every run
+        self.clip_choice = self.rng.integers(2 ** 31, size=num_videos)
+
+    def num_frames(self, path: str) -> int:
+        """Number of frames of the video, read from its metadata once and remembered."""
+        if path not in self._num_frames:
+            with FrameReader(path) as reader:
+                self._num_frames[path] = reader.frame_count
+        return self._num_frames[path]
+
+    def load_clip(self, video_idx: int) -> np.ndarray:
+        """
+        Decode (or get from cache) one clip of the given video, as decoded (BGR, uint8) frames.
+
+        :param video_idx:
+            Index of the video in `self.videos`
+        :return:
+            Array of shape (clip_len, height, width, 3)
+        """
+        path, _ = self.videos[video_idx]
+        clips = self.sampler(self.num_frames(path))
+        indices = clips[self.clip_choice[video_idx] % len(clips)]
+
+        key = (path, tuple(indices))
+        clip = self.cache.get(key)
+        if clip is None:
+            clip = read_clips(path, [indices])[0]
+            self.cache.put(key, clip)
+
+        return clip
+
+    def get_batch(self, batch_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Decode the clips of one batch on the worker pool.
+
+        :param batch_idx:
+            Index of the batch in the current epoch
+        :return:
+            The clips as float32 of shape (batch, clip_len, height, width, 3), and one-hot labels
+        """
+        video_ids = self.order[batch_idx * self.batch_size:(batch_idx + 1) * self.batch_size]
+        clips = list(self.pool.map(self.load_clip, video_ids))
+
+        # Preprocessed straight into the batch (RGB, float32), the same way as at inference time
+        clip_len, height, width = clips[0].shape[:3]
+        if self.resize_dims is not None:
+            width, height = self.resize_dims
+        batch_x = np.empty((len(clips), clip_len, height, width, 3), dtype=np.float32)
+        for clip, clip_dst in zip(clips, batch_x):
+            preprocess_clip(clip, clip_dst, size=self.resize_dims)
+        batch_y = self._onehot[self._labels[video_ids]]
+
+        return batch_x, batch_y
+
+    def __getitem__(self, batch_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.get_batch(batch_idx)
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Iterate over the batches of one epoch, decoding the next batch in the background."""
+        num_batches = len(self)
+        if num_batches == 0:
+            return
+        # The prefetch runs on a separate thread so that it can itself use the worker pool
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            next_batch = prefetcher.submit(self.get_batch, 0)
+            for batch_idx in range(num_batches):
+                batch = next_batch.result()
+                if batch_idx + 1 < num_batches:
+                    next_batch = prefetcher.submit(self.get_batch, batch_idx + 1)
+                yield batch
+        self.on_epoch_end()
+
+    def close(self):
+        """Shut down the worker pool."""
+        self.pool.shutdown()
@@ -0,0 +1,272 @@
+"""
+Bounded-memory streaming reader for video files, shared by all the processing scripts.
+
+Instead of reading a complete video into a list of frames, the `FrameReader` yields one frame at
+a time, optionally decoding into a preallocated buffer and/or on a background thread, so the
+memory used per video stays constant no matter how long the recording is.
+"""
+
+from threading import Thread
+from typing import Iterator
+from typing import Optional
+import os
+import queue
+
+import cv2
+import numpy as np
+
+from constants import PROP_ID_FPS
+from constants import PROP_ID_FRAME_COUNT
+from constants import PROP_ID_HEIGHT
+from constants import PROP_ID_POS_FRAMES
+from constants import PROP_ID_WIDTH
+from profiling import count
+from profiling import stage
+from video_codecs import backend_name
+from video_codecs import open_capture
+
+# Containers storing an index of every frame, whose frame count is exact
+INDEXED_CONTAINERS = (".mp4", ".m4v", ".mov", ".avi")
+
+# Sentinel put on the prefetch queue once the decode thread is done
+_END_OF_STREAM = None
+
+
+class FrameReader:
+    """
+    Iterator and context manager over the frames of a `cv2.VideoCapture`.
+
+    Example:
+
+        with FrameReader(path_in, reuse_buffer=True) as reader:
+            for frame in reader:
+                out.write(frame)
+
+    When `reuse_buffer` is set, frames are decoded into preallocated buffers and a yielded frame is
+    only valid until the next one is requested, so copy it if it has to be kept around.
+    """
+
+    def __init__(self,
+                 path_in: str,
+                 reuse_buffer: bool = False,
+                 start: int = 0,
+                 stop: Optional[int] = None,
+                 stride: int = 1,
+                 prefetch: int = 0):
+        """
+        :param path_in:
+            Path to the video file to read
+        :param reuse_buffer:
+            Decode into preallocated frame buffers instead of allocating a new array per frame
+        :param start:
+            Index of the first frame to read
+        :param stop:
+            Index of the frame to stop reading at (exclusive), or None to read till the end
+        :param stride:
+            Only yield every `stride`-th frame, the frames in between are grabbed but not retrieved
+            (nor converted to BGR)
+        :param prefetch:
+            Number of frames to decode ahead on a background thread (0 to decode synchronously)
+        """
+        if stride < 1:
+            raise ValueError(f"Stride should be a positive integer, got {stride}")
+
+        self.path_in = path_in
+        self.reuse_buffer = reuse_buffer
+        self.start = start
+        self.stop = stop
+        self.stride = stride
+        self.prefetch = prefetch
+
+        self.cap = open_capture(path_in)
+        self.backend = backend_name(self.cap)
+        self.fps = self.cap.get(PROP_ID_FPS)
+        self.width = int(self.cap.get(PROP_ID_WIDTH))
+        self.height = int(self.cap.get(PROP_ID_HEIGHT))
+        self.frame_count = int(self.cap.get(PROP_ID_FRAME_COUNT))
+
+        self._thread = None
+        self._queue = None
+        self._shutdown = False
+
+    @property
+    def dims(self):
+        """Frame size as (width, height), the format expected by `cv2.VideoWriter`."""
+        return self.width, self.height
+
+    def is_opened(self) -> bool:
+        """Whether the underlying VideoCapture could open the video."""
+        return self.cap.isOpened()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Stop the decode thread (if any) and release the VideoCapture."""
+        self._shutdown = True
+        if self._thread is not None:
+            # Drain the queue so that a blocked decode thread can exit
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._thread = None
+        self.cap.release()
+
+    def _new_buffers(self, num_buffers: int):
+        """Allocate `num_buffers` frame buffers, or Nones if buffers aren't reused."""
+        if not self.reuse_buffer:
+            return [None] * num_buffers
+        return [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(num_buffers)]
+
+    def _decode(self, buffers) -> Iterator[np.ndarray]:
+        """Decode the selected frames, cycling over the given buffers."""
+        if self.start > 0:
+            self.cap.set(PROP_ID_POS_FRAMES, self.start)
+
+        frame_idx = self.start
+        num_buffers = len(buffers)
+        buffer_idx = 0
+        while not self._shutdown and (self.stop is None or frame_idx < self.stop):
+            with stage("decode"):
+                ret, frame = self.cap.read(image=buffers[buffer_idx]) if self.reuse_buffer else self.cap.read()
+            if not ret:
+                break
+            count("decode.frames")
+            count("decode.bytes", frame.nbytes)
+            yield frame
+            buffer_idx = (buffer_idx + 1) % num_buffers
+            frame_idx += 1
+
+            # Skip over the in-between frames without decoding them
+            for _ in range(self.stride - 1):
+                if self.stop is not None and frame_idx >= self.stop:
+                    break
+                with stage("grab"):
+                    grabbed = self.cap.grab()
+                if not grabbed:
+                    return
+                frame_idx += 1
+
+    def _run_decode_thread(self, buffers):
+        """Body of the background decode thread, passing a decoding error on to the consumer."""
+        try:
+            for frame in self._decode(buffers):
+                self._queue.put(frame)
+        except Exception as e:
+            self._queue.put(e)
+        finally:
+            self._queue.put(_END_OF_STREAM)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        if self.prefetch <= 0:
+            yield from self._decode(self._new_buffers(1))
+            return
+
+        # A buffer can be in the queue, held by the decode thread or held by the consumer, hence
+        # `prefetch + 2` buffers make sure a frame is never overwritten while still in use
+        self._queue = queue.Queue(self.prefetch)
+        self._thread = Thread(target=self._run_decode_thread,
+                              args=(self._new_buffers(self.prefetch + 2),),
+                              daemon=True)
+        self._thread.start()
+        while True:
+            frame = self._queue.get()
+            if frame is _END_OF_STREAM:
+                break
+            if isinstance(frame, Exception):
+                self._thread.join()
+                self._thread = None
+                raise frame
+            yield frame
+        self._thread.join()
+        self._thread = None
+
+    def read_all(self, to_rgb: bool = False) -> np.ndarray:
+        """
+        Read the remaining (selected) frames into a single array of shape (N, height, width, 3),
+        allocated once from the frame count of the video instead of stacked from a list of frames.
+
+        :param to_rgb:
+            Convert the frames from BGR to RGB while copying them
+        :return:
+            The array of frames
+        """
+        frames = np.empty((max(self.frame_count, 0), self.height, self.width, 3), dtype=np.uint8)
+        num_frames = 0
+        for frame in self:
+            if num_frames == len(frames):
+                # The frame count of the container was underestimated
+                extra = np.empty((max(len(frames), 1), self.height, self.width, 3), dtype=np.uint8)
+                frames = np.concatenate((frames, extra))
+            if to_rgb:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frames[num_frames])
+            else:
+                frames[num_frames] = frame
+            num_frames += 1
+
+        return frames[:num_frames]
+
+    def windows(self, size: int, step: int = 1) -> Iterator[np.ndarray]:
+        """
+        Iterate over windows of consecutive (strided) frames.
+
+        The yielded array of shape (size, height, width, 3) is reused from one window to the next,
+        so copy it if it has to be kept around.
+
+        :param size:
+            Number of frames per window
+        :param step:
+            Number of frames between the start of two consecutive windows
+        """
+        if size < 1 or step < 1:
+            raise ValueError(f"Window size and step should be positive integers, got {size} and {step}")
+
+        window = np.empty((size, self.height, self.width, 3), dtype=np.uint8)
+        filled = 0
+        to_skip = 0
+        for frame in self:
+            if to_skip > 0:
+                to_skip -= 1
+                continue
+            window[filled] = frame
+            filled += 1
+            if filled == size:
+                yield window
+                if step < size:
+                    # Shift the overlapping frames to the front of the window
+                    window[:size - step] = window[step:]
+                    filled = size - step
+                else:
+                    filled = 0
+                    to_skip = step - size
+
+
+def count_frames(path_in: str, exact: bool = False) -> int:
+    """
+    Number of frames of a video. The frame count stored in the container (`PROP_ID_FRAME_COUNT`)
+    is exact for the containers that index every frame (`INDEXED_CONTAINERS`), and only estimated
+    from the duration for the others, whose frames are counted by grabbing them all instead (which
+    decodes the whole video, as the FFmpeg backend decodes on `grab`).
+
+    :param path_in:
+        Path to the video file
+    :param exact:
+        Always count the frames by grabbing them, even when the container frame count is exact
+    :return:
+        The number of frames in the video
+    """
+    cap = open_capture(path_in)
+    num_frames = int(cap.get(PROP_ID_FRAME_COUNT))
+    if exact or num_frames <= 0 or os.path.splitext(path_in)[1].lower() not in INDEXED_CONTAINERS:
+        count("count_frames.grab")
+        num_frames = 0
+        while cap.grab():
+            num_frames += 1
+    cap.release()
+
+    return num_frames